@@ -1,6 +1,6 @@
 from items import ItemTable
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 
 # GUI部分
 class ItemManagerGUI:
@@ -79,10 +79,29 @@ class ItemManagerGUI:
 
         tk.Button(frame_search, text='查找', command=self.search_item).grid(row=0, column=3, padx=5)
         tk.Button(frame_search, text='显示全部', command=self.refresh_list).grid(row=0, column=4, padx=5)
+        tk.Button(frame_search, text='导出Excel', command=self.export_excel).grid(row=0, column=5, padx=5)
 
         frame_search.columnconfigure(1, weight=1)
 
         self.refresh_list()
+        self.periodic_sync()
+
+    def periodic_sync(self):
+        '''
+        每秒把还未落盘的操作 fsync 一次，空闲时写入的操作也不会长时间停留在缓存中
+        '''
+        self.table.sync()
+        self.root.after(1000, self.periodic_sync)
+
+    def export_excel(self):
+        '''
+        导出当前有效物品到 Excel
+        '''
+        path = filedialog.asksaveasfilename(defaultextension='.xlsx', filetypes=[('Excel', '*.xlsx')])
+        if not path:
+            return
+        self.table.export_excel(path)
+        messagebox.showinfo('提示', '导出成功')
 
     def add_item(self):
         '''
@@ -155,25 +174,25 @@ class ItemManagerGUI:
             messagebox.showwarning('警告', '请输入搜索关键字')
             return
         
-        found = []
-        for item in self.table.item_list:
-            
-            # 对于记为0的不用管
-            if not item.valid:
-                continue
-
-            if field == 'item id':
-                # 输入必须是整型
-                if item.item_id == int(keyword):
-                    found.append(item)
-                else:
-                    messagebox.showinfo('警告', '按id查找时必须输入整数')
-            elif field == 'item name' and keyword in item.item_name:
-                found.append(item)
-            elif field == 'item description' and keyword in item.item_description:
-                found.append(item)
-            elif field == 'contact information' and keyword in item.contact_info:
-                found.append(item)
+        # 查找选项对应的物品属性
+        fields = {
+            'item id': 'item_id',
+            'item name': 'item_name',
+            'item description': 'item_description',
+            'contact information': 'contact_info'
+        }
+        if field not in fields:
+            messagebox.showwarning('警告', '请选择查找的属性')
+            return
+        if field == 'item id':
+            # 输入必须是整型
+            if not keyword.isdigit():
+                messagebox.showinfo('警告', '按id查找时必须输入整数')
+                return
+            keyword = int(keyword)
+
+        # 通过 id 字典和倒排索引查找，不再逐个扫描
+        found = self.table.search(fields[field], keyword)
         if not found:
             messagebox.showinfo('提示', '没有找到匹配的物品')
             # 显示全部的物品
@@ -231,10 +250,14 @@ class ItemManagerGUI:
 
 
 if __name__ == '__main__':
+    import gc
     import logging
     logging.basicConfig(level=logging.INFO)
 
     table = ItemTable()
+    # 启动时加载的物品表是大量长期存在的对象，一次性移出循环垃圾回收的扫描范围，
+    # 否则查找结果创建大量 Item 时触发的完整回收每次都要遍历整张表；之后创建的对象仍正常回收
+    gc.freeze()
 
     root = tk.Tk()
     gui = ItemManagerGUI(root, table)
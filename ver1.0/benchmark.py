@@ -0,0 +1,125 @@
+'''
+ItemTable 查找性能基准
+创建 --items 个物品，每个修改 --revisions 次，然后比较:
+    id 查找:   id 字典  vs  逐个扫描列表
+    子串查找: 倒排索引  vs  逐个扫描列表 (与改进前的 find_item / GUI.search_item 相同)
+同时核对两种方式的查找结果一致
+存储使用不落盘的空后端，只测量内存中的数据结构
+用法:
+    python benchmark.py
+    python benchmark.py --items 100000 --revisions 10 --queries 200
+'''
+import time
+import random
+import logging
+import argparse
+import statistics
+from items import ItemTable
+from storage import ItemStorage, state_to_columns
+
+NAMES = ['手机', '笔记本电脑', '平板电脑', '耳机', '背包', '台灯', '自行车', '教材', '显示器', '键盘',
+         '鼠标', '电饭煲', '吉他', '篮球', '羽毛球拍', '行李箱', '书架', '电风扇', '充电宝', '相机']
+WORDS = ['九成新', '自用', '有划痕', '送充电器', '原价购入', '毕业出', '可小刀', '几乎没用过', '学校发的',
+         '外观完好', '功能正常', '电池健康', '附说明书', '宿舍自提', '包邮', '急出', '二手网站买来的']
+DOMAINS = ['fudan.edu.cn', 'sjtu.edu.cn', 'qq.com', '163.com', 'gmail.com']
+
+
+class NullStorage(ItemStorage):
+    '''不落盘的存储后端'''
+    def load(self):
+        return 0, state_to_columns({})
+
+    def append(self, op):
+        pass
+
+    def close(self):
+        pass
+
+
+def random_item(rng: random.Random) -> tuple[str, str, str]:
+    name = rng.choice(NAMES) + str(rng.randint(1, 999))
+    desc = '，'.join(rng.sample(WORDS, 3))
+    if rng.random() < 0.5:
+        contact = '1' + ''.join(rng.choice('0123456789') for _ in range(10))
+    else:
+        contact = f'{rng.randint(1000, 99999)}@{rng.choice(DOMAINS)}'
+    return name, desc, contact
+
+
+def scan(items, field, keyword):
+    '''改进前的做法：逐个检查列表中的物品'''
+    if field == 'item_id':
+        return [item for item in items if item.item_id == keyword]
+    return [item for item in items if keyword in getattr(item, field)]
+
+
+def timed(func, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def summary(ms: list[float]) -> str:
+    ms = sorted(ms)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    return f'p50 {statistics.median(ms):8.3f}ms   p95 {p95:8.3f}ms'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ItemTable 查找性能基准')
+    parser.add_argument('--items', type=int, default=100000)
+    parser.add_argument('--revisions', type=int, default=10, help='每个物品修改的次数')
+    parser.add_argument('--queries', type=int, default=200, help='每类查找的次数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)      # ItemTable 的每次创建、修改、删除都会输出 INFO 日志
+    rng = random.Random(args.seed)
+
+    table = ItemTable(storage=NullStorage())
+    start = time.perf_counter()
+    for _ in range(args.items):
+        table.create_new_item(*random_item(rng))
+    created = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(args.revisions):
+        for item_id in range(1, args.items + 1):
+            name, desc, contact = random_item(rng)
+            table.revise_item(item_id, name=name, description=desc, contact=contact)
+    revised = time.perf_counter() - start
+    total_ops = args.items * args.revisions
+    print(f'创建 {args.items} 个物品: {created:.2f}s    修改 {total_ops} 次: {revised:.2f}s '
+          f'({revised / max(total_ops, 1) * 1e6:.1f}us/次)')
+
+    # 倒排索引在第一次按某个属性查找时建立，先建好再计时
+    start = time.perf_counter()
+    for field in ItemTable.TEXT_FIELDS:
+        table.search(field, '_')
+    print(f'建立倒排索引: {time.perf_counter() - start:.2f}s')
+
+    items = table.item_list
+    queries = {
+        'item_id': [rng.randint(1, args.items) for _ in range(args.queries)],
+        'item_name (1字)': ('item_name', [rng.choice(rng.choice(NAMES)) for _ in range(args.queries)]),
+        'item_name': ('item_name', [rng.choice(NAMES) + str(rng.randint(1, 99)) for _ in range(args.queries)]),
+        'item_description': ('item_description', [rng.choice(WORDS)[:3] for _ in range(args.queries)]),
+        'contact_info': ('contact_info', [str(rng.randint(1000, 9999)) for _ in range(args.queries)]),
+    }
+    print(f'{"查找":<18} {"索引":<36} {"逐个扫描":<36} 加速比  平均结果数')
+    for label, spec in queries.items():
+        field, keywords = ('item_id', spec) if label == 'item_id' else spec
+        index_ms, scan_ms, hits = [], [], 0
+        for keyword in keywords:
+            t_index, found = timed(table.search, field, keyword)
+            t_scan, expected = timed(scan, items, field, keyword)
+            if sorted(i.item_id for i in found) != sorted(i.item_id for i in expected):
+                raise AssertionError(f'索引查找结果与扫描不一致: {field}={keyword!r}')
+            index_ms.append(t_index)
+            scan_ms.append(t_scan)
+            hits += len(found)
+        speedup = statistics.median(scan_ms) / max(statistics.median(index_ms), 1e-6)
+        print(f'{label:<18} {summary(index_ms):<36} {summary(scan_ms):<36} {speedup:6.1f}x  {hits / len(keywords):.0f}')
+    print(f'注: 改进前修改过的旧版本仍留在列表中，扫描的列表会是 {args.items * (args.revisions + 1)} 项，而不是这里的 {len(items)} 项')
+
+
+if __name__ == '__main__':
+    main()
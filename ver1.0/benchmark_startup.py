@@ -0,0 +1,125 @@
+'''
+ItemTable 启动性能基准：比较改进前后的载入方式
+    旧: pd.read_excel 后 df.iterrows() 逐行创建 Item，每个 Item 输出一条 INFO 日志
+    新: pd.read_excel 后整列转换为列存储 (frame_to_columns)，Item 只在需要时创建
+另外测量默认的操作日志后端 (快照) 的启动时间，以及第一次查找时建立倒排索引的时间
+日志写到 os.devnull，只计算日志格式化和写出的开销，不刷屏
+用法:
+    python benchmark_startup.py
+    python benchmark_startup.py --rows 100000 --skip-excel    # 不生成/解析 xlsx，只比较 DataFrame 之后的部分
+'''
+import os
+import time
+import random
+import logging
+import argparse
+import tempfile
+import pandas as pd
+from pathlib import Path
+from items import Item, ItemTable
+from storage import ItemStorage, LogStorage, frame_to_columns
+from benchmark import random_item
+
+
+class FrameStorage(ItemStorage):
+    '''从内存中的 DataFrame 载入，不读写文件'''
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+
+    def load(self):
+        return frame_to_columns(self.df)
+
+    def append(self, op):
+        pass
+
+    def close(self):
+        pass
+
+
+def legacy_load(df: pd.DataFrame) -> list[Item]:
+    '''改进前 ItemTable._load 的做法'''
+    item_list = []
+    for _, row in df.iterrows():
+        item_list.append(Item(
+            int(row['item id']),
+            str(row['item name']),
+            str(row['item description']),
+            str(row['contact information']),
+            valid=1
+        ))
+        logging.info(f'new item: {row["item name"]}, created!')     # 改进前 Item 构造时输出的日志
+    return item_list
+
+
+def make_frame(rows: int, seed: int) -> pd.DataFrame:
+    rng = random.Random(seed)
+    data = [random_item(rng) for _ in range(rows)]
+    return pd.DataFrame({
+        'current num': rows,
+        'item id': range(1, rows + 1),
+        'item name': [d[0] for d in data],
+        'item description': [d[1] for d in data],
+        'contact information': [d[2] for d in data]
+    })
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ItemTable 启动性能基准')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-excel', action='store_true', help='不生成和解析 xlsx (两种方式解析 Excel 的开销相同)')
+    args = parser.parse_args()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.FileHandler(os.devnull))
+    root.setLevel(logging.INFO)
+
+    df = make_frame(args.rows, args.seed)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        if not args.skip_excel:
+            xlsx = Path(tmp) / 'database.xlsx'
+            df.to_excel(xlsx, index=False)
+            t, df = timed(pd.read_excel, xlsx)
+            results.append(('pd.read_excel (两种方式相同)', t))
+
+        t, old_items = timed(legacy_load, df)
+        results.append(('旧: iterrows + Item + INFO 日志', t))
+        t, table = timed(ItemTable, None, FrameStorage(df))
+        results.append(('新: 整列转换为列存储', t))
+        if len(old_items) != len(table.rows):
+            raise AssertionError('两种方式载入的物品数不一致')
+
+        t, _ = timed(table.search, 'item_name', '电脑')
+        results.append(('新: 第一次按名称查找 (建立索引)', t))
+        t, _ = timed(table.search, 'item_name', '耳机')
+        results.append(('新: 之后的按名称查找', t))
+
+        # 操作日志后端：写一份快照，再测量从快照启动
+        log_dir = Path(tmp) / 'data'
+        storage = LogStorage(log_dir)
+        storage.load()
+        storage.state = {item_id: (name, desc, contact) for item_id, name, desc, contact in
+                         zip(table.ids, table.names, table.descriptions, table.contacts)}
+        storage.close()
+        t, log_table = timed(ItemTable, None, LogStorage(log_dir))
+        results.append(('新: 从操作日志快照启动', t))
+        log_table.storage.close()
+
+    print(f'{args.rows} 行')
+    for label, seconds in results:
+        print(f'{label:<36} {seconds:8.3f}s')
+    legacy = dict(results)['旧: iterrows + Item + INFO 日志']
+    columnar = dict(results)['新: 整列转换为列存储']
+    print(f'载入 (不含 Excel 解析) 加速 {legacy / max(columnar, 1e-9):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
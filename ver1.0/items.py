@@ -1,6 +1,7 @@
 import logging
-import pandas as pd
 from pathlib import Path
+from storage import ItemStorage, LogStorage, write_excel
+from ngram_index import NgramIndex
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 DATABASE_PATH = Path(r'database.xlsx')
@@ -27,8 +28,7 @@ class Item():
         self.item_description: str = item_description
         self.contact_info: str = contact_info
         self.valid = valid
-
-        logging.info(f'new item: {item_name}, created!')
+        # Item 只是 ItemTable 中某一行的视图，显示和查找时会大量创建，因此不再逐个输出日志
 
     def to_dict(self):
         '''
@@ -43,52 +43,96 @@ class Item():
 
 # 存储所有物品信息的表
 class ItemTable():
-    def __init__(self, db_path: Path = DATABASE_PATH):
-        self.item_list: list[Item] = []         
+    # 建立倒排索引的文本属性 → 对应的列
+    TEXT_FIELDS = {'item_name': 'names', 'item_description': 'descriptions', 'contact_info': 'contacts'}
+
+    def __init__(self, db_path: Path = DATABASE_PATH, storage: ItemStorage = None):
+        '''
+        物品按列存放 (ids / names / descriptions / contacts 四个列表的同一位置是一行)，
+        修改物品时在末尾追加新的一行，Item 对象只在需要时 (显示、查找结果) 才根据行创建
+        Args:
+            db_path: Excel 文件路径，只用于首次启动时导入和导出
+            storage: 存储后端，默认为 data 目录下的操作日志 (LogStorage)；传入 ExcelStorage 则沿用旧的 Excel 存储
+        '''
+        self.ids: list[int] = []
+        self.names: list[str] = []
+        self.descriptions: list[str] = []
+        self.contacts: list[str] = []
+        self.rows: dict[int, int] = {}          # item id → 最新版本所在的行，按创建/修改的先后排列
+        self.indexes: dict[str, NgramIndex] = {}        # 倒排索引，第一次按该属性查找时才建立
         self.current_num: int = 0
         self.db_path = db_path
-        self._init_db()
+        self.storage = storage if storage is not None else LogStorage(import_from=db_path)
         self._load()
 
-    def _init_db(self):
+    @property
+    def item_list(self) -> list[Item]:
         '''
-        如果数据库不存在就初始化一个
+        当前有效的物品 (修改过的物品只保留最新版本)
         '''
-        if not self.db_path.exists():
-            self.df = pd.DataFrame(columns=[
-                'current num', 'item id', 'item name',
-                'item description', 'contact information'
-            ])
-            self.df.to_excel(self.db_path, index=False)
+        return [self._item(row) for row in self.rows.values()]
 
     def _load(self):
         '''
-        载入数据
+        从存储后端载入数据，直接接管后端给出的整列数据，不逐行创建 Item
         '''
-        self.df = pd.read_excel(self.db_path)
-        
-        # 读取当前编号
-        if not self.df.empty and 'current num' in self.df.columns and pd.notna(self.df.iloc[0]['current num']):
-            self.current_num = int(self.df.iloc[0]['current num'])
-        else:
-            self.current_num = 0
-        
-        # 读取数据库，创建item
-        self.item_list = []
+        self.current_num, columns = self.storage.load()
+        self.ids = columns['item id']
+        self.names = columns['item name']
+        self.descriptions = columns['item description']
+        self.contacts = columns['contact information']
+        self.rows = dict(zip(self.ids, range(len(self.ids))))
+        self.indexes = {}
+
+    def _item(self, row: int) -> Item:
+        return Item(self.ids[row], self.names[row], self.descriptions[row], self.contacts[row])
 
-        # 空表格，item_list保持空列表
-        if self.df.empty:
-            return  
+    def _index(self, field: str) -> NgramIndex:
+        '''
+        取某个属性的倒排索引，还没有时用当前的行建立
+        '''
+        index = self.indexes.get(field)
+        if index is None:
+            index = self.indexes[field] = NgramIndex()
+            column = getattr(self, self.TEXT_FIELDS[field])
+            for item_id, row in self.rows.items():
+                index.add(item_id, column[row])
+        return index
+
+    def _put(self, item_id: int, name: str, description: str, contact: str) -> int:
+        '''
+        追加一行作为物品的最新版本并更新已建立的索引；替换的物品移到末尾，返回新行的位置
+        '''
+        old_row = self.rows.pop(item_id, None)
+        if old_row is not None:
+            self._unindex(item_id, old_row)
+        row = len(self.ids)
+        self.ids.append(item_id)
+        self.names.append(name)
+        self.descriptions.append(description)
+        self.contacts.append(contact)
+        self.rows[item_id] = row
+        for field, index in self.indexes.items():
+            index.add(item_id, getattr(self, self.TEXT_FIELDS[field])[row])
+        self._compact_columns()
+        return self.rows[item_id]
 
-        # 非空表格，逐行创建 Item
-        for _, row in self.df.iterrows():
-            self.item_list.append(Item(
-                int(row['item id']),
-                str(row['item name']),
-                str(row['item description']),
-                str(row['contact information']),
-                valid=1  # 读入时都是有效的
-            ))
+    def _unindex(self, item_id: int, row: int) -> None:
+        for field, index in self.indexes.items():
+            index.remove(item_id, getattr(self, self.TEXT_FIELDS[field])[row])
+
+    def _compact_columns(self) -> None:
+        '''
+        被修改或删除的旧行超过一半时重建各列，只保留最新版本 (均摊到每次修改是常数时间)
+        '''
+        if len(self.ids) < 1024 or len(self.ids) < 2 * len(self.rows):
+            return
+        rows = list(self.rows.values())
+        self.ids = [self.ids[row] for row in rows]
+        self.names = [self.names[row] for row in rows]
+        self.descriptions = [self.descriptions[row] for row in rows]
+        self.contacts = [self.contacts[row] for row in rows]
+        self.rows = dict(zip(self.ids, range(len(self.ids))))
 
     def create_new_item(self,
                         item_name: str,
@@ -103,16 +147,10 @@ class ItemTable():
         self.current_num += 1
         logging.info(f'trying to create item with id: {self.current_num}')
         new_item = Item(self.current_num, item_name, item_description, contact_info)
-        self.item_list.append(new_item)
-
-        # 将新的一行写入数据库
-        new_row = pd.DataFrame([{
-            'current num': self.current_num,
-            **new_item.to_dict()
-        }])
-        with pd.ExcelWriter(self.db_path, mode='a', engine='openpyxl', if_sheet_exists='overlay') as writer:
-            new_row.to_excel(writer, index=False, header=False, startrow=writer.sheets['Sheet1'].max_row)
+        self._put(new_item.item_id, new_item.item_name, new_item.item_description, new_item.contact_info)
 
+        # 将新的物品写入数据库
+        self.storage.append({'op': 'create', 'current num': self.current_num, **new_item.to_dict()})
 
         # 后台日志
         logging.info(f'\t created an item with id: {new_item.item_id} \n'
@@ -134,46 +172,33 @@ class ItemTable():
             contact: 修改后的联系人信息
         '''
         logging.info(f'trying to revise item with id: {item_id} ...')
-        for item in self.item_list:
-            if item.item_id == item_id and item.valid == 1:
-                item.valid = 0           # 标记旧物品无效
-
-                # 创建新物品（继承 item_id）
-                new_item = Item(
-                    item_id=item.item_id,
-                    item_name=name if name else item.item_name,
-                    item_description=description if description else item.item_description,
-                    contact_info=contact if contact else item.contact_info,
-                    valid=1
-                )
-                self.item_list.append(new_item)
+        row = self.rows.get(item_id)
+        if row is None:
+            return None
 
-                # 新物品写入Excel
-                new_row = pd.DataFrame([{
-                    'current num': self.current_num,
-                    **new_item.to_dict()
-                }])
-                with pd.ExcelWriter(self.db_path, mode='a', engine='openpyxl', if_sheet_exists='overlay') as writer:
-                    new_row.to_excel(writer, index=False, header=False, startrow=writer.sheets['Sheet1'].max_row)
+        # 追加继承 item_id 的新行，替换旧行
+        row = self._put(
+            item_id,
+            name if name else self.names[row],
+            description if description else self.descriptions[row],
+            contact if contact else self.contacts[row]
+        )
+        new_item = self._item(row)
 
-                return new_item
-        return None
+        # 新物品写入数据库
+        self.storage.append({'op': 'revise', 'current num': self.current_num, **new_item.to_dict()})
+        return new_item
     
     # 删除物品
     def delete_item(self, item_id: int) -> None:
         logging.info(f'trying to delete item with id: {item_id} ...')
-        is_find = False
-        for item in self.item_list:
-            if item.item_id == item_id:
-                item.valid = 0      # 逻辑删除，性能更强
-                logging.info(f'item with id: {item_id} has been deleted!')
-                is_find = True
-                break
-            else:
-                continue
-        
-        if not is_find:
+        row = self.rows.pop(item_id, None)
+        if row is None:
             logging.info(f'couldn\'t find item with id: {item_id}, please check it again!')
+            return
+        self._unindex(item_id, row)
+        self.storage.append({'op': 'delete', 'item id': item_id})     # 立即记录，崩溃后不会丢失
+        logging.info(f'item with id: {item_id} has been deleted!')
 
     # 显示物品列表
     def display_list(self, items: list[Item]=None) -> list[Item]:
@@ -208,16 +233,7 @@ class ItemTable():
             return None
         
         else:
-            found_items = []
-            for item in self.item_list:
-                if finding_info == 'item_id' and item.item_id == finding_info_value:
-                    found_items.append(item)
-                elif finding_info == 'item_name' and finding_info_value in item.item_name:
-                    found_items.append(item)
-                elif finding_info == 'item_description' and finding_info_value in item.item_description:
-                    found_items.append(item)
-                elif finding_info == 'contact_info' and finding_info_value in item.contact_info:
-                    found_items.append(item)
+            found_items = self.search(finding_info, finding_info_value)
             if found_items == []:
                 logging.info(f'find none items with specific attribution, try other keywords!')
                 self.display_list()
@@ -225,24 +241,59 @@ class ItemTable():
                 self.display_list(found_items)
                 return found_items
     
+    def search(self, field: str, keyword) -> list[Item]:
+        '''
+        按 id 精确查找，或在文本属性中查找包含 keyword 的物品 (模糊查找)，结果按创建/修改的先后排列
+        Args:
+            field: 'item_id' 或 TEXT_FIELDS 中的属性
+            keyword: 查找的 id 或子串
+        '''
+        if field == 'item_id':
+            row = self.rows.get(keyword)
+            return [self._item(row)] if row is not None else []
+        if not keyword:
+            return self.item_list
+
+        # 倒排索引给出候选，再确认确实包含子串；行号越大越晚修改，按行号排序即按先后排列
+        rows = sorted(self.rows[item_id] for item_id in self._index(field).candidates(keyword))
+        if len(keyword) > 1:
+            column = getattr(self, self.TEXT_FIELDS[field])
+            rows = [row for row in rows if keyword in column[row]]
+        return [self._item(row) for row in rows]
+
     def get_all_items(self):
         '''
         获取当前有效的物品
         '''
-        return [item for item in self.item_list if item.valid == 1]
+        return self.item_list
         
-    def save_and_close(self):
+    def sync(self):
         '''
-        关闭程序，只保存valid=1的物品
+        将已写入的操作落盘
         '''
-        valid_items = self.get_all_items()
-        rows = [{
-            'current num': self.current_num,
-            **item.to_dict()
-        } for item in valid_items]
+        self.storage.sync()
 
-        new_df = pd.DataFrame(rows)
-        new_df.to_excel(self.db_path, index=False)
+    def export_excel(self, path: Path = None):
+        '''
+        按 database.xlsx 的格式导出当前有效的物品
+        Args:
+            path: 导出路径，默认为 db_path
+        '''
+        path = Path(path) if path is not None else self.db_path
+        rows = list(self.rows.values())
+        write_excel(path, self.current_num, {
+            'item id': [self.ids[row] for row in rows],
+            'item name': [self.names[row] for row in rows],
+            'item description': [self.descriptions[row] for row in rows],
+            'contact information': [self.contacts[row] for row in rows]
+        })
+        logging.info(f'exported {len(rows)} items to {path}')
+
+    def save_and_close(self):
+        '''
+        关闭程序，由存储后端完成最后的写回 (操作日志压缩为快照 / Excel 重写)
+        '''
+        self.storage.close()
         print('数据已保存，程序关闭。')
 
 
@@ -0,0 +1,64 @@
+# 字符二元组倒排索引，用于子串查找
+class NgramIndex():
+    '''
+    每段文本拆成相邻两个字符组成的二元组 (末尾补一个结束符，使单个字符的文本也有二元组)，
+    记录 {二元组: 包含它的 key 的集合}
+    查找长度 >= 2 的关键字时取各二元组集合的交集，只需在候选中确认子串；
+    查找单个字符时取以该字符开头的二元组集合的并集，结果是精确的
+    '''
+    END = '\x00'
+
+    def __init__(self):
+        self.postings: dict[str, set] = {}
+        self.grams_by_char: dict[str, set[str]] = {}     # 首字符 → 以它开头的二元组
+
+    def _grams(self, text: str) -> set[str]:
+        text = text + self.END
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def add(self, key, text: str) -> None:
+        for gram in self._grams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = set()
+                self.grams_by_char.setdefault(gram[0], set()).add(gram)
+            posting.add(key)
+
+    def remove(self, key, text: str) -> None:
+        for gram in self._grams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                continue
+            posting.discard(key)
+            if not posting:
+                del self.postings[gram]
+                grams = self.grams_by_char[gram[0]]
+                grams.discard(gram)
+                if not grams:
+                    del self.grams_by_char[gram[0]]
+
+    def candidates(self, keyword: str) -> set:
+        '''
+        返回可能包含 keyword 的 key 集合；keyword 多于一个字符时，调用方还需确认子串
+        '''
+        if len(keyword) == 1:
+            result = set()
+            for gram in self.grams_by_char.get(keyword, ()):
+                result |= self.postings[gram]
+            return result
+
+        postings = []
+        for i in range(len(keyword) - 1):
+            posting = self.postings.get(keyword[i:i + 2])
+            if posting is None:
+                return set()
+            postings.append(posting)
+
+        # 从最小的集合开始求交集，结果只会越来越小
+        postings.sort(key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result &= posting
+        return result
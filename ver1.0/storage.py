@@ -0,0 +1,273 @@
+import os
+import json
+import time
+import logging
+from abc import ABC, abstractmethod
+import pandas as pd
+from pathlib import Path
+
+COLUMNS = ['current num', 'item id', 'item name', 'item description', 'contact information']
+LOG_DIR = Path(r'data')
+
+
+# 存储后端的公共接口
+class ItemStorage(ABC):
+    '''
+    物品表的存储后端，ItemTable 的每次增删改都以一条操作记录交给后端
+    操作记录是字典: {'op': 'create'/'revise'/'delete', 'current num': ..., 'item id': ..., 'item name': ..., ...}
+    create/revise 记录包含物品修改后的全部字段，delete 只包含 item id
+    '''
+    @abstractmethod
+    def load(self) -> tuple[int, dict[str, list]]:
+        '''
+        返回 (当前编号, 有效物品的列数据 {列名: 列表})，列名为 COLUMNS 中除 current num 外的各列，
+        各列按物品在表中的顺序排列 (最近创建或修改的在后)
+        '''
+
+    @abstractmethod
+    def append(self, op: dict) -> None:
+        '''记录一条操作'''
+
+    def sync(self) -> None:
+        '''将已写入的操作落盘，默认不需要额外操作'''
+
+    @abstractmethod
+    def close(self) -> None:
+        '''完成最后的写回并释放资源'''
+
+
+def _apply(state: dict, op: dict) -> None:
+    '''
+    把一条操作应用到 {item id: (名称, 描述, 联系人)} 上；修改过的物品移到末尾，与 ItemTable 中的顺序一致
+    create/revise 携带完整字段，重复应用同一条操作结果不变
+    '''
+    item_id = op['item id']
+    state.pop(item_id, None)
+    if op['op'] != 'delete':
+        state[item_id] = (op['item name'], op['item description'], op['contact information'])
+
+
+def state_to_columns(state: dict) -> dict[str, list]:
+    '''{item id: (名称, 描述, 联系人)} → 列数据'''
+    values = list(zip(*state.values())) or [(), (), ()]
+    return dict(zip(COLUMNS[1:], [list(state), *map(list, values)]))
+
+
+def columns_to_state(columns: dict[str, list]) -> dict:
+    '''列数据 → {item id: (名称, 描述, 联系人)}'''
+    return dict(zip(columns['item id'], zip(*(columns[key] for key in COLUMNS[2:]))))
+
+
+def read_excel(path: Path) -> tuple[int, dict[str, list]]:
+    '''
+    读取 ver1.0 的 database.xlsx，整列转换而不是逐行构造；
+    同一 item id 出现多次时以最后一行 (最新的修改) 为准，位置也取最后一行
+    '''
+    return frame_to_columns(pd.read_excel(path))
+
+
+def frame_to_columns(df: pd.DataFrame) -> tuple[int, dict[str, list]]:
+    '''
+    database.xlsx 格式的 DataFrame → (当前编号, 列数据)
+    '''
+    current_num = 0
+    if not df.empty and 'current num' in df.columns and pd.notna(df.iloc[0]['current num']):
+        current_num = int(df['current num'].max())
+    df = df.dropna(subset=['item id']).drop_duplicates('item id', keep='last')
+    columns = {'item id': df['item id'].astype('int64').tolist()}
+    for key in COLUMNS[2:]:
+        columns[key] = df[key].astype(str).tolist()
+    return current_num, columns
+
+
+def write_excel(path: Path, current_num: int, columns: dict[str, list]) -> None:
+    '''
+    按 ver1.0 的格式导出到 Excel
+    '''
+    df = pd.DataFrame(columns, columns=COLUMNS[1:])
+    df.insert(0, 'current num', current_num)
+    df.to_excel(path, index=False)
+
+
+# 旧的存储方式：每次修改追加一行到 Excel，删除只在关闭时重写整个表格
+class ExcelStorage(ItemStorage):
+    def __init__(self, db_path: Path):
+        '''
+        Args:
+            db_path: Excel 文件路径
+        '''
+        self.db_path = db_path
+        self.state: dict = {}
+        self.current_num: int = 0
+
+    def load(self):
+        if not self.db_path.exists():
+            write_excel(self.db_path, 0, state_to_columns({}))
+        self.current_num, columns = read_excel(self.db_path)
+        self.state = columns_to_state(columns)
+        return self.current_num, columns
+
+    def append(self, op):
+        _apply(self.state, op)
+        self.current_num = op.get('current num', self.current_num)
+        if op['op'] == 'delete':
+            return      # 删除只在关闭时写回
+        new_row = pd.DataFrame([{key: op[key] for key in COLUMNS}])
+        with pd.ExcelWriter(self.db_path, mode='a', engine='openpyxl', if_sheet_exists='overlay') as writer:
+            new_row.to_excel(writer, index=False, header=False, startrow=writer.sheets['Sheet1'].max_row)
+
+    def close(self):
+        write_excel(self.db_path, self.current_num, state_to_columns(self.state))
+
+
+# 追加写的操作日志 + 定期压缩的快照
+class LogStorage(ItemStorage):
+    def __init__(self,
+                 log_dir: Path = LOG_DIR,
+                 sync_every: int = 32,
+                 sync_interval: float = 1.0,
+                 compact_every: int = 10000,
+                 import_from: Path = None):
+        '''
+        每次修改只在 ops.jsonl 末尾追加一行，代价与数据量无关；
+        启动时读取 snapshot.jsonl 再重放其后的操作，崩溃时写了一半的最后一行会被丢弃
+        Args:
+            log_dir: 快照和操作日志所在目录
+            sync_every: 累积多少条操作后 fsync 一次
+            sync_interval: 距上次 fsync 超过多少秒时，下一次写入立即 fsync
+            compact_every: 操作日志超过多少条时压缩为新快照并清空日志
+            import_from: 目录中还没有数据时，从这个 Excel 文件导入 (用于从旧版本切换)
+        '''
+        self.log_dir = Path(log_dir)
+        self.snapshot_path = self.log_dir / 'snapshot.jsonl'
+        self.log_path = self.log_dir / 'ops.jsonl'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.compact_every = compact_every
+        self.import_from = import_from
+
+        self.state: dict = {}
+        self.current_num: int = 0
+        self.seq: int = 0               # 最后一条操作的序号
+        self.log_count: int = 0         # 操作日志中的条数
+        self.pending: int = 0           # 已写入但还未 fsync 的条数
+        self.last_sync: float = time.monotonic()
+        self.log_file = None
+
+    def load(self):
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        if not self.snapshot_path.exists() and not self.log_path.exists():
+            if self.import_from is not None and Path(self.import_from).exists():
+                self.current_num, columns = read_excel(Path(self.import_from))
+                self.state = columns_to_state(columns)
+                logging.info(f'imported {len(self.state)} items from {self.import_from}')
+            self._write_snapshot()
+
+        self._read_snapshot()
+        self._replay()
+        self.log_file = open(self.log_path, 'a', encoding='utf-8')
+        return self.current_num, state_to_columns(self.state)
+
+    def _read_snapshot(self):
+        with open(self.snapshot_path, encoding='utf-8') as f:
+            meta = json.loads(f.readline())
+            self.current_num = meta['current num']
+            self.seq = meta['seq']
+            self.state = {}
+            for line in f:
+                item_id, name, desc, contact = json.loads(line)
+                self.state[item_id] = (name, desc, contact)
+
+    def _replay(self):
+        '''
+        重放快照之后的操作；最后一行不完整 (崩溃时写了一半) 时截掉，避免后续追加的记录接在坏行后面
+        '''
+        if not self.log_path.exists():
+            return
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        good_end = 0
+        replayed = 0
+        self.log_count = 0
+        while good_end < len(data):
+            line_end = data.find(b'\n', good_end)
+            if line_end == -1:
+                break       # 没有换行符的最后一行必然不完整
+            try:
+                op = json.loads(data[good_end:line_end])
+            except ValueError:
+                if data[line_end + 1:].strip():
+                    raise ValueError(f'{self.log_path} is corrupted at byte {good_end}')
+                break
+            good_end = line_end + 1
+            self.log_count += 1
+            if op['seq'] <= self.seq:
+                continue    # 压缩时快照已包含这条操作
+            _apply(self.state, op)
+            self.current_num = max(self.current_num, op.get('current num', 0))
+            self.seq = op['seq']
+            replayed += 1
+        if good_end < len(data):
+            logging.warning(f'discarded {len(data) - good_end} bytes of incomplete log at the end of {self.log_path}')
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(good_end)
+        logging.info(f'replayed {replayed} operations from {self.log_path}')
+
+    def append(self, op):
+        self.seq += 1
+        op = {'seq': self.seq, **op}
+        _apply(self.state, op)
+        self.current_num = op.get('current num', self.current_num)
+
+        # 每条都 flush 到操作系统，进程崩溃不会丢失；fsync 按批进行，断电时最多丢失一批
+        self.log_file.write(json.dumps(op, ensure_ascii=False) + '\n')
+        self.log_file.flush()
+        self.log_count += 1
+        self.pending += 1
+        if self.pending >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+        if self.log_count >= self.compact_every:
+            self.compact()
+
+    def sync(self):
+        if self.pending and self.log_file is not None:
+            os.fsync(self.log_file.fileno())
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def compact(self):
+        '''
+        把当前状态写成新快照并清空操作日志
+        先写临时文件、fsync 后再原子替换；替换后、清空日志前崩溃时，重放会按序号跳过快照已包含的操作
+        '''
+        self.sync()
+        self._write_snapshot()
+        if self.log_file is not None:
+            self.log_file.close()
+        self.log_file = open(self.log_path, 'w', encoding='utf-8')
+        self.log_count = 0
+        logging.info(f'compacted {len(self.state)} items into {self.snapshot_path}')
+
+    def _write_snapshot(self):
+        tmp_path = self.snapshot_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'current num': self.current_num, 'seq': self.seq}) + '\n')
+            for item_id, row in self.state.items():
+                f.write(json.dumps([item_id, *row], ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if hasattr(os, 'O_DIRECTORY'):
+            # 目录项也要落盘，否则断电后可能仍看到旧快照
+            dir_fd = os.open(self.log_dir, os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def close(self):
+        if self.log_file is None:
+            return
+        self.compact()
+        self.log_file.close()
+        self.log_file = None
@@ -0,0 +1,30 @@
+'''
+冷数据归档
+将售出超过指定天数的物品连同其购买意向和留言分批移入归档库 (默认 second_hand_archive.db)，
+主库的列表和搜索只扫描在线数据；历史视图 (我的意向、"包含已归档") 通过合并视图查询归档库
+可在系统运行时执行，每批一个短事务
+用法:
+    python archive_db.py --days 180
+    python archive_db.py --db second_hand.db --days 30 --batch-size 2000
+'''
+import time
+import argparse
+import database
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将已售出的旧物品归档到归档库")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--days', type=int, default=180, help="售出超过多少天的物品会被归档")
+    parser.add_argument('--batch-size', type=int, default=1000, help="每个事务归档的物品数")
+    args = parser.parse_args()
+    database.DB_FILE = args.db
+
+    from models import ItemManager    # 延迟导入：models 在导入时会对 database.DB_FILE 执行 init_db
+    start = time.perf_counter()
+    counts = ItemManager().archive_sold_items(args.days, args.batch_size)
+    print(f"已归档到 {database.archive_path()}: {counts}，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
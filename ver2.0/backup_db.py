@@ -0,0 +1,353 @@
+'''
+在线备份与恢复
+通过 sqlite3.Connection.backup 分步复制数据库：每步只复制有限的页数，步与步之间休眠，
+备份期间只在每一步内部短暂持有源库的读锁，客户端可以照常读写
+每次备份是备份目录下的一个快照目录 (以时间命名)，包含主库、归档库和 ITEM_IMG 的一代副本：
+    主库与归档库对应同一时刻 (两者之间没有归档事务提交)，恢复时一起写回
+    图片按 (大小, 修改时间) 清单与上一代比较，未变化的文件以硬链接共享，只复制新增或变化的图片；
+    每代目录都是完整的，删除旧快照只会去掉它的链接，仍被其他快照引用的图片不受影响
+备份期间每个数据库有一个探测线程反复获取写锁，报告中的 max_writer_blocked_ms 是实测的写入者最长等待时间
+用法:
+    python backup_db.py backups/
+    python backup_db.py backups/ --db second_hand.db --pages 512 --pause 0.02
+    python backup_db.py --restore backups/20250101_120000
+'''
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+import database
+
+MANIFEST_FILE = 'image_manifest.json'
+PARTIAL_SUFFIX = '.part'
+MAIN_FILE, ARCHIVE_FILE = 'main.db', 'archive.db'      # 快照目录中主库和归档库的文件名
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+class WriterProbe:
+    '''
+    测量备份期间写入者被阻塞的最长时间：后台线程每隔 interval_s 对数据库执行一次 BEGIN EXCLUSIVE / COMMIT，记录获取锁的等待时间
+    EXCLUSIVE 锁就是写入者提交时需要的锁 (回滚日志模式下要等所有读锁释放，WAL 模式下只与其他写入者互斥)；
+    探测事务不修改数据库，不会使分步备份重新开始。等待时间包含 SQLite 忙等待的重试间隔，是偏大的实测值
+    start() 之后开始测量，stop() 之后读取 max_wait_ms
+    '''
+    def __init__(self, path, interval_s=0.005):
+        self.path = path
+        self.interval_s = interval_s
+        self.max_wait_ms = 0.0
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                conn.execute("BEGIN EXCLUSIVE")
+                self.max_wait_ms = max(self.max_wait_ms, (time.perf_counter() - start) * 1000)
+                conn.execute("COMMIT")
+                self.samples += 1
+                self._stop.wait(self.interval_s)
+        finally:
+            conn.close()
+
+
+def online_backup(src_path, dest_path, pages_per_step=256, pause_s=0.01, max_restarts=3) -> Dict:
+    '''
+    分步在线备份 src_path 到 dest_path，返回吞吐量和步长统计
+    备份只在每一步内部持有源库的读锁，回滚日志模式下写入者最多等待一步 (max_step_ms，实测值见 WriterProbe)；
+    WAL 模式下读锁不阻塞写入。若源库在两步之间被其他连接修改，SQLite 会从头重新复制 (记为 restarts)，
+    写入频繁时分步复制可能永远追不上，因此重启超过 max_restarts 次后改为一步复制剩余全部页面
+    '''
+    stats = {'steps': 0, 'restarts': 0, 'max_step_ms': 0.0, 'full_copy_fallback': False}
+    last = {'remaining': None, 'time': 0.0}
+
+    def progress(status, remaining, total):
+        step_ms = (time.perf_counter() - last['time']) * 1000
+        stats['steps'] += 1
+        stats['max_step_ms'] = max(stats['max_step_ms'], step_ms)
+        stats['pages'] = total
+        if last['remaining'] is not None and remaining > last['remaining']:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        last['remaining'] = remaining
+        time.sleep(pause_s)     # 步与步之间不持有锁，让写入者有机会提交
+        last['time'] = time.perf_counter()
+
+    tmp_path = dest_path + '.part'
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(tmp_path)
+    start = time.perf_counter()
+    last['time'] = start
+    try:
+        journal_mode = src.execute("PRAGMA journal_mode").fetchone()[0]
+        try:
+            src.backup(dst, pages=pages_per_step, progress=progress)
+        except _TooManyRestarts:
+            stats['full_copy_fallback'] = True
+            last['time'] = time.perf_counter()
+            src.backup(dst, pages=-1, progress=progress)
+    finally:
+        dst.close()
+        src.close()
+    elapsed = time.perf_counter() - start
+    os.replace(tmp_path, dest_path)     # 备份完成后才出现在目标位置，不会留下半成品
+
+    size = os.path.getsize(dest_path)
+    stats.update({
+        'journal_mode': journal_mode,
+        'bytes': size,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_mb_s': round(size / 1024 / 1024 / elapsed, 2) if elapsed > 0 else None,
+        'max_step_ms': round(stats['max_step_ms'], 3),
+    })
+    return stats
+
+
+def _archive_version(conn) -> int:
+    '''归档库的 data_version：其他连接每提交一次 (包括每个归档事务) 都会变化'''
+    return conn.execute("PRAGMA archive.data_version").fetchone()[0]
+
+
+def consistent_copy(main_path, archive_path, main_dest, archive_dest):
+    '''
+    在同一个读事务中复制主库和归档库，两者为同一时刻的快照
+    读事务持续整个复制过程，回滚日志模式下期间的写入都要等待 (计入 WriterProbe 的实测值)，因此只在分步复制反复追不上归档事务时使用
+    '''
+    conn = sqlite3.connect(main_path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        conn.execute("BEGIN")
+        conn.execute("SELECT COUNT(*) FROM main.sqlite_master").fetchone()      # 同时持有两个库的读锁
+        conn.execute("SELECT COUNT(*) FROM archive.sqlite_master").fetchone()
+        for name, dest_path in (('main', main_dest), ('archive', archive_dest)):
+            dst = sqlite3.connect(dest_path)
+            try:
+                conn.backup(dst, name=name)
+            finally:
+                dst.close()
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def verify(path) -> bool:
+    '''用 PRAGMA integrity_check 校验备份文件'''
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        conn.close()
+    return result == [('ok',)]
+
+
+def _read_manifest(image_dir) -> Dict[str, list]:
+    manifest_path = os.path.join(image_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def snapshot_images(src_dir, dest_dir, previous_dir: Optional[str] = None) -> Dict[str, int]:
+    '''
+    生成图片目录的一代副本 dest_dir：与上一代 previous_dir 的清单比较 (大小, 修改时间)，
+    未变化的文件硬链接到上一代 (文件系统不支持硬链接时复制)，新增或变化的文件复制；
+    源目录中已删除的文件只是不出现在新一代中，上一代仍保留它
+    '''
+    os.makedirs(dest_dir, exist_ok=True)
+    old_manifest = _read_manifest(previous_dir) if previous_dir else {}
+
+    counts = {'copied': 0, 'linked': 0, 'dropped': 0, 'bytes_copied': 0}
+    manifest = {}
+    if os.path.isdir(src_dir):
+        for entry in os.scandir(src_dir):
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            signature = [st.st_size, int(st.st_mtime)]
+            manifest[entry.name] = signature
+            target = os.path.join(dest_dir, entry.name)
+            if old_manifest.get(entry.name) == signature:
+                try:
+                    os.link(os.path.join(previous_dir, entry.name), target)
+                    counts['linked'] += 1
+                    continue
+                except OSError:
+                    pass        # 上一代缺少该文件或不支持硬链接，改为复制
+            shutil.copy2(entry.path, target)
+            counts['copied'] += 1
+            counts['bytes_copied'] += st.st_size
+    counts['dropped'] = sum(1 for name in old_manifest if name not in manifest)
+
+    with open(os.path.join(dest_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    return counts
+
+
+def _latest_snapshot(backup_dir) -> Optional[str]:
+    '''备份目录中最新的完整快照 (未完成的 .part 目录除外)'''
+    snapshots = sorted(entry.name for entry in os.scandir(backup_dir)
+                       if entry.is_dir() and not entry.name.endswith(PARTIAL_SUFFIX)
+                       and os.path.exists(os.path.join(entry.path, database.IMG_DIR, MANIFEST_FILE)))
+    return os.path.join(backup_dir, snapshots[-1]) if snapshots else None
+
+
+def backup(backup_dir, pages_per_step=256, pause_s=0.01, max_restarts=3) -> Dict:
+    '''
+    在 backup_dir 下生成一个快照目录：主库、归档库 (存在时) 和图片目录的一代副本，每个数据库复制后立即校验
+    主库和归档库分别分步复制；若复制期间有归档事务提交 (归档库的 data_version 变化)，两者可能不是同一时刻，
+    重新复制，超过 max_restarts 次后在一个读事务中一次复制两个库
+    快照先写入 .part 目录，全部完成后才改名，未完成的快照不会被恢复或作为下一代图片的基准
+    复制期间 (包括一次复制两个库的情况) 每个数据库由一个 WriterProbe 测量写入者的最长等待时间，记入各库的 max_writer_blocked_ms，
+    报告顶层的 max_writer_blocked_ms 为其中的最大值
+    '''
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    snapshot_dir = os.path.join(backup_dir, stamp)
+    work_dir = snapshot_dir + PARTIAL_SUFFIX
+    os.makedirs(work_dir)
+    sources = [(src_path, os.path.join(work_dir, name))
+               for src_path, name in ((database.DB_FILE, MAIN_FILE), (database.archive_path(), ARCHIVE_FILE))
+               if os.path.exists(src_path)]
+    has_archive = len(sources) == 2
+    report = {'snapshot': snapshot_dir, 'databases': {}, 'archive_retries': 0, 'single_transaction': False}
+
+    probe = None
+    if has_archive:
+        probe = sqlite3.connect(database.DB_FILE)
+        probe.execute("ATTACH DATABASE ? AS archive", (database.archive_path(),))
+    writer_probes = {src_path: WriterProbe(src_path) for src_path, _ in sources}
+    for writer_probe in writer_probes.values():
+        writer_probe.start()
+    try:
+        while True:
+            version = _archive_version(probe) if probe else None
+            for src_path, dest_path in sources:
+                report['databases'][src_path] = online_backup(src_path, dest_path, pages_per_step, pause_s, max_restarts)
+            if probe is None or _archive_version(probe) == version:
+                break
+            if report['archive_retries'] >= max_restarts:
+                consistent_copy(database.DB_FILE, database.archive_path(), sources[0][1], sources[1][1])
+                report['single_transaction'] = True
+                break
+            report['archive_retries'] += 1
+    finally:
+        for writer_probe in writer_probes.values():
+            writer_probe.stop()
+        if probe:
+            probe.close()
+
+    for src_path, dest_path in sources:
+        stats = report['databases'][src_path]
+        stats['max_writer_blocked_ms'] = round(writer_probes[src_path].max_wait_ms, 3)
+        stats['writer_probes'] = writer_probes[src_path].samples
+        stats['path'] = os.path.join(snapshot_dir, os.path.basename(dest_path))
+        stats['integrity_ok'] = verify(dest_path)
+    report['max_writer_blocked_ms'] = max(s['max_writer_blocked_ms'] for s in report['databases'].values())
+    previous = _latest_snapshot(backup_dir)
+    report['images'] = snapshot_images(database.IMG_DIR, os.path.join(work_dir, database.IMG_DIR),
+                                       os.path.join(previous, database.IMG_DIR) if previous else None)
+    os.replace(work_dir, snapshot_dir)
+    return report
+
+
+def _restore_db(backup_path, target_path, pages_per_step, pause_s):
+    src = sqlite3.connect(backup_path)
+    dst = sqlite3.connect(target_path)
+    try:
+        src.backup(dst, pages=pages_per_step, progress=lambda *args: time.sleep(pause_s))
+    finally:
+        dst.close()
+        src.close()
+
+
+def restore(snapshot_dir, pages_per_step=256, pause_s=0.01) -> Dict:
+    '''
+    从快照目录恢复到 database.DB_FILE：先校验快照中的所有数据库，再通过 backup API 写回主库和归档库 (目标库上的其他连接会看到一次完整替换)，
+    最后使图片目录与快照一致 (恢复缺失或变化的图片，删除快照之后新增的图片)
+    快照中没有归档库时 (备份时尚未归档过)，删除现有的归档库；恢复应在系统停止使用时进行，否则两个库写回的间隙中可能读到不一致的数据
+    '''
+    main_backup = os.path.join(snapshot_dir, MAIN_FILE)
+    archive_backup = os.path.join(snapshot_dir, ARCHIVE_FILE)
+    if not os.path.exists(main_backup):
+        raise ValueError(f"快照中没有主库: {main_backup}")
+    pairs = [(main_backup, database.DB_FILE)]
+    if os.path.exists(archive_backup):
+        pairs.append((archive_backup, database.archive_path()))
+    for backup_path, _ in pairs:
+        if not verify(backup_path):
+            raise ValueError(f"备份文件未通过完整性检查: {backup_path}")
+
+    start = time.perf_counter()
+    for backup_path, restore_path in pairs:
+        _restore_db(backup_path, restore_path, pages_per_step, pause_s)
+    if len(pairs) == 1 and os.path.exists(database.archive_path()):
+        os.remove(database.archive_path())
+    images = restore_images(os.path.join(snapshot_dir, database.IMG_DIR), database.IMG_DIR)
+    return {'restored_to': [restore_path for _, restore_path in pairs], 'images': images,
+            'elapsed_s': round(time.perf_counter() - start, 3),
+            'integrity_ok': all(verify(restore_path) for _, restore_path in pairs)}
+
+
+def restore_images(generation_dir, target_dir) -> Dict[str, int]:
+    '''使图片目录与快照中的一代一致：复制缺失或 (大小, 修改时间) 不同的文件，删除快照中没有的文件'''
+    os.makedirs(target_dir, exist_ok=True)
+    manifest = _read_manifest(generation_dir)
+    counts = {'copied': 0, 'unchanged': 0, 'removed': 0}
+    for name, signature in manifest.items():
+        target = os.path.join(target_dir, name)
+        if os.path.exists(target):
+            st = os.stat(target)
+            if [st.st_size, int(st.st_mtime)] == signature:
+                counts['unchanged'] += 1
+                continue
+        shutil.copy2(os.path.join(generation_dir, name), target)
+        counts['copied'] += 1
+    for entry in os.scandir(target_dir):
+        if entry.is_file() and entry.name not in manifest:
+            os.remove(entry.path)
+            counts['removed'] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="二手交易系统在线备份与恢复")
+    parser.add_argument('backup_dir', nargs='?', default='backups', help="备份目录")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--pages', type=int, default=256, help="每步复制的页数")
+    parser.add_argument('--pause', type=float, default=0.01, help="两步之间的休眠时间 (秒)")
+    parser.add_argument('--max-restarts', type=int, default=3, help="源库被修改导致重新复制的次数上限，超过后一步复制完成")
+    parser.add_argument('--restore', metavar='SNAPSHOT_DIR', help="校验并从快照目录恢复 --db、其归档库和图片目录")
+    args = parser.parse_args()
+    database.DB_FILE = args.db
+
+    if args.restore:
+        report = restore(args.restore, args.pages, args.pause)
+    else:
+        report = backup(args.backup_dir, args.pages, args.pause, args.max_restarts)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if not args.restore and not all(s['integrity_ok'] for s in report['databases'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+'''
+规模基准测试
+在不同数据规模 (默认 1k / 100k / 1M 物品) 的合成数据库上，对 ItemManager、UserManager、CategoryManager
+的每个公开方法计时，结果保存为 JSON 基线，可用 --compare 与旧基线对比找出性能回退
+用法:
+    python benchmark.py --scales 1000 100000 1000000 --output bench_data/baseline.json
+    python benchmark.py --scales 1000 --compare bench_data/baseline.json
+'''
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import statistics
+from datetime import datetime
+from typing import Callable, Dict, Tuple
+import database
+import datagen
+
+BENCH_DIR = 'bench_data'
+
+
+class BenchContext:
+    '''
+    基准上下文：保存数据规模信息，并提供 (不计时的) 准备函数，为会修改数据的方法构造独立的目标行
+    '''
+    def __init__(self, db_path, rng: random.Random, managers):
+        self.db_path = db_path
+        self.rng = rng
+        self.user_manager, self.item_manager, self.category_manager = managers
+        self.counter = 0
+        with sqlite3.connect(db_path) as conn:
+            self.user_ids = [r[0] for r in conn.execute("SELECT id FROM users WHERE role = 'user'")]
+            self.usernames = dict(conn.execute("SELECT id, username FROM users"))
+            self.pending_usernames = [r[0] for r in conn.execute("SELECT username FROM users WHERE status = 'pending'")]
+            self.max_item_id = conn.execute("SELECT MAX(id) FROM items").fetchone()[0]
+            self.categories = [r[0] for r in conn.execute("SELECT name FROM categories")]
+
+    def unique(self, prefix) -> str:
+        self.counter += 1
+        return f"{prefix}_{os.getpid()}_{self.counter}"
+
+    def user_id(self) -> int:
+        return self.rng.choice(self.user_ids)
+
+    def username(self) -> str:
+        return self.usernames[self.user_id()]
+
+    def item_id(self) -> int:
+        return self.rng.randint(1, self.max_item_id)
+
+    def category(self) -> str:
+        return self.rng.choice(self.categories)
+
+    def new_item(self, status='active', want_user=None, reserved_by=None, owner_id=None) -> Tuple[int, int]:
+        '''直接插入一个物品 (可选附带一条意向)，返回 (item_id, version)'''
+        with sqlite3.connect(self.db_path) as conn:
+            cur = conn.execute('''
+                INSERT INTO items (name, description, category_id, owner_id, status, price, reserved_by, reserved_until)
+                VALUES (?, '基准测试物品', (SELECT id FROM categories LIMIT 1), ?, ?, 10, ?,
+                        CASE WHEN ? IS NULL THEN NULL ELSE datetime('now', '-1 hours') END)
+            ''', (self.unique('bench_item'), owner_id or self.user_id(), status, reserved_by, reserved_by))
+            item_id = cur.lastrowid
+            if want_user is not None:
+                conn.execute("INSERT INTO item_wants (user_id, item_id) VALUES (?, ?)", (want_user, item_id))
+        return item_id, 0
+
+    def reserved_sales(self, n, owner_id):
+        '''为批量售出构造 n 个属于 owner_id、已预留给某个有意向买家的物品'''
+        sales = []
+        for _ in range(n):
+            buyer = self.user_id()
+            sales.append((self.new_item('reserved', want_user=buyer, reserved_by=buyer, owner_id=owner_id)[0], None))
+        return sales
+
+
+# 每个方法的参数构造函数：ctx -> (args, kwargs)，在计时之外调用
+# 新增管理器方法时在此补充；缺少构造函数的方法会在结果中标记为 skipped
+CASES: Dict[str, Callable[[BenchContext], Tuple[tuple, dict]]] = {
+    # --- UserManager ---
+    'UserManager.authenticate': lambda c: ((c.username(), datagen.SYNTHETIC_PASSWORD), {}),
+    'UserManager.get_user': lambda c: ((c.username(),), {}),
+    'UserManager.register': lambda c: ((c.unique('bench_user'), 'pw', {"address": "", "phone": "", "email": ""}), {}),
+    'UserManager.register_user': lambda c: ((c.unique('bench_user'), 'pw', '', '', ''), {}),
+    'UserManager.get_pending_users': lambda c: ((), {}),
+    'UserManager.get_all_users': lambda c: ((), {}),
+    'UserManager.approve_user': lambda c: ((c.rng.choice(c.pending_usernames) if c.pending_usernames else c.username(),), {}),
+    'UserManager.approve_users': lambda c: ((c.rng.sample(c.pending_usernames, min(100, len(c.pending_usernames))),), {}),
+    'UserManager.approve_all_pending': lambda c: ((), {}),
+    'UserManager.list_users': lambda c: ((), {'status': c.rng.choice([None, 'pending']), 'page': c.rng.randint(0, 3)}),
+    'UserManager.has_admin': lambda c: ((), {}),
+    'UserManager.create_admin': lambda c: ((c.unique('bench_admin'), 'pw'), {}),
+    # --- CategoryManager ---
+    'CategoryManager.get_all': lambda c: ((), {}),
+    'CategoryManager.get_all_categories': lambda c: ((), {}),
+    'CategoryManager.add_category': lambda c: ((c.unique('bench_cat'), ["属性"]), {}),
+    'CategoryManager.get_attributes_for_category': lambda c: ((c.category(),), {}),
+    'CategoryManager.update_category': lambda c: ((c.category(), c.category_manager.get_attributes_for_category(c.categories[0])), {}),
+    'CategoryManager.delete_category': lambda c: ((c.unique('no_such_cat'),), {}),
+    # --- ItemManager ---
+    'ItemManager.create_item': lambda c: (('基准物品', '描述', 10.0, 0, '地点', '', '', c.category(), c.username(), {}), {}),
+    'ItemManager.create_items': lambda c: (([('基准物品', '描述', 1, c.user_id(), 10.0, 0, '地点', '{}', '[]')] * 1000,), {}),
+    'ItemManager.get_import_checkpoint': lambda c: (('bench_source',), {}),
+    'ItemManager.clear_import_checkpoint': lambda c: (('bench_source',), {}),
+    'ItemManager.get_all_items': lambda c: ((), {}),
+    'ItemManager.search_items': lambda c: ((c.rng.choice([None, c.category()]), c.rng.choice(['耳机', '教材', '九成新', '全新', 'erji', '蓝牙'])),
+                                           {'max_price': c.rng.choice([None, None, 50, 200]), 'status': c.rng.choice([None, 'active'])}),
+    'ItemManager.faceted_search': lambda c: ((c.category(), c.rng.choice(['耳机', '教材', '九成新', 'erji'])), {'status': c.rng.choice([None, 'active'])}),
+    'ItemManager.list_items': lambda c: ((c.rng.choice(['price', 'created_at', 'want_count', 'name']), c.rng.random() < 0.5),
+                                         {'category_name': c.rng.choice([None, c.category()]),
+                                          'keyword': c.rng.choice([None, None, '耳机', '九成新']),
+                                          'max_price': c.rng.choice([None, None, 50, 200])}),
+    'ItemManager.similar_items': lambda c: ((c.item_id(),), {}),
+    'ItemManager.find_item_by_id': lambda c: ((c.item_id(),), {}),
+    'ItemManager.delete_item': lambda c: ((c.new_item()[0],), {}),
+    'ItemManager.revise_item': lambda c: ((c.new_item()[0], {'price': 20.0, 'description': '降价'}, 0), {}),
+    'ItemManager.add_want': lambda c: ((c.new_item()[0], c.user_id(), 5.0), {}),
+    'ItemManager.get_item_wanters': lambda c: ((c.item_id(),), {}),
+    'ItemManager.get_user_wants': lambda c: ((c.user_id(),), {}),
+    'ItemManager.get_received_wants': lambda c: ((c.user_id(),), {}),
+    'ItemManager.confirm_sold': lambda c: (lambda buyer: ((c.new_item(want_user=buyer)[0], buyer, 0), {}))(c.user_id()),
+    'ItemManager.reserve_item': lambda c: (lambda buyer: ((c.new_item(want_user=buyer)[0], buyer, 24, 0), {}))(c.user_id()),
+    'ItemManager.release_reservation': lambda c: ((c.new_item('reserved', reserved_by=c.user_id())[0],), {}),
+    'ItemManager.release_expired_reservations': lambda c: ((), {'batch_size': 500}),
+    'ItemManager.archive_sold_items': lambda c: ((), {'older_than_days': 365, 'batch_size': 1000}),
+    'ItemManager.delete_items': lambda c: (([c.new_item()[0] for _ in range(100)], c.user_id(), True), {}),
+    'ItemManager.mark_sold_many': lambda c: (lambda owner: ((c.reserved_sales(100, owner), owner), {}))(c.user_id()),
+    'ItemManager.reprice_many': lambda c: (([c.new_item()[0] for _ in range(100)], 80, c.user_id(), True), {}),
+    'ItemManager.add_message': lambda c: ((c.item_id(), c.user_id(), '基准测试留言'), {}),
+    'ItemManager.get_messages': lambda c: ((c.item_id(),), {}),
+}
+
+
+def _public_methods(manager):
+    owner = type(manager).__name__
+    for name in sorted(dir(type(manager))):
+        if not name.startswith('_') and callable(getattr(manager, name)):
+            yield f"{owner}.{name}", getattr(manager, name)
+
+
+def ensure_dataset(n_items, seed=42) -> str:
+    '''返回指定规模的基准数据库路径，不存在时生成 (用户、意向、留言数量随物品数按比例缩放)'''
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    db_path = os.path.join(BENCH_DIR, f"bench_{n_items}_s{seed}.db")
+    if not os.path.exists(db_path):
+        start = time.perf_counter()
+        counts = datagen.generate_dataset(db_path, n_users=max(100, n_items // 100), n_items=n_items,
+                                          n_wants=n_items // 2, n_messages=n_items // 2, seed=seed)
+        print(f"  生成数据 {counts} 用时 {time.perf_counter() - start:.1f}s")
+    return db_path
+
+
+def run_scale(n_items, repeat=20, budget_s=2.0, seed=42) -> Dict[str, Dict]:
+    '''
+    在一个数据规模上对所有方法计时
+    每个方法最多重复 repeat 次，累计耗时超过 budget_s 后提前停止 (至少执行一次)
+    在数据库副本上运行，保证每次基准的起始数据一致
+    '''
+    source = ensure_dataset(n_items, seed)
+    work_path = source.replace('.db', '.work.db')
+    with sqlite3.connect(source) as src, sqlite3.connect(work_path) as dst:
+        src.backup(dst)
+    database.DB_FILE = work_path
+
+    import models   # 延迟导入：models 在导入时会对 database.DB_FILE 执行 init_db
+    managers = (models.UserManager(), models.ItemManager(), models.CategoryManager())
+    ctx = BenchContext(work_path, random.Random(seed), managers)
+
+    results = {}
+    for manager in managers:
+        for qualified_name, method in _public_methods(manager):
+            case = CASES.get(qualified_name)
+            if case is None:
+                results[qualified_name] = {'skipped': '缺少参数构造函数'}
+                continue
+            samples, rows = [], None
+            spent = 0.0
+            while len(samples) < repeat and (not samples or spent < budget_s):
+                args, kwargs = case(ctx)
+                start = time.perf_counter()
+                result = method(*args, **kwargs)
+                elapsed = time.perf_counter() - start
+                samples.append(elapsed * 1000)
+                spent += elapsed
+                if isinstance(result, list):
+                    rows = len(result)
+            samples.sort()
+            results[qualified_name] = {
+                'runs': len(samples),
+                'min_ms': round(samples[0], 3),
+                'median_ms': round(statistics.median(samples), 3),
+                'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+                'max_ms': round(samples[-1], 3),
+                'rows': rows,
+            }
+            print(f"  {qualified_name:<45} median {results[qualified_name]['median_ms']:>10.3f}ms  runs {len(samples)}")
+    os.remove(work_path)
+    return results
+
+
+def compare(baseline: Dict, current: Dict, threshold=1.25) -> int:
+    '''对比两份基线，打印中位数变化，返回回退 (变慢超过阈值) 的方法数'''
+    regressions = 0
+    for scale, methods in current['results'].items():
+        base_methods = baseline.get('results', {}).get(scale)
+        if not base_methods:
+            continue
+        print(f"\n== {scale} 物品 ==")
+        for name, stats in methods.items():
+            base = base_methods.get(name)
+            if not base or 'median_ms' not in base or 'median_ms' not in stats:
+                continue
+            ratio = stats['median_ms'] / base['median_ms'] if base['median_ms'] > 0 else float('inf')
+            flag = "  <-- 回退" if ratio > threshold else ""
+            regressions += bool(flag)
+            print(f"  {name:<45} {base['median_ms']:>10.3f} -> {stats['median_ms']:>10.3f}ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="二手交易系统规模基准测试")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 100000, 1000000], help="物品数量规模")
+    parser.add_argument('--repeat', type=int, default=20, help="每个方法的最大重复次数")
+    parser.add_argument('--budget', type=float, default=2.0, help="每个方法的计时预算 (秒)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=os.path.join(BENCH_DIR, f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"))
+    parser.add_argument('--compare', help="与之对比的旧基线 JSON 文件")
+    parser.add_argument('--threshold', type=float, default=1.25, help="中位数变慢超过该倍数视为回退")
+    args = parser.parse_args()
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': {},
+    }
+    for n_items in args.scales:
+        print(f"规模: {n_items} 物品")
+        report['results'][str(n_items)] = run_scale(n_items, args.repeat, args.budget, args.seed)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n基准结果已保存到 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
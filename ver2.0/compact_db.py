@@ -0,0 +1,182 @@
+'''
+数据库整理工具 (一次性任务，可在系统运行时执行)
+1. 分批删除悬空记录：物品已被删除的购买意向和留言、回复目标已不存在的留言引用，
+   以及物品已被删除的搜索索引、相似向量、重复检测签名和分桶 (这些表只由 ItemManager 同步，绕过它删除物品时会残留)
+2. 删除 ITEM_IMG 中不再被任何物品引用的图片 (只处理超过宽限期的文件，避免误删正在发布的物品图片)
+3. 增量 VACUUM：每步回收有限的空闲页并短暂休眠，不长时间阻塞其他客户端
+用法:
+    python compact_db.py
+    python compact_db.py --db second_hand.db --batch-size 5000 --vacuum-pages 2000 --dry-run
+'''
+import os
+import time
+import json
+import argparse
+from typing import Dict
+import database
+import search_index
+import similar
+import duplicates
+from database import get_db_connection, write_transaction, managed_image_path, attach_archive
+
+# 每类悬空记录的 (行的键, 查询)：查询返回一批待删除行的键
+# legacy_v1_items 中物品已不存在的行不在此列：它们记录 "已在新系统中删除或归档"，使 migrate_v1 不会重新创建这些物品
+# (ver1.0 中也已删除的由 migrate_v1.py --prune 清除)
+_ORPHAN_QUERIES = {
+    'item_wants': ('id', '''
+        SELECT w.id FROM item_wants w
+        WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.id = w.item_id)
+           OR NOT EXISTS (SELECT 1 FROM users u WHERE u.id = w.user_id)
+        LIMIT ?
+    '''),
+    'messages': ('id', '''
+        SELECT m.id FROM messages m
+        WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.id = m.item_id)
+        LIMIT ?
+    '''),
+    search_index.SEARCH_TABLE: ('rowid', f'''
+        SELECT s.rowid FROM {search_index.SEARCH_TABLE} s
+        WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.id = s.rowid)
+        LIMIT ?
+    '''),
+    similar.VECTORS_TABLE: ('item_id', f'''
+        SELECT v.item_id FROM {similar.VECTORS_TABLE} v
+        WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.id = v.item_id)
+        LIMIT ?
+    '''),
+    duplicates.SIGNATURES_TABLE: ('item_id', f'''
+        SELECT s.item_id FROM {duplicates.SIGNATURES_TABLE} s
+        WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.id = s.item_id)
+        LIMIT ?
+    '''),
+    duplicates.BANDS_TABLE: ('(bucket, item_id)', f'''
+        SELECT b.bucket, b.item_id FROM {duplicates.BANDS_TABLE} b
+        WHERE NOT EXISTS (SELECT 1 FROM items i WHERE i.id = b.item_id)
+        LIMIT ?
+    '''),
+}
+
+
+def remove_orphans(batch_size=5000, dry_run=False) -> Dict[str, int]:
+    '''分批删除悬空的意向、留言和索引行，每批一个短事务，返回各表删除 (或 dry_run 时发现) 的行数'''
+    counts = {}
+    for table, (key, query) in _ORPHAN_QUERIES.items():
+        total = 0
+        if dry_run:
+            conn = get_db_connection()
+            total = len(conn.execute(query, (-1,)).fetchall())
+            conn.close()
+        else:
+            while True:
+                with write_transaction() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(f"DELETE FROM {table} WHERE {key} IN ({query})", (batch_size,))
+                    deleted = cursor.rowcount
+                total += deleted
+                if deleted < batch_size:
+                    break
+        counts[table] = total
+
+    # 被回复的留言已删除时，保留回复本身，只清除引用
+    if dry_run:
+        conn = get_db_connection()
+        counts['dangling_replies'] = conn.execute('''
+            SELECT COUNT(*) FROM messages m
+            WHERE m.reply_to_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM messages p WHERE p.id = m.reply_to_id)
+        ''').fetchone()[0]
+        conn.close()
+    else:
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE messages SET reply_to_id = NULL
+                WHERE reply_to_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM messages p WHERE p.id = messages.reply_to_id)
+            ''')
+            counts['dangling_replies'] = cursor.rowcount
+    return counts
+
+
+def remove_unreferenced_images(grace_seconds=3600, dry_run=False) -> int:
+    '''
+    删除 ITEM_IMG 中没有任何物品引用、且修改时间早于宽限期的图片，返回删除 (或 dry_run 时发现) 的文件数
+    已归档的物品仍引用其图片，因此同时扫描归档库
+    '''
+    if not os.path.isdir(database.IMG_DIR):
+        return 0
+    referenced = set()
+    conn = get_db_connection()
+    table = 'items'
+    if os.path.exists(database.archive_path()):
+        attach_archive(conn)
+        table = 'all_items'
+    cursor = conn.execute(f"SELECT image_paths FROM {table} WHERE image_paths != '[]'")
+    while True:
+        rows = cursor.fetchmany(1000)
+        if not rows:
+            break
+        for r in rows:
+            for path in json.loads(r['image_paths']):
+                local = managed_image_path(path)
+                if local:
+                    referenced.add(os.path.basename(local))
+    conn.close()
+
+    cutoff = time.time() - grace_seconds
+    removed = 0
+    for entry in os.scandir(database.IMG_DIR):
+        if entry.is_file() and entry.name not in referenced and entry.stat().st_mtime < cutoff:
+            if not dry_run:
+                os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+def incremental_vacuum(pages_per_step=1000, pause_s=0.05) -> Dict[str, int]:
+    '''
+    分步回收空闲页
+    旧数据库的 auto_vacuum 为 NONE 时，需要先执行一次完整 VACUUM 才能切换到 INCREMENTAL 模式 (会短暂阻塞写入)，
+    之后每次整理都只需增量回收
+    '''
+    conn = get_db_connection()
+    conn.isolation_level = None
+    converted = 0
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        converted = 1
+    freed = 0
+    free_pages = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free_pages:
+        # sqlite3 的 execute 对该 PRAGMA 只执行一步 (回收一页)，executescript 才会执行到完成
+        conn.executescript(f"PRAGMA incremental_vacuum({pages_per_step});")
+        remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        freed += free_pages - remaining
+        free_pages = remaining
+        time.sleep(pause_s)     # 让出写锁，其他客户端可以在两步之间写入
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    conn.close()
+    return {'converted_to_incremental': converted, 'pages_freed': freed, 'bytes_freed': freed * page_size}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="清理悬空记录和未引用图片，并增量回收数据库空间")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--batch-size', type=int, default=5000, help="每个删除事务处理的行数")
+    parser.add_argument('--vacuum-pages', type=int, default=1000, help="每步增量 VACUUM 回收的页数")
+    parser.add_argument('--image-grace', type=int, default=3600, help="未引用图片至少存在多少秒后才删除")
+    parser.add_argument('--dry-run', action='store_true', help="只统计，不修改")
+    args = parser.parse_args()
+    database.DB_FILE = args.db
+
+    start = time.perf_counter()
+    orphans = remove_orphans(args.batch_size, args.dry_run)
+    print(f"悬空记录: {orphans}")
+    images = remove_unreferenced_images(args.image_grace, args.dry_run)
+    print(f"未引用图片: {images}")
+    if not args.dry_run:
+        print(f"空间回收: {incremental_vacuum(args.vacuum_pages)}")
+    print(f"用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
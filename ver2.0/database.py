@@ -1,18 +1,192 @@
 import sqlite3
 import os
 import json
+from contextlib import contextmanager
+import search_index
+import similar
+import duplicates
 
 DB_FILE = 'second_hand.db'
+IMG_DIR = 'ITEM_IMG'
+
+# 连接扩展点：性能分析等可选功能通过替换连接类、注册钩子来配置每个新连接
+# 默认不注册任何钩子，get_db_connection 没有额外开销
+_connection_factory = sqlite3.Connection
+_connection_hooks = []
+
+def set_connection_factory(factory):
+    '''设置创建连接时使用的 sqlite3.Connection 子类'''
+    global _connection_factory
+    _connection_factory = factory
+
+def add_connection_hook(hook):
+    '''注册连接钩子，每个新连接创建后都会以 hook(conn) 的形式调用'''
+    _connection_hooks.append(hook)
+
+def remove_connection_hook(hook):
+    if hook in _connection_hooks:
+        _connection_hooks.remove(hook)
 
 def get_db_connection():
     '''
     获取数据库连接
     配置 row_factory 以便可以通过列名访问数据
     '''
-    conn = sqlite3.connect(DB_FILE)
+    conn = sqlite3.connect(DB_FILE, factory=_connection_factory)
     conn.row_factory = sqlite3.Row  # 允许通过列名访问数据
+    for hook in _connection_hooks:
+        hook(conn)
     return conn
 
+def archive_path():
+    '''归档库文件路径：与主库同目录，如 second_hand.db -> second_hand_archive.db'''
+    root, ext = os.path.splitext(DB_FILE)
+    return f"{root}_archive{ext or '.db'}"
+
+# 归档的表，以及已确认结构同步过的归档库 (每个进程只检查一次)
+ARCHIVED_TABLES = ('items', 'item_wants', 'messages')
+_archive_schema_ready = set()
+
+def table_columns(conn, table, schema='main') -> list:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+def attach_archive(conn):
+    '''
+    将归档库以 archive 为名附加到连接上 (文件不存在时自动创建)，必须在事务开始前调用
+    归档表的列与主库保持一致 (主库迁移新增的列会同步补齐)，另有 archived_at 记录归档时间；
+    同时创建临时视图 all_items / all_item_wants / all_messages，合并在线数据与归档数据，
+    视图中的 archived 列标记行来自哪个库
+    '''
+    conn.execute("ATTACH DATABASE ? AS archive", (archive_path(),))
+    columns = {table: table_columns(conn, table) for table in ARCHIVED_TABLES}
+
+    key = os.path.abspath(archive_path())
+    if key not in _archive_schema_ready:
+        for table in ARCHIVED_TABLES:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+            existing = set(table_columns(conn, table, 'archive'))
+            for column in columns[table] + ['archived_at']:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column}")
+            if table == 'items' and 'want_count' not in existing:
+                # 早于 want_count 列归档的物品补上想要人数 (之后归档的物品连同该列一起复制)
+                conn.execute('''UPDATE archive.items SET want_count =
+                                (SELECT COUNT(*) FROM archive.item_wants w WHERE w.item_id = archive.items.id)''')
+        # 归档表由 CREATE TABLE AS 创建，没有主键，按查询方式补充索引
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_items_id ON items (id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_items_category ON items (category_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_wants_item ON item_wants (item_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_wants_user ON item_wants (user_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_archived_messages_item ON messages (item_id, created_at)")
+        _archive_schema_ready.add(key)
+
+    for table in ARCHIVED_TABLES:
+        cols = ', '.join(columns[table])
+        conn.execute(f'''
+            CREATE TEMP VIEW IF NOT EXISTS all_{table} AS
+            SELECT {cols}, 0 AS archived FROM main.{table}
+            UNION ALL
+            SELECT {cols}, 1 AS archived FROM archive.{table}
+        ''')
+
+@contextmanager
+def write_transaction(with_archive=False):
+    '''
+    以 BEGIN IMMEDIATE 开启一个写事务
+    在事务开始时就获取写锁，保证"检查-修改"在同一事务内完成，避免并发覆盖；
+    正常退出时提交，出现异常时回滚
+    with_archive=True 时先附加归档库，事务同时覆盖主库和归档库
+    '''
+    conn = get_db_connection()
+    conn.isolation_level = None  # 手动管理事务边界
+    try:
+        if with_archive:
+            attach_archive(conn)
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+def managed_image_path(path):
+    '''
+    若 path 指向系统复制到 ITEM_IMG 目录下的图片，返回其本地路径，否则返回 None
+    数据库中可能保存 Windows 分隔符的路径 (如 ITEM_IMG\\xxx.jpg)；目录之外的外部图片不归系统管理，从不删除
+    '''
+    normalized = path.replace('\\', '/')
+    if os.path.dirname(normalized) != IMG_DIR:
+        return None
+    return os.path.join(IMG_DIR, os.path.basename(normalized))
+
+def remove_image_files(paths):
+    '''删除物品的本地图片文件，应在数据库事务提交之后调用；返回删除的文件数'''
+    removed = 0
+    for path in paths:
+        local = managed_image_path(path)
+        if local and os.path.isfile(local):
+            try:
+                os.remove(local)
+                removed += 1
+            except OSError as e:
+                print(f"删除图片失败 {local}: {e}")
+    return removed
+
+def defer_index(cursor, source, first_id):
+    '''
+    整批写入 (导入、迁移) 不逐批建立搜索索引、相似向量和重复检测签名时，在调用方的写事务中
+    记下 source 从 first_id 起的物品尚未建立索引 (已有更早的起点时保留原起点)
+    '''
+    cursor.execute('''
+        INSERT INTO import_checkpoints (source, rows_done, index_from) VALUES (?, 0, ?)
+        ON CONFLICT(source) DO UPDATE SET index_from = COALESCE(index_from, excluded.index_from)
+    ''', (source, first_id))
+
+def build_deferred_index(source) -> int:
+    '''
+    为 source 延迟建立索引的物品 (ID 不小于记下的起点) 一次建立搜索索引、相似向量和重复检测签名，并清除起点，
+    返回建立索引的物品数，没有待建立的索引时返回 0
+    整个范围在一个写事务中完成，中断时起点仍保留，下次调用重新建立
+    '''
+    with write_transaction() as conn:
+        row = conn.execute("SELECT index_from FROM import_checkpoints WHERE source = ?", (source,)).fetchone()
+        if row is None or row['index_from'] is None:
+            return 0
+        total = search_index.index_new_items(conn, row['index_from'])
+        similar.index_new_items(conn, row['index_from'])
+        duplicates.index_new_items(conn, row['index_from'])
+        conn.execute("UPDATE import_checkpoints SET index_from = NULL WHERE source = ?", (source,))
+    return total
+
+def add_attribute_rows(cursor, first_id) -> int:
+    '''为 ID 不小于 first_id 的物品一次生成属性行 (整批插入期间 items_attributes_insert 不逐行执行，见 init_db)，返回生成的行数'''
+    cursor.execute(_ATTRIBUTE_ROWS.format(where='i.id >= ?'), (first_id,))
+    return cursor.rowcount
+
+def _add_column_if_missing(cursor, table, column, definition):
+    '''
+    数据库迁移辅助函数：旧数据库缺少新列时通过 ALTER TABLE 补齐，返回是否补齐了该列
+    '''
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [r['name'] for r in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+# 由类别模板中列出的属性生成 item_attributes 行，{where} 限定物品范围；格式错误的 JSON 视为没有属性
+_ATTRIBUTE_ROWS = '''
+    INSERT OR REPLACE INTO item_attributes (item_id, key, value)
+    SELECT i.id, j.key, trim(j.atom)
+    FROM items i
+    JOIN categories c ON c.id = i.category_id
+    JOIN json_each(CASE WHEN json_valid(i.specific_attributes) THEN i.specific_attributes ELSE '{{}}' END) j
+    WHERE {where} AND j.atom IS NOT NULL AND trim(j.atom) != ''
+      AND j.key IN (SELECT value FROM json_each(c.attributes_template))
+'''
+
 def init_db():
     '''
     初始化数据库表结构
@@ -23,10 +197,12 @@ def init_db():
     
     # 开启外键支持
     cursor.execute("PRAGMA foreign_keys = ON")
+    # 新建的数据库使用增量 VACUUM，删除数据后可由 compact_db.py 分批回收空间 (对已有数据库无效果)
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
 
     # 初始化图片存储目录
-    if not os.path.exists('ITEM_IMG'):
-        os.makedirs('ITEM_IMG')
+    if not os.path.exists(IMG_DIR):
+        os.makedirs(IMG_DIR)
 
     # 1. 用户表 - 存储账户信息、密码哈希、角色状态和联系方式
     cursor.execute('''
@@ -40,6 +216,8 @@ def init_db():
             contact_info TEXT NOT NULL -- JSON string
         )
     ''')
+    # 管理员按审批状态分页查看用户 (待审批优先)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_status ON users (status)")
 
     # 2. 物品类别表 - 存储类别名称及该类别特有的属性模板(JSON)
     cursor.execute('''
@@ -79,12 +257,42 @@ def init_db():
             specific_attributes TEXT DEFAULT '{}', -- JSON string
             image_paths TEXT DEFAULT '[]', -- JSON string list
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER NOT NULL DEFAULT 0, -- 乐观锁版本号，每次修改 +1
+            reserved_by INTEGER, -- 预留给的买家ID (status = 'reserved' 时有效)
+            reserved_until TIMESTAMP, -- 预留到期时间 (UTC)，到期后由清理线程释放
+            sold_at TIMESTAMP, -- 确认售出的时间 (UTC)，用于归档
+            want_count INTEGER NOT NULL DEFAULT 0, -- 想要人数，由 item_wants 上的触发器维护
             FOREIGN KEY (category_id) REFERENCES categories (id),
             FOREIGN KEY (owner_id) REFERENCES users (id),
             FOREIGN KEY (buyer_id) REFERENCES users (id)
         )
     ''')
-    
+    # 旧数据库迁移：补齐后续版本新增的列
+    _add_column_if_missing(cursor, 'items', 'version', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column_if_missing(cursor, 'items', 'reserved_by', 'INTEGER REFERENCES users (id)')
+    _add_column_if_missing(cursor, 'items', 'reserved_until', 'TIMESTAMP')
+    _add_column_if_missing(cursor, 'items', 'sold_at', 'TIMESTAMP')
+    # 想要人数：由 item_wants 上的触发器维护 (见第 4 部分)，用于按想要人数排序
+    want_count_added = _add_column_if_missing(cursor, 'items', 'want_count', 'INTEGER NOT NULL DEFAULT 0')
+
+    # 物品表索引：部分索引只收录处于预留中的物品，供清理线程按到期时间扫描
+    # 排序列表 (list_items) 的索引：单列索引用于不加筛选的排序，(筛选列, 排序列) 复合索引用于常见的按状态、类别筛选后排序；
+    # 索引末尾隐含物品ID，按 (排序列, id) 分页时只读索引，不回表
+    cursor.execute("DROP INDEX IF EXISTS idx_items_status")     # 已被 (status, created_at) 覆盖
+    for name, columns in (('price', 'price'), ('created_at', 'created_at'), ('want_count', 'want_count'), ('name', 'name'),
+                          ('status_price', 'status, price'), ('status_created_at', 'status, created_at'),
+                          ('category_price', 'category_id, price'), ('category_created_at', 'category_id, created_at')):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_items_{name} ON items ({columns})")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_items_reserved_until ON items (reserved_until)
+        WHERE reserved_until IS NOT NULL
+    ''')
+    # 归档任务按售出时间查找已售出物品 (旧数据没有 sold_at，以发布时间代替)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_items_sold_at ON items (COALESCE(sold_at, created_at))
+        WHERE status = 'sold'
+    ''')
+
     # 4. 物品意向表 - 多对多关联表，记录买家对物品的购买意向和出价
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS item_wants (
@@ -98,6 +306,22 @@ def init_db():
             UNIQUE(user_id, item_id)
         )
     ''')
+    # 按物品查找意向 (想要人数、买家列表、删除物品时的级联清理)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_item_wants_item ON item_wants (item_id)")
+    # 维护 items.want_count；归档时先把物品连同 want_count 复制到归档库，再按留言、意向、物品的顺序从主库删除，
+    # 删除意向时的减一作用于随后即被删除的主库物品行，不影响归档库中的数据
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS item_wants_count_insert AFTER INSERT ON item_wants BEGIN
+            UPDATE items SET want_count = want_count + 1 WHERE id = NEW.item_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS item_wants_count_delete AFTER DELETE ON item_wants BEGIN
+            UPDATE items SET want_count = want_count - 1 WHERE id = OLD.item_id;
+        END
+    ''')
+    if want_count_added:
+        cursor.execute("UPDATE items SET want_count = (SELECT COUNT(*) FROM item_wants w WHERE w.item_id = items.id)")
 
     # 5. 留言表 - 存储物品详情页下的用户留言和回复
     cursor.execute('''
@@ -113,6 +337,94 @@ def init_db():
             FOREIGN KEY (reply_to_id) REFERENCES messages (id)
         )
     ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_item ON messages (item_id, created_at)")
+
+    # 6. 导入进度表 - 批量导入时与每批数据在同一事务中更新，失败后从这里恢复
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY, -- 导入文件的绝对路径
+            rows_done INTEGER NOT NULL, -- 已处理 (插入或拒绝) 的源记录数
+            index_from INTEGER, -- 延迟建立索引的第一个物品ID，NULL 表示没有待建立的索引
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    _add_column_if_missing(cursor, 'import_checkpoints', 'index_from', 'INTEGER')
+
+    # 7. ver1.0 迁移映射表 - 记录 ver1.0 物品ID 对应的物品，重复执行迁移时据此更新而不是重复插入
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS legacy_v1_items (
+            v1_id INTEGER PRIMARY KEY, -- database.xlsx 中的 item id
+            item_id INTEGER NOT NULL, -- 迁移生成的物品 (可能已在新系统中被删除或归档)
+            migrated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # 8. 搜索索引 (FTS5) - 名称、描述的二元组和拼音词条，见 search_index.py；旧数据库首次升级时为已有物品建立索引
+    if search_index.create_table(cursor):
+        cursor.execute("SELECT 1 FROM items LIMIT 1")
+        if cursor.fetchone():
+            print(f"系统升级: 已为 {search_index.rebuild(conn)} 个已有物品建立搜索索引")
+
+    # 9. 物品属性表 - specific_attributes 中类别模板列出的属性，每个属性一行，供按属性筛选 (如 品牌 = Apple)
+    # 由触发器与物品表、类别模板同步，任何写入方式 (包括 datagen、迁移工具) 都不需要额外处理；值比较不区分大小写
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'item_attributes'")
+    attributes_exist = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS item_attributes (
+            item_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL COLLATE NOCASE,
+            PRIMARY KEY (item_id, key)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_item_attributes_lookup ON item_attributes (key, value, item_id)")
+    # create_items 整批插入时在写事务内向 bulk_insert 写一行，插入触发器不逐行执行，
+    # 由 add_attribute_rows 在同一事务中对整批物品一次生成 (该行在提交前删除，其他连接看不到)
+    cursor.execute("CREATE TABLE IF NOT EXISTS bulk_insert (active INTEGER)")
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'items_attributes_insert'")
+    row = cursor.fetchone()
+    if row and 'bulk_insert' not in row['sql']:
+        cursor.execute("DROP TRIGGER items_attributes_insert")    # 旧数据库的触发器没有整批插入的判断
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS items_attributes_insert AFTER INSERT ON items
+        WHEN NOT EXISTS (SELECT 1 FROM bulk_insert) BEGIN
+            {_ATTRIBUTE_ROWS.format(where='i.id = NEW.id')};
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS items_attributes_update AFTER UPDATE OF specific_attributes, category_id ON items BEGIN
+            DELETE FROM item_attributes WHERE item_id = OLD.id;
+            {_ATTRIBUTE_ROWS.format(where='i.id = NEW.id')};
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS items_attributes_delete AFTER DELETE ON items BEGIN
+            DELETE FROM item_attributes WHERE item_id = OLD.id;
+        END
+    ''')
+    # 修改类别模板时按新模板重建该类别所有物品的属性行
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS categories_attributes_update AFTER UPDATE OF attributes_template ON categories BEGIN
+            DELETE FROM item_attributes WHERE item_id IN (SELECT id FROM items WHERE category_id = NEW.id);
+            {_ATTRIBUTE_ROWS.format(where='i.category_id = NEW.id')};
+        END
+    ''')
+    if not attributes_exist:
+        cursor.execute(_ATTRIBUTE_ROWS.format(where='1'))
+        if cursor.rowcount > 0:
+            print(f"系统升级: 已为已有物品建立 {cursor.rowcount} 条属性索引")
+
+    # 10. 相似物品的词频向量 - 见 similar.py；与搜索索引一样由 ItemManager 同步，旧数据库首次升级时为已有物品生成
+    if similar.create_tables(cursor):
+        cursor.execute("SELECT 1 FROM items LIMIT 1")
+        if cursor.fetchone():
+            print(f"系统升级: 已为 {similar.rebuild(conn)} 个已有物品生成相似度向量")
+
+    # 11. 重复发布检测的 MinHash 签名和 LSH 分桶 - 见 duplicates.py；同样由 ItemManager 同步，旧数据库首次升级时为已有物品生成
+    if duplicates.create_tables(cursor):
+        cursor.execute("SELECT 1 FROM items LIMIT 1")
+        if cursor.fetchone():
+            print(f"系统升级: 已为 {duplicates.rebuild(conn)} 个已有物品生成重复检测签名")
 
     conn.commit()
     conn.close()
\ No newline at end of file
@@ -0,0 +1,272 @@
+'''
+合成数据生成器
+按固定随机种子生成用户、物品、购买意向和留言，用于规模测试和性能基准
+用法: python datagen.py --db bench_data/bench.db --items 100000
+'''
+import os
+import json
+import random
+import hashlib
+import argparse
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+import database
+import search_index
+import similar
+import duplicates
+
+CATEGORIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'categories.json')
+
+# 所有合成用户共用的密码 (逐个计算 PBKDF2 太慢，统一预先计算一次)
+SYNTHETIC_PASSWORD = 'password'
+
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+GIVEN_CHARS = "伟芳娜秀敏静丽强磊军洋勇艳杰娟涛明超兰霞平刚桂英华玉萍红鹏辉俊峰建波宁欣怡浩然子涵宇轩梓萱晨雨思远嘉琪文博一诺雅婷"
+LOCATIONS = ["东区宿舍1号楼", "东区宿舍3号楼", "西区宿舍5号楼", "南区食堂门口", "北门快递站", "图书馆一楼大厅",
+             "第一教学楼", "第三教学楼", "体育馆东侧", "学生活动中心", "研究生公寓A座", "校医院对面", "二食堂二楼"]
+CONDITIONS = ["全新未拆封", "九成新", "九五新", "八成新", "七成新", "自用", "闲置", "毕业清仓", "搬家急出", "仅拆封试用"]
+DESC_TEMPLATES = [
+    "{cond}，{reason}，{extra}。",
+    "{reason}，{cond}，{extra}，有意私聊。",
+    "{cond}的{name}，{extra}，{reason}。",
+    "出一个{name}，{cond}，{extra}，价格可小刀。",
+]
+REASONS = ["毕业了带不走", "买重了", "用不上了", "换了新的", "室友送的用不着", "搬宿舍清东西", "考完试不需要了"]
+EXTRAS = ["无划痕无磕碰", "功能完好", "配件齐全", "包装盒还在", "有少量使用痕迹", "可当面验货", "送货到宿舍楼下", "支持校内自提"]
+
+# 各类别的物品名词及常见品牌，未列出的类别使用通用词表
+CATEGORY_NOUNS: Dict[str, List[str]] = {
+    "书籍": ["高等数学教材", "线性代数辅导书", "大学英语四级真题", "考研政治全套", "数据结构教程", "C语言程序设计",
+           "微观经济学", "三体全集", "活着", "百年孤独", "算法导论", "概率论与数理统计", "雅思词汇"],
+    "电子产品": ["蓝牙耳机", "机械键盘", "无线鼠标", "平板电脑", "笔记本电脑", "充电宝", "电子词典", "显示器",
+             "智能手表", "降噪耳机", "移动硬盘", "台灯", "路由器"],
+    "食品": ["进口巧克力", "坚果礼盒", "速溶咖啡", "自热火锅", "家乡特产辣条", "牛肉干", "蜂蜜", "茶叶礼盒", "燕麦片"],
+    "服装": ["羽绒服", "卫衣", "牛仔裤", "运动鞋", "冲锋衣", "毛呢大衣", "学士服", "篮球服", "帆布鞋", "围巾"],
+    "工具": ["电钻", "螺丝刀套装", "万用表", "焊台", "卷尺", "扳手套装", "热熔胶枪", "美工刀", "工具箱"],
+}
+GENERIC_NOUNS = ["收纳箱", "台灯", "自行车", "吉他", "瑜伽垫", "电风扇", "小冰箱", "行李箱", "篮球", "羽毛球拍"]
+BRANDS: Dict[str, List[str]] = {
+    "电子产品": ["Apple", "华为", "小米", "联想", "索尼", "罗技", "OPPO", "vivo", "戴尔", "漫步者"],
+    "服装": ["优衣库", "李宁", "安踏", "耐克", "阿迪达斯", "波司登", "太平鸟", "ZARA"],
+    "工具": ["博世", "得力", "世达", "史丹利", "绿林", "胜利"],
+}
+PUBLISHERS = ["高等教育出版社", "人民邮电出版社", "机械工业出版社", "清华大学出版社", "人民文学出版社", "中信出版社", "外语教学与研究出版社"]
+COLORS = ["黑色", "白色", "灰色", "蓝色", "红色", "粉色", "军绿色", "卡其色"]
+MATERIALS = ["纯棉", "涤纶", "羊毛", "牛仔布", "尼龙", "真皮"]
+SIZES = ["S", "M", "L", "XL", "XXL", "均码"]
+CLOTHES_TYPES = ["上衣", "裤子", "外套", "鞋子", "配饰"]
+ELECTRONIC_TYPES = ["音频设备", "电脑外设", "移动设备", "存储设备", "网络设备"]
+MESSAGES = ["还在吗？", "能便宜点吗？", "可以看看实物吗？", "什么时候方便交易？", "有发票吗？", "可以送到宿舍吗？",
+            "还能再小刀吗？", "电池续航怎么样？", "有使用痕迹吗？", "周末可以面交吗？"]
+REPLIES = ["在的", "最低价了", "可以，私聊约时间", "没有发票", "可以送", "周末都行", "几乎没用过"]
+
+
+def load_category_templates(path=CATEGORIES_FILE) -> Dict[str, List[str]]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _person_name(rng: random.Random) -> str:
+    return rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_CHARS) for _ in range(rng.randint(1, 2)))
+
+
+def _attribute_value(rng: random.Random, category: str, key: str) -> str:
+    '''根据属性名生成看起来合理的属性值，未识别的属性名使用通用取值'''
+    if key == "作者":
+        return _person_name(rng)
+    if key == "出版社":
+        return rng.choice(PUBLISHERS)
+    if key == "ISBN":
+        return f"978-7-{rng.randint(100, 999)}-{rng.randint(10000, 99999)}-{rng.randint(0, 9)}"
+    if key in ("出版年份",):
+        return str(rng.randint(1995, 2025))
+    if key == "品牌":
+        return rng.choice(BRANDS.get(category, ["无品牌", "杂牌", "自制"]))
+    if key == "型号":
+        return f"{rng.choice('ABCDEFGHKMNPRSTX')}{rng.randint(100, 9999)}"
+    if key == "类型":
+        return rng.choice(CLOTHES_TYPES if category == "服装" else ELECTRONIC_TYPES)
+    if key == "新旧程度":
+        return rng.choice(CONDITIONS)
+    if key in ("保质期", "生产日期", "购买日期"):
+        return (datetime(2025, 1, 1) + timedelta(days=rng.randint(0, 700))).strftime("%Y-%m-%d")
+    if key == "保修期":
+        return f"{rng.choice([0, 3, 6, 12, 24])}个月"
+    if key in ("数量", "净含量"):
+        return f"{rng.randint(1, 20)}{rng.choice(['袋', '盒', '瓶', '包'])}"
+    if key == "成分":
+        return rng.choice(["小麦粉、白砂糖", "可可脂、牛奶", "花生、杏仁", "牛肉、食盐"])
+    if key == "尺码":
+        return rng.choice(SIZES)
+    if key == "材质":
+        return rng.choice(MATERIALS)
+    if key == "适用性别":
+        return rng.choice(["男", "女", "通用"])
+    if key == "颜色":
+        return rng.choice(COLORS)
+    return rng.choice(CONDITIONS)
+
+
+def _timestamp(rng: random.Random, now: datetime, max_days=365) -> str:
+    '''生成过去 max_days 天内的时间戳，格式与 CURRENT_TIMESTAMP 一致'''
+    return (now - timedelta(seconds=rng.randint(0, max_days * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _chunks(iterable, size):
+    batch = []
+    for row in iterable:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _prepare_schema(db_path):
+    '''在目标数据库文件上建表 (init_db 使用 database.DB_FILE)'''
+    database.DB_FILE = db_path
+    database.init_db()
+
+
+def generate_dataset(db_path, n_users=1000, n_items=10000, n_wants=5000, n_messages=5000,
+                     seed=42, batch_size=10000) -> Dict[str, int]:
+    '''
+    向 db_path 写入一份确定性的合成数据集 (相同参数和种子得到相同数据)
+    所有写入都通过 executemany 分批完成，返回各表新增行数
+    '''
+    rng = random.Random(seed)
+    now = datetime(2026, 1, 1)  # 固定基准时间，保证可复现
+    _prepare_schema(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = OFF")    # 生成数据期间不需要持久化保证
+    cursor = conn.cursor()
+
+    # 1. 类别：按 categories.json 补齐缺失类别，属性模板以数据库中为准
+    for name, attrs in load_category_templates().items():
+        cursor.execute("INSERT OR IGNORE INTO categories (name, attributes_template) VALUES (?, ?)",
+                       (name, json.dumps(attrs, ensure_ascii=False)))
+    cursor.execute("SELECT id, name, attributes_template FROM categories")
+    categories = [(r[0], r[1], json.loads(r[2])) for r in cursor.fetchall()]
+
+    # 2. 用户
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+    first_user_id = cursor.fetchone()[0] + 1
+    salt = hashlib.sha256(f"seed-{seed}".encode()).digest()[:16]
+    pwd_hash = hashlib.pbkdf2_hmac('sha256', SYNTHETIC_PASSWORD.encode(), salt, 100000)
+
+    def user_rows():
+        for i in range(n_users):
+            uid = first_user_id + i
+            contact = {"address": rng.choice(LOCATIONS), "phone": f"1{rng.choice('3578')}{rng.randint(100000000, 999999999)}",
+                       "email": f"stu{uid}@example.edu.cn"}
+            status = 'pending' if rng.random() < 0.05 else 'approved'
+            yield (uid, f"stu{seed}_{uid:07d}", pwd_hash, salt, 'user', status, json.dumps(contact, ensure_ascii=False))
+
+    for batch in _chunks(user_rows(), batch_size):
+        cursor.executemany("INSERT INTO users (id, username, password_hash, salt, role, status, contact_info) VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    user_ids = range(first_user_id, first_user_id + n_users)
+
+    # 3. 物品：约 70% 在售、5% 预留、25% 已售出
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM items")
+    first_item_id = cursor.fetchone()[0] + 1
+
+    def item_rows():
+        for i in range(n_items):
+            iid = first_item_id + i
+            cat_id, cat_name, template = rng.choice(categories)
+            noun = rng.choice(CATEGORY_NOUNS.get(cat_name, GENERIC_NOUNS))
+            brand = rng.choice(BRANDS[cat_name]) + " " if cat_name in BRANDS and rng.random() < 0.6 else ""
+            cond = rng.choice(CONDITIONS)
+            name = f"{cond}{brand}{noun}" if rng.random() < 0.4 else f"{brand}{noun}"
+            desc = rng.choice(DESC_TEMPLATES).format(cond=cond, reason=rng.choice(REASONS), extra=rng.choice(EXTRAS), name=noun)
+            attrs = {key: _attribute_value(rng, cat_name, key) for key in template}
+            owner = rng.choice(user_ids)
+            r = rng.random()
+            status, buyer, reserved_by, reserved_until = 'active', None, None, None
+            if r < 0.25:
+                status, buyer = 'sold', rng.choice(user_ids)
+            elif r < 0.30:
+                status, reserved_by = 'reserved', rng.choice(user_ids)
+                reserved_until = (now + timedelta(hours=rng.randint(-48, 72))).strftime("%Y-%m-%d %H:%M:%S")
+            price = round(rng.choice([rng.uniform(1, 50), rng.uniform(20, 300), rng.uniform(100, 5000)]), 1)
+            yield (iid, name, desc, cat_id, owner, buyer, status, price, int(rng.random() < 0.5), rng.choice(LOCATIONS),
+                   json.dumps(attrs, ensure_ascii=False), '[]', _timestamp(rng, now), reserved_by, reserved_until)
+
+    for batch in _chunks(item_rows(), batch_size):
+        cursor.executemany('''
+            INSERT INTO items (id, name, description, category_id, owner_id, buyer_id, status, price, can_bargain, address,
+                               specific_attributes, image_paths, created_at, reserved_by, reserved_until)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+        conn.commit()
+    item_ids = range(first_item_id, first_item_id + n_items)
+    for batch in _chunks(item_ids, batch_size):
+        search_index.index_items(cursor, batch)
+        similar.index_items(cursor, batch)
+        duplicates.index_items(cursor, batch)
+        conn.commit()
+    search_index.optimize(cursor)
+    conn.commit()
+
+    # 4. 购买意向：随机 (用户, 物品) 对，重复的组合由 UNIQUE 约束忽略
+    def want_rows():
+        for _ in range(n_wants):
+            yield (rng.choice(user_ids), rng.choice(item_ids), round(rng.uniform(0, 500), 1) if rng.random() < 0.3 else 0,
+                   _timestamp(rng, now))
+
+    wants_before = conn.total_changes
+    for batch in _chunks(want_rows(), batch_size):
+        cursor.executemany("INSERT OR IGNORE INTO item_wants (user_id, item_id, offer_price, created_at) VALUES (?, ?, ?, ?)", batch)
+        conn.commit()
+    wants_added = conn.total_changes - wants_before
+
+    # 5. 留言：约 20% 为对同一物品已有留言的回复
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+    first_message_id = cursor.fetchone()[0] + 1
+    last_message_of_item = {}
+
+    def message_rows():
+        for i in range(n_messages):
+            mid = first_message_id + i
+            item_id = rng.choice(item_ids)
+            reply_to = last_message_of_item.get(item_id) if rng.random() < 0.2 else None
+            content = rng.choice(REPLIES if reply_to else MESSAGES)
+            last_message_of_item[item_id] = mid
+            yield (mid, item_id, rng.choice(user_ids), content, reply_to, _timestamp(rng, now))
+
+    for batch in _chunks(message_rows(), batch_size):
+        cursor.executemany("INSERT INTO messages (id, item_id, sender_id, content, reply_to_id, created_at) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        conn.commit()
+
+    cursor.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return {'users': n_users, 'items': n_items, 'wants': wants_added, 'messages': n_messages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成二手交易系统合成数据")
+    parser.add_argument('--db', default=os.path.join('bench_data', 'synthetic.db'), help="目标数据库文件")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--wants', type=int, default=None, help="默认为物品数的一半")
+    parser.add_argument('--messages', type=int, default=None, help="默认为物品数的一半")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    start = time.perf_counter()
+    counts = generate_dataset(args.db, args.users, args.items,
+                              args.items // 2 if args.wants is None else args.wants,
+                              args.items // 2 if args.messages is None else args.messages,
+                              seed=args.seed)
+    print(f"已生成 {counts}，耗时 {time.perf_counter() - start:.1f}s -> {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+'''
+重复发布检测 (MinHash/LSH)
+卖家为了让物品排在前面，会把同一物品反复发布；这里把同一卖家内容几乎相同的未售出物品识别为重复
+每个物品的特征集合为名称、描述的词条 (与搜索索引相同的切分，见 search_index.text_terms) 和首张图片的均值哈希，
+两个物品的相似度为特征集合的 Jaccard 系数，用 NUM_PERM 个最小哈希值组成的签名估计 (相等的位置所占比例)
+持久化：与搜索索引一样，在 ItemManager 创建、修改、删除和归档物品时于同一事务内更新
+    item_signatures: 每个物品的签名，NUM_PERM 个 uint32 打包为一个 BLOB (256 字节)
+    item_bands:      LSH 分桶，签名切成 BANDS 段，每段与卖家ID一起哈希为一个桶号；
+                     两个物品只要有一段完全相同就落入同一个桶，成为候选，再用签名核对相似度
+                     相似度 0.7 的物品成为候选的概率约 99%，0.3 时约 12%
+发布物品时按新物品的 BANDS 个桶号查找候选 (主键查找，与物品总数无关)，最多 MAX_CANDIDATES 个候选的签名整批核对
+(约 10 万个物品、同一卖家反复发布的数据上 find_duplicates 的中位数约 0.7ms)；
+管理员可执行批处理，按卖家顺序扫描一遍所有签名，把重复的物品聚成簇:
+    python duplicates.py --cluster
+签名计算在安装可选依赖 numpy 时向量化，未安装时逐个计算，两者结果相同；整批修改数据后可执行:
+    python duplicates.py --rebuild
+'''
+import json
+import time
+import zlib
+import random
+import argparse
+from array import array
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import database
+import search_index
+
+try:
+    import numpy as np
+except ImportError:     # 签名计算的向量化为可选功能
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:     # 命令行工具可能在未安装 Pillow 的环境中运行，此时不比较图片
+    Image = None
+
+SIGNATURES_TABLE = 'item_signatures'
+BANDS_TABLE = 'item_bands'
+NUM_PERM = 64               # 签名长度 (最小哈希个数)
+BANDS = 16                  # LSH 段数，每段 NUM_PERM // BANDS 个值
+DUPLICATE_SIMILARITY = 0.7  # 估计的 Jaccard 系数不低于此值视为重复
+MAX_CANDIDATES = 200        # 发布时最多核对的候选数
+_PRIME = (1 << 31) - 1      # 哈希函数 (a * x + b) mod _PRIME，乘积不超过 2^62，numpy 的 uint64 不会溢出
+_ROWS = NUM_PERM // BANDS
+_BUCKET_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # 固定种子：签名、桶号必须在各进程、各次运行之间一致
+_A = [_rng.randrange(1, _PRIME) for _ in range(NUM_PERM)]
+_B = [_rng.randrange(0, _PRIME) for _ in range(NUM_PERM)]
+_BUCKET_MULTIPLIER = _rng.randrange(1, _BUCKET_PRIME)
+if np is not None:
+    _A_NP = np.array(_A, dtype=np.uint64)[:, None]
+    _B_NP = np.array(_B, dtype=np.uint64)[:, None]
+
+
+def create_tables(cursor) -> bool:
+    '''创建签名表和分桶表 (由 init_db 调用)，返回签名表是否为新建'''
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (SIGNATURES_TABLE,))
+    created = cursor.fetchone() is None
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {SIGNATURES_TABLE} (
+            item_id INTEGER PRIMARY KEY,
+            owner_id INTEGER NOT NULL,
+            signature BLOB NOT NULL     -- NUM_PERM 个 uint32
+        )
+    ''')
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{SIGNATURES_TABLE}_owner ON {SIGNATURES_TABLE} (owner_id)")
+    # 删除时由签名重新算出桶号，不需要按物品ID的索引
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {BANDS_TABLE} (
+            bucket INTEGER NOT NULL,
+            item_id INTEGER NOT NULL,
+            PRIMARY KEY (bucket, item_id)
+        ) WITHOUT ROWID
+    ''')
+    return created
+
+
+def image_hash(path) -> Optional[int]:
+    '''图片的 64 位均值哈希 (缩小为 8x8 灰度图，每个像素是否高于平均值)，重新压缩、缩放过的同一张图片哈希相同或相近；无法读取时返回 None'''
+    if Image is None or not path:
+        return None
+    try:
+        with Image.open(path) as img:
+            img.draft('L', (64, 64))    # JPEG 在解码时直接缩小，不必解码原图
+            pixels = list(img.convert('L').resize((8, 8)).getdata())
+    except (OSError, ValueError):
+        return None
+    mean = sum(pixels) / len(pixels)
+    return sum(1 << i for i, p in enumerate(pixels) if p > mean)
+
+
+def features(name, description, image_paths=()) -> Set[str]:
+    '''物品的特征集合：名称、描述的词条和首张图片哈希的 4 段 (图片略有差异时仍有部分特征相同)'''
+    result = set(search_index.text_terms(name))
+    result.update(search_index.text_terms(description))
+    h = image_hash(image_paths[0]) if image_paths else None
+    if h is not None:
+        result.update(f'#img{i}:{(h >> (16 * i)) & 0xffff:04x}' for i in range(4))
+    return result
+
+
+def signatures(feature_sets: List[Iterable[str]]) -> List[Optional[bytes]]:
+    '''一批特征集合的 MinHash 签名，集合为空时对应 None；有 numpy 时整批一起计算'''
+    hashed = [[zlib.crc32(f.encode('utf-8')) % _PRIME for f in fs] for fs in feature_sets]
+    if np is None:
+        return [array('I', [min((a * x + b) % _PRIME for x in xs) for a, b in zip(_A, _B)]).tobytes() if xs else None
+                for xs in hashed]
+    result = []
+    for start in range(0, len(hashed), 1000):   # 每次 1000 个物品，中间矩阵约 NUM_PERM x 2 万个值
+        chunk = hashed[start:start + 1000]
+        lengths = np.array([len(xs) for xs in chunk])
+        xs = np.fromiter((x for xs in chunk for x in xs), dtype=np.uint64, count=int(lengths.sum()))
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        nonempty = lengths > 0     # reduceat 要求各段非空，只对非空的集合取最小值
+        mins = iter(np.minimum.reduceat((_A_NP * xs + _B_NP) % _PRIME, offsets[nonempty], axis=1).astype(np.uint32).T
+                    if nonempty.any() else [])
+        result.extend(next(mins).tobytes() if n else None for n in nonempty)
+    return result
+
+
+def signature(feature_set: Iterable[str]) -> Optional[bytes]:
+    '''特征集合的 MinHash 签名，集合为空时返回 None'''
+    return signatures([feature_set])[0]
+
+
+def similarity(sig1: bytes, sig2: bytes) -> float:
+    '''两个签名估计的 Jaccard 系数'''
+    return sum(a == b for a, b in zip(array('I', sig1), array('I', sig2))) / NUM_PERM
+
+
+def similarities(sig: bytes, others: List[bytes]) -> List[float]:
+    '''一个签名与一批签名各自估计的 Jaccard 系数；有 numpy 时整批比较'''
+    if np is None or not others:
+        return [similarity(sig, other) for other in others]
+    matrix = np.frombuffer(b''.join(others), dtype=np.uint32).reshape(len(others), NUM_PERM)
+    return (matrix == np.frombuffer(sig, dtype=np.uint32)).mean(axis=1).tolist()
+
+
+def buckets(owner_id, sig: bytes) -> List[int]:
+    '''
+    签名的 BANDS 个桶号：卖家ID、段号和该段的 _ROWS 个值拼成一个整数 key，桶号为 key * 乘数 mod (2^61 - 1)
+    模数为素数，不同的 key 得到相同桶号的概率约为 2^-61 (偶尔相同也无妨，候选都会再核对签名)
+    '''
+    width = _ROWS * 4
+    return [(((owner_id * BANDS + band) << (width * 8)) + int.from_bytes(sig[band * width:(band + 1) * width], 'little'))
+            * _BUCKET_MULTIPLIER % _BUCKET_PRIME for band in range(BANDS)]
+
+
+def _remove(cursor, item_ids):
+    '''删除物品的签名和分桶'''
+    for start in range(0, len(item_ids), 500):
+        batch = item_ids[start:start + 500]
+        cursor.execute(f"SELECT item_id, owner_id, signature FROM {SIGNATURES_TABLE} WHERE item_id IN ({','.join('?' * len(batch))})", batch)
+        rows = cursor.fetchall()
+        cursor.executemany(f"DELETE FROM {BANDS_TABLE} WHERE bucket = ? AND item_id = ?",
+                           [(bucket, r[0]) for r in rows for bucket in buckets(r[1], r[2])])
+        cursor.executemany(f"DELETE FROM {SIGNATURES_TABLE} WHERE item_id = ?", [(r[0],) for r in rows])
+
+
+def _write(cursor, rows, bands_table=BANDS_TABLE):
+    '''
+    rows 为 [(物品ID, 卖家ID, 名称, 描述, 图片路径 JSON)]，写入它们的签名和分桶
+    直接写入分桶表时按主键顺序插入：桶号是随机的，按生成顺序插入会在 B 树中来回跳，排序后每个页最多访问一次
+    (写入临时表时不排序，由 _flush_bands 统一排序)
+    '''
+    sigs = signatures([features(r[2], r[3], json.loads(r[4] or '[]')) for r in rows])
+    written, bands = [], []
+    for r, sig in zip(rows, sigs):
+        if sig is not None:
+            written.append((r[0], r[1], sig))
+            bands.extend((bucket, r[0]) for bucket in buckets(r[1], sig))
+    if bands_table == BANDS_TABLE:
+        bands.sort()
+    cursor.executemany(f"INSERT INTO {SIGNATURES_TABLE} (item_id, owner_id, signature) VALUES (?, ?, ?)", written)
+    cursor.executemany(f"INSERT OR IGNORE INTO {bands_table} (bucket, item_id) VALUES (?, ?)", bands)
+
+
+_STAGED_BANDS = 'temp.staged_bands'
+
+
+def _stage_bands(cursor):
+    '''
+    多批写入时分桶先追加到临时表，全部写完后由 _flush_bands 按主键顺序一次插入
+    (桶号是随机的，逐批插入 B 树会分散写到各处的页)
+    '''
+    cursor.execute(f"CREATE TABLE {_STAGED_BANDS} (bucket INTEGER, item_id INTEGER)")
+
+
+def _flush_bands(cursor):
+    cursor.execute(f"INSERT OR IGNORE INTO {BANDS_TABLE} (bucket, item_id) SELECT bucket, item_id FROM {_STAGED_BANDS} ORDER BY bucket, item_id")
+    cursor.execute(f"DROP TABLE {_STAGED_BANDS}")
+
+
+def index_items(cursor, item_ids: Iterable[int]):
+    '''重新生成一批物品的签名 (物品已不存在时只删除)，需在调用方的写事务中执行；超过一批 (500 个) 时分桶经临时表按顺序插入'''
+    item_ids = list(item_ids)
+    _remove(cursor, item_ids)
+    staged = len(item_ids) > 500
+    if staged:
+        _stage_bands(cursor)
+    for start in range(0, len(item_ids), 500):
+        batch = item_ids[start:start + 500]
+        cursor.execute(f"SELECT id, owner_id, name, description, image_paths FROM items WHERE id IN ({','.join('?' * len(batch))})", batch)
+        _write(cursor, cursor.fetchall(), _STAGED_BANDS if staged else BANDS_TABLE)
+    if staged:
+        _flush_bands(cursor)
+
+
+def remove_items(cursor, item_ids: Iterable[int]):
+    '''删除一批已不存在的物品的签名 (仍存在的会被跳过)，需在调用方的写事务中执行'''
+    item_ids = list(item_ids)
+    for start in range(0, len(item_ids), 500):
+        batch = item_ids[start:start + 500]
+        cursor.execute(f"SELECT id FROM items WHERE id IN ({','.join('?' * len(batch))})", batch)
+        existing = {r[0] for r in cursor.fetchall()}
+        _remove(cursor, [item_id for item_id in batch if item_id not in existing])
+
+
+def _write_all(conn, first_id, batch_size) -> int:
+    '''流式读取ID不小于 first_id 的物品，写入签名 (分桶经临时表按顺序插入)，返回物品数'''
+    cursor = conn.cursor()
+    _stage_bands(cursor)
+    read = conn.execute("SELECT id, owner_id, name, description, image_paths FROM items WHERE id >= ?", (first_id,))
+    total = 0
+    while True:
+        rows = read.fetchmany(batch_size)
+        if not rows:
+            break
+        _write(cursor, rows, _STAGED_BANDS)
+        total += len(rows)
+    _flush_bands(cursor)
+    return total
+
+
+def index_new_items(conn, first_id, batch_size=20000) -> int:
+    '''
+    为ID不小于 first_id 的物品一次生成签名，返回物品数；需在调用方的写事务中执行
+    供整批导入延迟建立索引时在最后一批之后调用，该范围内已有的签名 (导入期间经 ItemManager 创建或修改的物品) 先删除再重新生成
+    '''
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT item_id FROM {SIGNATURES_TABLE} WHERE item_id >= ?", (first_id,))
+    _remove(cursor, [r[0] for r in cursor.fetchall()])
+    return _write_all(conn, first_id, batch_size)
+
+
+def rebuild(conn, batch_size=20000) -> int:
+    '''清空并按物品表重建所有签名，返回物品数'''
+    conn.execute(f"DELETE FROM {SIGNATURES_TABLE}")
+    conn.execute(f"DELETE FROM {BANDS_TABLE}")
+    return _write_all(conn, 0, batch_size)
+
+
+def find_duplicates(cursor, item_id, limit) -> List[Tuple[int, float]]:
+    '''同一卖家与物品重复的未售出物品 [(物品ID, 估计的相似度)]，按相似度从高到低最多 limit 个；物品须已有签名'''
+    cursor.execute(f"SELECT owner_id, signature FROM {SIGNATURES_TABLE} WHERE item_id = ?", (item_id,))
+    row = cursor.fetchone()
+    if not row:
+        return []
+    owner_id, sig = row[0], row[1]
+    keys = buckets(owner_id, sig)
+    # 先取去重后的候选再按主键连接：近似相同的物品在每一段都同桶，不去重时 LIMIT 只能覆盖约 MAX_CANDIDATES / BANDS 个物品；
+    # CROSS JOIN 固定连接顺序，否则查询规划器可能选择按 status 索引扫描整个物品表
+    cursor.execute(f'''
+        SELECT s.item_id, s.signature
+        FROM (SELECT DISTINCT item_id FROM {BANDS_TABLE} WHERE bucket IN ({','.join('?' * len(keys))}) AND item_id != ? LIMIT ?) c
+        CROSS JOIN {SIGNATURES_TABLE} s ON s.item_id = c.item_id
+        CROSS JOIN items i ON i.id = c.item_id
+        WHERE i.status != 'sold'
+    ''', (*keys, item_id, MAX_CANDIDATES))
+    rows = cursor.fetchall()
+    found = [(r[0], score) for r, score in zip(rows, similarities(sig, [r[1] for r in rows])) if score >= DUPLICATE_SIMILARITY]
+    found.sort(key=lambda f: (-f[1], -f[0]))
+    return found[:limit]
+
+
+def clusters(conn) -> List[List[int]]:
+    '''
+    把所有未售出物品中同一卖家的重复物品聚成簇，返回每簇的物品ID (从小到大)，按簇的大小从大到小
+    按卖家顺序扫描一遍签名，每个卖家在内存中分桶：同一桶中的物品与桶中第一个物品核对相似度，相似则合并 (并查集)
+    '''
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(f'''
+        SELECT s.owner_id, s.item_id, s.signature FROM {SIGNATURES_TABLE} s JOIN items i ON i.id = s.item_id
+        WHERE i.status != 'sold' ORDER BY s.owner_id
+    ''')
+    result = []
+    for _, owned in groupby(rows, key=lambda r: r[0]):
+        owned = list(owned)
+        if len(owned) < 2:
+            continue
+        parent = {r[1]: r[1] for r in owned}
+
+        def find(x):
+            while parent[x] != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        first: Dict[int, Tuple[int, bytes]] = {}
+        for owner_id, item_id, sig in owned:
+            for bucket in buckets(owner_id, sig):
+                if bucket not in first:
+                    first[bucket] = (item_id, sig)
+                    continue
+                other, other_sig = first[bucket]
+                if find(item_id) != find(other) and similarity(sig, other_sig) >= DUPLICATE_SIMILARITY:
+                    parent[find(item_id)] = find(other)
+        groups: Dict[int, List[int]] = {}
+        for item_id in parent:
+            groups.setdefault(find(item_id), []).append(item_id)
+        result.extend(sorted(g) for g in groups.values() if len(g) > 1)
+    result.sort(key=lambda g: (-len(g), g[0]))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重复发布检测：重建签名或把已有的重复物品聚成簇")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--rebuild', action='store_true', help="清空并重建所有物品的签名")
+    parser.add_argument('--cluster', action='store_true', help="列出同一卖家重复发布的物品")
+    parser.add_argument('--show', type=int, default=20, help="最多显示的簇数")
+    args = parser.parse_args()
+    if not args.rebuild and not args.cluster:
+        parser.error("请指定 --rebuild 或 --cluster")
+    database.DB_FILE = args.db
+    database.init_db()
+
+    if args.rebuild:
+        start = time.perf_counter()
+        with database.write_transaction() as conn:
+            total = rebuild(conn)
+        print(f"已重建 {total} 个物品的签名，用时 {time.perf_counter() - start:.1f}s")
+    if args.cluster:
+        start = time.perf_counter()
+        conn = database.get_db_connection()
+        try:
+            groups = clusters(conn)
+            print(f"发现 {len(groups)} 组重复发布，共 {sum(map(len, groups))} 个物品，用时 {time.perf_counter() - start:.1f}s")
+            for group in groups[:args.show]:
+                names = {r['id']: (r['name'], r['username']) for r in conn.execute(f'''
+                    SELECT i.id, i.name, u.username FROM items i JOIN users u ON u.id = i.owner_id
+                    WHERE i.id IN ({','.join('?' * len(group))})''', group)}
+                name, username = names[group[0]]
+                print(f"  {username} 的 {len(group)} 个物品 \"{name}\": {', '.join(map(str, group))}")
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
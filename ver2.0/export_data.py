@@ -0,0 +1,157 @@
+'''
+数据导出 (供运营分析使用，如 pandas.read_csv / read_parquet)
+以 fetchmany 分块流式读取 items (关联类别名和发布者)、item_wants、messages，逐块写出 CSV，
+安装了 pyarrow 时同时可写出 Parquet (每块一个 row group)，内存占用与表大小无关
+物品的 specific_attributes 按 CategoryManager 的属性模板展开为 attr_<属性名> 列，模板之外的键保留在 attributes_extra (JSON) 中
+每张表在一个读事务中导出；非 WAL 模式下长时间的读事务会推迟写入提交，繁忙时可先用 backup_db.py 备份，再对备份文件导出 (--db)
+用法:
+    python export_data.py exports/
+    python export_data.py exports/ --format parquet --chunk-size 20000 --include-archived
+'''
+import os
+import csv
+import json
+import time
+import argparse
+from typing import Dict, List
+import database
+from database import get_db_connection, attach_archive
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # Parquet 导出为可选功能
+    pa = None
+
+# 每张导出表的查询和列类型 (用于 Parquet schema)，{items} 等占位符在合并归档时替换为合并视图
+_ITEM_COLUMNS = [
+    ('id', 'int'), ('name', 'str'), ('description', 'str'), ('category', 'str'), ('owner', 'str'),
+    ('buyer_id', 'int'), ('status', 'str'), ('price', 'float'), ('can_bargain', 'int'), ('address', 'str'),
+    ('created_at', 'str'), ('sold_at', 'str'), ('want_count', 'int'),
+]
+_EXPORTS = {
+    'items': ('''
+        SELECT i.id, i.name, i.description, c.name AS category, u.username AS owner, i.buyer_id, i.status, i.price,
+               i.can_bargain, i.address, i.created_at, i.sold_at, i.want_count, i.specific_attributes
+        FROM {items} i
+        JOIN categories c ON i.category_id = c.id
+        JOIN users u ON i.owner_id = u.id
+    ''', _ITEM_COLUMNS),
+    'item_wants': ('''
+        SELECT w.id, w.item_id, w.user_id, u.username AS user, w.offer_price, w.created_at
+        FROM {item_wants} w JOIN users u ON w.user_id = u.id
+    ''', [('id', 'int'), ('item_id', 'int'), ('user_id', 'int'), ('user', 'str'), ('offer_price', 'float'), ('created_at', 'str')]),
+    'messages': ('''
+        SELECT m.id, m.item_id, m.sender_id, u.username AS sender, m.content, m.reply_to_id, m.created_at
+        FROM {messages} m JOIN users u ON m.sender_id = u.id
+    ''', [('id', 'int'), ('item_id', 'int'), ('sender_id', 'int'), ('sender', 'str'), ('content', 'str'),
+          ('reply_to_id', 'int'), ('created_at', 'str')]),
+}
+
+
+def _attribute_columns(conn) -> List[str]:
+    '''所有类别属性模板中出现的属性名 (按出现顺序去重)，作为展开后的列'''
+    names = []
+    for r in conn.execute("SELECT attributes_template FROM categories ORDER BY id"):
+        for name in json.loads(r['attributes_template']):
+            if name not in names:
+                names.append(name)
+    return names
+
+
+class _TableWriter:
+    '''将一张表的分块数据写到 CSV 和/或 Parquet'''
+    def __init__(self, out_dir, table, columns, formats):
+        self.columns = columns
+        self.csv_file = self.csv_writer = self.parquet_writer = None
+        if 'csv' in formats:
+            # utf-8-sig 便于 Excel 直接打开中文内容
+            self.csv_file = open(os.path.join(out_dir, f"{table}.csv"), 'w', newline='', encoding='utf-8-sig')
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow([name for name, _ in columns])
+        if 'parquet' in formats:
+            types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+            self.schema = pa.schema([(name, types[kind]) for name, kind in columns])
+            self.parquet_writer = pq.ParquetWriter(os.path.join(out_dir, f"{table}.parquet"), self.schema)
+
+    def write(self, rows: List[tuple]):
+        if self.csv_writer:
+            self.csv_writer.writerows(rows)
+        if self.parquet_writer:
+            arrays = [list(col) for col in zip(*rows)]
+            self.parquet_writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        if self.csv_file:
+            self.csv_file.close()
+        if self.parquet_writer:
+            self.parquet_writer.close()
+
+
+def export_all(out_dir, formats=('csv',), chunk_size=10000, include_archived=False) -> Dict[str, int]:
+    '''流式导出所有表，返回各表导出的行数'''
+    if 'parquet' in formats and pa is None:
+        raise RuntimeError("导出 Parquet 需要安装 pyarrow")
+    os.makedirs(out_dir, exist_ok=True)
+    conn = get_db_connection()
+    tables = {'items': 'items', 'item_wants': 'item_wants', 'messages': 'messages'}
+    if include_archived:
+        attach_archive(conn)
+        tables = {name: f"all_{name}" for name in tables}
+    attr_names = _attribute_columns(conn)
+
+    counts = {}
+    try:
+        for table, (sql, columns) in _EXPORTS.items():
+            if table == 'items':
+                columns = columns + [(f"attr_{name}", 'str') for name in attr_names] + [('attributes_extra', 'str')]
+            writer = _TableWriter(out_dir, table, columns, formats)
+            cursor = conn.execute(sql.format(**tables))
+            counts[table] = 0
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if table == 'items':
+                        rows = [_flatten_item(r, attr_names) for r in rows]
+                    else:
+                        rows = [tuple(r) for r in rows]
+                    writer.write(rows)
+                    counts[table] += len(rows)
+            finally:
+                writer.close()
+    finally:
+        conn.close()
+    return counts
+
+
+def _flatten_item(row, attr_names) -> tuple:
+    '''将 specific_attributes 展开为模板属性列，模板之外的键以 JSON 保留'''
+    attrs = json.loads(row['specific_attributes'] or '{}')
+    values = [attrs.pop(name, None) for name in attr_names]
+    extra = json.dumps(attrs, ensure_ascii=False) if attrs else None
+    return tuple(row)[:-1] + tuple(None if v is None else str(v) for v in values) + (extra,)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式导出物品、意向和留言数据")
+    parser.add_argument('out_dir', nargs='?', default='exports')
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--format', choices=['csv', 'parquet', 'both'], default='csv')
+    parser.add_argument('--chunk-size', type=int, default=10000, help="每次 fetchmany 读取的行数")
+    parser.add_argument('--include-archived', action='store_true', help="同时导出归档库中的历史数据")
+    args = parser.parse_args()
+    if args.format != 'csv' and pa is None:
+        parser.error("导出 Parquet 需要安装 pyarrow")
+    database.DB_FILE = args.db
+    database.init_db()      # 补齐旧数据库缺少的列 (如 sold_at)
+
+    formats = ('csv', 'parquet') if args.format == 'both' else (args.format,)
+    start = time.perf_counter()
+    counts = export_all(args.out_dir, formats, args.chunk_size, args.include_archived)
+    print(f"已导出到 {args.out_dir}: {counts}，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
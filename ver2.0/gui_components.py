@@ -2,10 +2,27 @@ import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
 from typing import Dict, List, Optional
 import os
+import queue
 import shutil
+import threading
 import uuid
+from datetime import datetime, timedelta, timezone
 from PIL import Image, ImageTk
-from models import User, Item, CategoryManager, UserManager, ItemManager
+from models import User, Item, CategoryManager, UserManager, ItemManager, SEARCH_LIMIT, PRICE_BANDS
+import search_index
+import tracing
+
+ALL_CATEGORIES = "全部类别"     # 搜索类别下拉框中表示不限类别的选项
+SEARCH_DEBOUNCE_MS = 250        # 停止输入多久后开始搜索
+SEARCH_POLL_MS = 20             # 检查后台搜索结果的间隔
+STREAM_CHUNK = 20               # 每次事件循环向列表插入的行数
+STATUS_LABELS = {'active': '在售', 'wanted': '有人想要', 'reserved': '已预留', 'sold': '已售出'}
+# 搜索筛选：发布时间范围 (天数) 和物品状态的选项，"不限" 表示不筛选
+TIME_WINDOWS = {'不限': None, '24小时内': 1, '3天内': 3, '一周内': 7, '一月内': 30}
+ITEM_STATUS_CHOICES = {'不限': None, '在售': 'active', '已预留': 'reserved', '已售出': 'sold'}
+# 物品列表可点击排序的列 → (list_items 的排序列, 首次点击是否降序)；ID 按发布时间，状态按想要的人数
+SORTABLE_COLUMNS = {'id': ('created_at', True), 'name': ('name', False), 'price': ('price', False),
+                    'status': ('want_count', True)}
 
 # --- 基础/辅助窗口 ---
 
@@ -291,16 +308,36 @@ class UserManagementWindow(tk.Toplevel):
     '''
     用户管理窗口
     管理员用于查看用户列表和审批新注册用户
+    用户列表按页加载，待审批的用户排在最前
     '''
+    PAGE_SIZE = 100
+    STATUS_FILTERS = {"全部": None, "待审批": "pending", "已批准": "approved"}
+
     def __init__(self, parent, user_manager: UserManager):
         super().__init__(parent)
         self.title("用户管理")
         self.user_manager = user_manager
-        self.geometry("600x400")
+        self.geometry("600x450")
+        self.page = 0
+        self.total = 0
         
         frame = ttk.Frame(self, padding=10)
         frame.pack(fill="both", expand=True)
 
+        # 过滤条件
+        filter_frame = ttk.Frame(frame)
+        filter_frame.pack(fill="x", pady=(0, 5))
+        ttk.Label(filter_frame, text="状态:").pack(side="left")
+        self.status_combo = ttk.Combobox(filter_frame, values=list(self.STATUS_FILTERS), state="readonly", width=8)
+        self.status_combo.set("全部")
+        self.status_combo.pack(side="left", padx=5)
+        self.status_combo.bind("<<ComboboxSelected>>", lambda e: self.apply_filter())
+        ttk.Label(filter_frame, text="用户名:").pack(side="left")
+        self.keyword_entry = ttk.Entry(filter_frame, width=15)
+        self.keyword_entry.pack(side="left", padx=5)
+        self.keyword_entry.bind("<Return>", lambda e: self.apply_filter())
+        ttk.Button(filter_frame, text="筛选", command=self.apply_filter).pack(side="left")
+
         columns = ('username', 'role', 'status', 'address', 'phone')
         self.tree = ttk.Treeview(frame, columns=columns, show='headings')
         self.tree.heading('username', text='用户名')
@@ -309,23 +346,50 @@ class UserManagementWindow(tk.Toplevel):
         self.tree.heading('address', text='地址')
         self.tree.heading('phone', text='手机')
         self.tree.pack(fill="both", expand=True)
-        
-        self.refresh_users()
+
+        # 分页
+        page_frame = ttk.Frame(frame)
+        page_frame.pack(fill="x", pady=5)
+        ttk.Button(page_frame, text="上一页", command=lambda: self.goto_page(self.page - 1)).pack(side="left")
+        self.page_label = ttk.Label(page_frame, text="")
+        self.page_label.pack(side="left", padx=10)
+        ttk.Button(page_frame, text="下一页", command=lambda: self.goto_page(self.page + 1)).pack(side="left")
         
         btn_frame = ttk.Frame(frame)
-        btn_frame.pack(pady=10)
-        ttk.Button(btn_frame, text="批准选中用户", command=self.approve_selected).pack()
+        btn_frame.pack(pady=5)
+        ttk.Button(btn_frame, text="批准选中用户", command=self.approve_selected).pack(side="left", padx=5)
+        ttk.Button(btn_frame, text="批准全部待审批", command=self.approve_all_pending).pack(side="left", padx=5)
+
+        self.refresh_users()
+
+    def page_count(self) -> int:
+        return max(1, (self.total + self.PAGE_SIZE - 1) // self.PAGE_SIZE)
+
+    def apply_filter(self):
+        self.page = 0
+        self.refresh_users()
+
+    def goto_page(self, page):
+        if 0 <= page < self.page_count():
+            self.page = page
+            self.refresh_users()
 
     def refresh_users(self):
         '''
-        更新用户列表
+        按当前过滤条件和页码更新用户列表
         '''
         # 先删除
         for i in self.tree.get_children():
             self.tree.delete(i)
         # 后插入
-        for user in self.user_manager.get_all_users():
+        users, self.total = self.user_manager.list_users(
+            status=self.STATUS_FILTERS[self.status_combo.get()],
+            keyword=self.keyword_entry.get().strip() or None,
+            page=self.page, page_size=self.PAGE_SIZE
+        )
+        for user in users:
             self.tree.insert('', tk.END, values=(user.username, user.role, user.status, user.address, user.phone))
+        self.page_label.config(text=f"第 {self.page + 1}/{self.page_count()} 页 (共 {self.total} 人)")
 
     def approve_selected(self):
         '''
@@ -336,20 +400,17 @@ class UserManagementWindow(tk.Toplevel):
             messagebox.showwarning("提示", "请选择一个或多个待审批的用户。", parent=self)
             return
             
-        approved_count = 0
+        # 仅对状态为 'pending' (待审核) 的用户执行批准操作，在一个事务中批量提交
+        pending_usernames = []
         already_approved_or_admin = 0
-        # 获取用户的申请状态
         for item in selected_items:
             values = self.tree.item(item, 'values')
-            username = values[0]
-            status = values[2]
-            
-            # 仅对状态为 'pending' (待审核) 的用户执行批准操作
-            if status == 'pending':
-                if self.user_manager.approve_user(username):
-                    approved_count += 1
+            if values[2] == 'pending':
+                pending_usernames.append(values[0])
             else:
                 already_approved_or_admin += 1
+
+        approved_count = self.user_manager.approve_users(pending_usernames) if pending_usernames else 0
         
         if approved_count > 0:
             messagebox.showinfo("成功", f"{approved_count} 个用户的请求已被批准。", parent=self)
@@ -359,6 +420,16 @@ class UserManagementWindow(tk.Toplevel):
         else:
             messagebox.showerror("错误", "批准用户时发生未知错误。", parent=self)
 
+    def approve_all_pending(self):
+        '''
+        一次性批准所有待审批的用户
+        '''
+        if not messagebox.askyesno("确认", "确定批准所有待审批的用户吗？", parent=self):
+            return
+        approved_count = self.user_manager.approve_all_pending()
+        messagebox.showinfo("成功", f"{approved_count} 个用户的请求已被批准。", parent=self)
+        self.refresh_users()
+
 # --- 我的意向窗口 ---
 
 class MyWantsWindow(tk.Toplevel):
@@ -385,7 +456,9 @@ class MyWantsWindow(tk.Toplevel):
         tree.pack(fill="both", expand=True)
 
         for item in items:
-            status_text = "已售出" if item.status == 'sold' else "在售"
+            status_text = {"sold": "已售出", "reserved": "已预留"}.get(item.status, "在售")
+            if item.archived:
+                status_text += " (已归档)"
             tree.insert('', tk.END, values=(
                 item.name, item.category, f"¥{item.price}", status_text, 
                 item.owner_username, item.phone
@@ -464,6 +537,7 @@ class ItemDetailWindow(tk.Toplevel):
     物品详情窗口 (只读 + 留言板)
     展示物品的详细信息、图片以及留言互动区域
     '''
+    @tracing.traced('widget')
     def __init__(self, parent, item: Item, item_manager: ItemManager, current_user: User):
         super().__init__(parent)
         self.item = item
@@ -503,10 +577,11 @@ class ItemDetailWindow(tk.Toplevel):
             try:
                 img_path = item.image_paths[0]
                 if os.path.exists(img_path):
-                    pil_img = Image.open(img_path)
-                    # 调整图片大小，最大宽度 300
-                    pil_img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-                    self.photo = ImageTk.PhotoImage(pil_img)
+                    with tracing.span("加载图片", "image", path=img_path):
+                        pil_img = Image.open(img_path)
+                        # 调整图片大小，最大宽度 300
+                        pil_img.thumbnail((300, 300), Image.Resampling.LANCZOS)
+                        self.photo = ImageTk.PhotoImage(pil_img)
                     ttk.Label(scrollable_frame, image=self.photo).pack(anchor="w", pady=5)
             except Exception as e:
                 print(f"加载图片失败: {e}")
@@ -515,7 +590,13 @@ class ItemDetailWindow(tk.Toplevel):
         add_row("物品名称", item.name)
         add_row("类别", item.category)
         add_row("价格", f"¥{item.price}")
-        add_row("状态", "已售出" if item.status == 'sold' else ("在售" if item.want_count == 0 else f"{item.want_count}人想要"))
+        if item.status == 'sold':
+            status_text = "已售出 (已归档)" if item.archived else "已售出"
+        elif item.status == 'reserved':
+            status_text = f"已预留 (至 {item.reserved_until} UTC)"
+        else:
+            status_text = "在售" if item.want_count == 0 else f"{item.want_count}人想要"
+        add_row("状态", status_text)
         add_row("可砍价", "是" if item.can_bargain else "否")
         add_row("交易地点", item.address)
         add_row("物品说明", item.description)
@@ -533,6 +614,17 @@ class ItemDetailWindow(tk.Toplevel):
             ttk.Label(scrollable_frame, text="详细属性", font=("", 12, "bold")).pack(anchor="w", pady=(0, 10))
             for k, v in item.specific_attributes.items():
                 add_row(k, v)
+
+        # --- 相似物品 (归档物品不参与推荐) ---
+        if not item.archived:
+            ttk.Separator(scrollable_frame, orient="horizontal").pack(fill="x", pady=15)
+            ttk.Label(scrollable_frame, text="相似物品", font=("", 12, "bold")).pack(anchor="w", pady=(0, 10))
+            similar_items = self.item_manager.similar_items(item.id)
+            if not similar_items:
+                ttk.Label(scrollable_frame, text="暂无相似物品", foreground="gray").pack(anchor="w", pady=5)
+            for other in similar_items:
+                ttk.Button(scrollable_frame, text=f"{other.name}  ¥{other.price}",
+                           command=lambda o=other: ItemDetailWindow(self, o, self.item_manager, self.current_user)).pack(anchor="w", fill="x", pady=2)
         
         # --- 留言板区域 ---
         ttk.Separator(scrollable_frame, orient="horizontal").pack(fill="x", pady=15)
@@ -555,12 +647,18 @@ class ItemDetailWindow(tk.Toplevel):
         self.message_entry = ttk.Entry(input_row)
         self.message_entry.pack(side="left", fill="x", expand=True)
         
-        ttk.Button(input_row, text="发送", command=self.send_message).pack(side="left", padx=5)
+        send_button = ttk.Button(input_row, text="发送", command=self.send_message)
+        send_button.pack(side="left", padx=5)
         if self.current_user.username == self.item.owner_username:
              ttk.Button(input_row, text="取消回复", command=self.cancel_reply).pack(side="left")
+        # 已归档的物品是只读的历史记录，不再接受留言
+        if self.item.archived:
+            self.message_entry.config(state="disabled")
+            send_button.config(state="disabled")
 
         self.refresh_messages()
 
+    @tracing.traced('widget')
     def refresh_messages(self):
         '''
         刷新留言板内容
@@ -568,7 +666,7 @@ class ItemDetailWindow(tk.Toplevel):
         for widget in self.messages_frame.winfo_children():
             widget.destroy()
             
-        messages = self.item_manager.get_messages(self.item.id)
+        messages = self.item_manager.get_messages(self.item.id, include_archived=self.item.archived)
         if not messages:
             ttk.Label(self.messages_frame, text="暂无留言，快来提问吧！", foreground="gray").pack(anchor="w", pady=5)
             return
@@ -784,8 +882,11 @@ class ItemInfoWindow(tk.Toplevel):
                 "image_paths": image_paths,
                 "specific_attributes": specific_vals,
             }
-            self.item_manager.revise_item(self.item_to_edit.item_id, update_data)
-            messagebox.showinfo("成功", "物品修改成功！", parent=self)
+            success, msg = self.item_manager.revise_item(self.item_to_edit.item_id, update_data, self.item_to_edit.version)
+            if success:
+                messagebox.showinfo("成功", "物品修改成功！", parent=self)
+            else:
+                messagebox.showerror("修改失败", msg, parent=self)
 
         # 如果是创建，准备一个包含所有者和联系信息的完整数据包
         else: 
@@ -802,8 +903,14 @@ class ItemInfoWindow(tk.Toplevel):
                 "image_paths": image_paths,
                 "specific_attributes": specific_vals
             }
-            self.item_manager.create_item(**item_data)
-            messagebox.showinfo("成功", "物品添加成功！", parent=self)
+            duplicate_ids = self.item_manager.create_item(**item_data)
+            if duplicate_ids:
+                # 疑似重复发布只提示，不阻止
+                names = [item.name for item in map(self.item_manager.find_item_by_id, duplicate_ids) if item]
+                messagebox.showwarning("疑似重复发布", "物品已添加，但与你发布的以下物品几乎相同：\n" + "\n".join(names) +
+                                       "\n\n请不要重复发布同一物品，可修改原物品或将其删除。", parent=self)
+            else:
+                messagebox.showinfo("成功", "物品添加成功！", parent=self)
         
         # 统一的后续操作
         self.master.refresh_item_list()         # 调用父窗口的刷新方法
@@ -836,10 +943,13 @@ class MainView(ttk.Frame):
             
         ttk.Button(top_frame, text="修改选中", command=self.open_edit_item_window).pack(side="left", padx=5)
         ttk.Button(top_frame, text="删除选中", command=self.delete_selected_item).pack(side="left")
+        ttk.Button(top_frame, text="批量调价", command=self.reprice_selected_items).pack(side="left", padx=5)
         
         if self.current_user.role == 'user':
             ttk.Button(top_frame, text="购买", command=self.buy_item).pack(side="left", padx=5)
             ttk.Button(top_frame, text="确认售出", command=self.confirm_sold).pack(side="left")
+            ttk.Button(top_frame, text="预留", command=self.reserve_item).pack(side="left", padx=5)
+            ttk.Button(top_frame, text="取消预留", command=self.release_reservation).pack(side="left")
             ttk.Button(top_frame, text="我的意向", command=self.open_my_wants).pack(side="left", padx=5)
             ttk.Button(top_frame, text="有人想要", command=self.open_received_wants).pack(side="left")
             
@@ -850,87 +960,448 @@ class MainView(ttk.Frame):
         search_frame.pack(fill="x", padx=10, pady=5)
         
         ttk.Label(search_frame, text="类别:").pack(side="left")
-        self.search_category_combo = ttk.Combobox(search_frame, values=self.category_manager.get_all_categories(), state="readonly")
+        self.search_category_combo = ttk.Combobox(search_frame, values=[ALL_CATEGORIES] + self.category_manager.get_all_categories(), state="readonly")
+        self.search_category_combo.set(ALL_CATEGORIES)
         self.search_category_combo.pack(side="left", padx=5)
+
+        # 属性筛选：属性名来自所选类别的模板 (全部类别时为所有模板的并集)，值需完全相同 (不区分大小写)
+        ttk.Label(search_frame, text="属性:").pack(side="left")
+        self.search_attribute_combo = ttk.Combobox(search_frame, width=8, state="readonly")
+        self.search_attribute_combo.pack(side="left")
+        self.search_attribute_entry = ttk.Entry(search_frame, width=10)
+        self.search_attribute_entry.pack(side="left", padx=5)
+        self.update_attribute_choices()
         
         ttk.Label(search_frame, text="关键字:").pack(side="left")
         self.search_entry = ttk.Entry(search_frame, width=30)
         self.search_entry.pack(side="left", fill="x", expand=True, padx=5)
+        # 输入即搜索：停止输入 SEARCH_DEBOUNCE_MS 后在后台线程查询，回车或按钮立即搜索
+        self.search_entry.bind('<KeyRelease>', self.schedule_search)
+        self.search_entry.bind('<Return>', lambda e: self.search_items())
+        self.search_category_combo.bind('<<ComboboxSelected>>', self.on_search_category_selected)
+        self.search_attribute_combo.bind('<<ComboboxSelected>>', self.schedule_search)
+        self.search_attribute_entry.bind('<KeyRelease>', self.schedule_search)
+        self.search_cache = search_index.PrefixCache(SEARCH_LIMIT)
+        self._search_after = None           # 等待中的防抖定时器
+        self._search_generation = 0         # 每次新的搜索或刷新加一，旧的结果和逐批插入据此作废
+        self._search_running = False        # 同一时间只有一个后台查询
+        self._pending_search = None         # 后台查询进行中时到来的最新请求，更早的请求直接丢弃
+        self._search_results = queue.Queue()
+        self._searched_state = None         # 最近一次搜索的条件
         
         ttk.Button(search_frame, text="搜索", command=self.search_items).pack(side="left")
         ttk.Button(search_frame, text="显示全部", command=self.refresh_item_list).pack(side="left", padx=5)
 
+        self.hide_reserved_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_frame, text="隐藏已预留", variable=self.hide_reserved_var,
+                        command=self.refresh_item_list).pack(side="left")
+
+        # 默认只显示在线数据，勾选后合并查询归档库中的历史成交
+        self.include_archived_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_frame, text="包含已归档", variable=self.include_archived_var,
+                        command=self.refresh_item_list).pack(side="left", padx=5)
+
+        # --- 筛选区：价格区间、发布时间、状态、可砍价，与类别、关键字、属性一起生效 ---
+        filter_frame = ttk.Frame(self, padding=(10, 0))
+        filter_frame.pack(fill="x")
+        ttk.Label(filter_frame, text="价格:").pack(side="left")
+        self.min_price_entry = ttk.Entry(filter_frame, width=8)
+        self.min_price_entry.pack(side="left", padx=(5, 0))
+        ttk.Label(filter_frame, text="-").pack(side="left")
+        self.max_price_entry = ttk.Entry(filter_frame, width=8)
+        self.max_price_entry.pack(side="left", padx=(0, 10))
+        ttk.Label(filter_frame, text="发布时间:").pack(side="left")
+        self.time_window_combo = ttk.Combobox(filter_frame, values=list(TIME_WINDOWS), width=8, state="readonly")
+        self.time_window_combo.set('不限')
+        self.time_window_combo.pack(side="left", padx=(5, 10))
+        ttk.Label(filter_frame, text="状态:").pack(side="left")
+        self.item_status_combo = ttk.Combobox(filter_frame, values=list(ITEM_STATUS_CHOICES), width=6, state="readonly")
+        self.item_status_combo.set('不限')
+        self.item_status_combo.pack(side="left", padx=(5, 10))
+        self.bargain_only_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(filter_frame, text="只看可砍价", variable=self.bargain_only_var,
+                        command=self.search_items).pack(side="left")
+        # 下拉框和勾选立即搜索；价格输入时与关键字一样防抖，回车立即搜索
+        for entry in (self.min_price_entry, self.max_price_entry):
+            entry.bind('<KeyRelease>', self.schedule_search)
+            entry.bind('<Return>', lambda e: self.search_items())
+        self.time_window_combo.bind('<<ComboboxSelected>>', lambda e: self.search_items())
+        self.item_status_combo.bind('<<ComboboxSelected>>', lambda e: self.search_items())
+
+        # --- 分面区：搜索后显示各类别、状态、价格区间的物品数，点击即按其筛选 ---
+        self.facet_frame = ttk.Frame(self, padding=(10, 0))
+        self.facet_frame.pack(fill="x")
+        self.facet_status = None            # 选中的状态分组 (STATUS_LABELS 的键)
+        self.facet_price = None             # 选中的价格区间 (PRICE_BANDS 的下标)
+
         # --- 物品列表区 (Treeview) ---
         list_frame = ttk.Frame(self, padding=10)
         list_frame.pack(fill="both", expand=True)
 
+        # 点击列标题按该列排序 (再次点击反向)，由数据库排序并分页，"加载更多" 取下一页
+        # 搜索结果同样每次只取一页 (SEARCH_LIMIT 个)，"加载更多" 按 faceted_search 的 page 取下一页
+        self.sort_state = None              # (列, 是否降序)，None 表示未按列排序
+        self._sort_cursor = None            # 下一页的游标
+        self._search_paging = None          # (faceted_search 的参数, 已显示的页码)，None 表示没有可继续翻页的搜索结果
+        self.load_more_button = ttk.Button(list_frame, text="加载更多", command=self.load_more, state="disabled")
+        self.load_more_button.pack(side="bottom", pady=(5, 0))
+
         columns = ('id', 'name', 'category', 'price', 'status', 'bargain', 'owner')
+        self.headings = {'id': 'ID', 'name': '物品名称', 'category': '类别', 'price': '价格',
+                         'status': '状态', 'bargain': '可砍价', 'owner': '发布者'}
         self.tree = ttk.Treeview(list_frame, columns=columns, show='headings')
-        self.tree.heading('id', text='ID')
-        self.tree.heading('name', text='物品名称')
-        self.tree.heading('category', text='类别')
-        self.tree.heading('price', text='价格')
-        self.tree.heading('status', text='状态')
-        self.tree.heading('bargain', text='可砍价')
-        self.tree.heading('owner', text='发布者')
+        for column, text in self.headings.items():
+            if column in SORTABLE_COLUMNS:
+                self.tree.heading(column, text=text, command=lambda c=column: self.sort_by(c))
+            else:
+                self.tree.heading(column, text=text)
         
         self.tree.column('id', width=40)
         self.tree.pack(fill="both", expand=True)
+        self.row_versions = {}  # 列表中各物品显示时的版本号，批量删除时据此检测期间是否被他人修改
         
         # 配置列表行的颜色标记
         self.tree.tag_configure('sold', foreground='gray')      # 已售出: 灰色
         self.tree.tag_configure('wanted', foreground='red')     # 有人想要: 红色
         self.tree.tag_configure('active', foreground='green')   # 在售: 绿色
+        self.tree.tag_configure('reserved', foreground='orange')  # 已预留: 橙色
         
         self.refresh_item_list()
 
-    def refresh_item_list(self, items: Optional[List[Item]] = None):
+    @tracing.traced('widget')
+    def refresh_item_list(self, items: Optional[List[Item]] = None, ranked=False):
         '''
         从数据库获取最新数据并刷新列表显示，应用状态颜色
+        ranked=True 时按传入的顺序显示 (按相似度排序的搜索结果)，否则最新的物品在最上面
         '''
+        self._search_generation += 1        # 停止正在进行的输入即搜索显示
 
         # 先清除
         for i in self.tree.get_children():
             self.tree.delete(i)
         
         # 如果没有传入特定的 items (如搜索结果)，则获取所有物品
-        item_source = items if items is not None else self.item_manager.get_all_items()
-        for item in reversed(item_source):
-            # 状态翻译
-            tag = 'active'
-            if item.status == 'sold':
-                status_text = "已售出"
-                tag = 'sold'
+        if items is None:
+            self.search_cache.clear()       # 数据可能已修改，缓存的搜索结果失效
+            self._show_facets(None)
+            self._clear_sort()
+            items = self.item_manager.get_all_items(include_reserved=not self.hide_reserved_var.get(),
+                                                    include_archived=self.include_archived_var.get())
+        for item in (items if ranked else reversed(items)):
+            self._insert_item_row(item)
+
+    def _insert_item_row(self, item: Item):
+        '''在列表末尾插入一个物品行，按状态设置颜色'''
+        # 状态翻译
+        tag = 'active'
+        if item.status == 'sold':
+            status_text = "已售出 (已归档)" if item.archived else "已售出"
+            tag = 'sold'
+        elif item.status == 'reserved':
+            status_text = "已预留"
+            tag = 'reserved'
+        else:
+            if item.want_count == 0:
+                status_text = "在售"
+                tag = 'active'
             else:
-                if item.want_count == 0:
-                    status_text = "在售"
-                    tag = 'active'
-                else:
-                    status_text = f"{item.want_count}人想要"
-                    tag = 'wanted'
-            
-            bargain_text = "是" if item.can_bargain else "否"
-            
-            self.tree.insert('', tk.END, values=(
-                item.item_id, item.name, item.category, 
-                f"¥{item.price}", status_text, bargain_text, item.owner_username
-            ), tags=(tag,))
+                status_text = f"{item.want_count}人想要"
+                tag = 'wanted'
+        
+        bargain_text = "是" if item.can_bargain else "否"
+        
+        self.row_versions[item.item_id] = item.version
+        self.tree.insert('', tk.END, values=(
+            item.item_id, item.name, item.category, 
+            f"¥{item.price}", status_text, bargain_text, item.owner_username
+        ), tags=(tag,))
     
     def search_items(self):
         '''
-        执行搜索逻辑：必须选择类别，关键字匹配名称或描述
+        执行搜索逻辑：不选类别 (或选择全部类别) 时搜索所有类别，关键字匹配名称、描述、拼音或发布者，结果按相似度排序
+        选择属性并填写值时只显示该属性相同的物品，筛选区的价格、发布时间、状态、可砍价条件同时生效；不包含归档数据时同时显示分面计数，可点击分面继续筛选
         '''
-        category = self.search_category_combo.get()
-        keyword = self.search_entry.get().strip()
-        if not category:
-            messagebox.showwarning("提示", "请先选择一个搜索类别。")
+        self._cancel_scheduled_search()
+        if not self._check_price_entries():
             return
-        
-        results = self.item_manager.search_items(category, keyword)
-        self.refresh_item_list(results)     # 用查找到的物品更新显示的列表
+        self._clear_sort()
+        self._searched_state = self._search_state()
+        category, keyword = self._search_scope()
+        include_archived = self.include_archived_var.get()
+        epoch = self.search_cache.epoch
+        attributes = self._search_attributes()
+        filters = self._search_filters()
+        item_status = filters.pop('status')
+        if include_archived:
+            # 归档数据不在索引中，不提供分面
+            results = self.item_manager.search_items(category, keyword, include_reserved=not self.hide_reserved_var.get(),
+                                                     include_archived=True, attributes=attributes, status=item_status, **filters)
+            self.refresh_item_list(results, ranked=bool(keyword))
+            self._show_facets(None)
+        else:
+            query = dict(category_name=category, keyword=keyword, include_reserved=not self.hide_reserved_var.get(),
+                         attributes=attributes, status=self.facet_status, price_band=self.facet_price,
+                         item_status=item_status, **filters)
+            found = self.item_manager.faceted_search(**query)
+            results = found['items']
+            if keyword and self.facet_status is None and self.facet_price is None:
+                self.search_cache.put(self._cache_scope(category, attributes), keyword, results, epoch)
+            self.refresh_item_list(results, ranked=True)     # 用查找到的物品更新显示的列表 (已按相似度或发布时间排好)
+            self._show_facets(found)
+            # 只显示了第一页 (如不带关键字浏览整个类别)，其余的由 "加载更多" 逐页取出
+            self._search_paging = (query, 0)
+            self.load_more_button.config(state="normal" if len(results) < found['total'] else "disabled")
         if not results:
             messagebox.showinfo("提示", "没有找到匹配的物品。")
 
+    def sort_by(self, column):
+        '''点击列标题：按当前的类别、关键字、属性和筛选条件列出在线物品，按该列排序；重复点击同一列时反向'''
+        if self.include_archived_var.get():
+            messagebox.showinfo("提示", "按列排序只包含在线物品，请先取消勾选“包含已归档”。")
+            return
+        if not self._check_price_entries():
+            return
+        sort, descending = SORTABLE_COLUMNS[column]
+        if self.sort_state is not None and self.sort_state[0] == column:
+            descending = not self.sort_state[1]
+        self.sort_state = (column, descending)
+        for name, text in self.headings.items():
+            arrow = (" ▼" if descending else " ▲") if name == column else ""
+            self.tree.heading(name, text=text + arrow)
+        self._load_sorted_page(more=False)
+
+    def load_more(self):
+        '''加载更多：按列排序时取下一页游标之后的物品，否则取搜索结果的下一页'''
+        if self.sort_state is not None:
+            if self._sort_cursor is not None:
+                self._load_sorted_page(more=True)
+        elif self._search_paging is not None:
+            self._load_search_page()
+
+    def _load_search_page(self):
+        '''以相同的搜索条件取搜索结果的下一页，追加到列表末尾；已取完全部结果时禁用 "加载更多"'''
+        query, page = self._search_paging
+        page += 1
+        found = self.item_manager.faceted_search(page=page, **query)
+        for item in found['items']:
+            self._insert_item_row(item)
+        self._search_paging = (query, page)
+        more = found['items'] and (page + 1) * SEARCH_LIMIT < found['total']
+        self.load_more_button.config(state="normal" if more else "disabled")
+
+    def _load_sorted_page(self, more):
+        '''取排序后的第一页 (more=False，替换列表) 或下一页 (追加到列表末尾)'''
+        column, descending = self.sort_state
+        category, keyword = self._search_scope()
+        items, self._sort_cursor = self.item_manager.list_items(
+            SORTABLE_COLUMNS[column][0], descending, category, keyword or None,
+            include_reserved=not self.hide_reserved_var.get(), attributes=self._search_attributes(),
+            after=self._sort_cursor if more else None, **self._search_filters())
+        if more:
+            for item in items:
+                self._insert_item_row(item)
+        else:
+            self.refresh_item_list(items, ranked=True)
+            self._show_facets(None)
+        self.load_more_button.config(state="normal" if self._sort_cursor is not None else "disabled")
+
+    def _clear_sort(self):
+        '''回到未排序的显示 (搜索结果按相似度，全部物品按发布时间)'''
+        self.sort_state = self._sort_cursor = self._search_paging = None
+        for name, text in self.headings.items():
+            self.tree.heading(name, text=text)
+        self.load_more_button.config(state="disabled")
+
+    def _show_facets(self, found: Optional[Dict]):
+        '''按分面搜索的结果重建分面区；found 为 None 时清空'''
+        for widget in self.facet_frame.winfo_children():
+            widget.destroy()
+        if found is None:
+            return
+        total = f"共 {found['total']} 个" + (" (仅统计最新的匹配)" if found['truncated'] else "")
+        ttk.Label(self.facet_frame, text=total).pack(side="left", padx=(0, 10))
+        facets = found['facets']
+        groups = [
+            ("类别", [(name, n, lambda name=name: self.apply_facet(category=name)) for name, n in facets['category'].items()]),
+            ("状态", [(STATUS_LABELS[key], n, lambda key=key: self.apply_facet(status=key))
+                      for key in STATUS_LABELS if key in facets['status']]),
+            ("价格", [(self._price_band_label(band), n, lambda band=band: self.apply_facet(price_band=band))
+                      for band, n in sorted(facets['price'].items())]),
+        ]
+        for title, entries in groups:
+            if not entries:
+                continue
+            ttk.Label(self.facet_frame, text=f"{title}:").pack(side="left")
+            for label, n, command in entries:
+                ttk.Button(self.facet_frame, text=f"{label} ({n})", command=command).pack(side="left", padx=1)
+        if self.facet_status is not None or self.facet_price is not None:
+            ttk.Button(self.facet_frame, text="清除筛选", command=self.clear_facets).pack(side="left", padx=10)
+
+    @staticmethod
+    def _price_band_label(band) -> str:
+        low, high = PRICE_BANDS[band]
+        return f"¥{low}以上" if high is None else f"¥{low}-{high}"
+
+    def apply_facet(self, category=None, status=None, price_band=None):
+        '''点击分面：类别写入类别下拉框，状态和价格区间记为选中的分面，然后重新搜索'''
+        if category is not None:
+            self.search_category_combo.set(category)
+            self.update_attribute_choices()
+        if status is not None:
+            self.facet_status = status
+        if price_band is not None:
+            self.facet_price = price_band
+        self.search_items()
+
+    def clear_facets(self):
+        self.facet_status = self.facet_price = None
+        self.search_items()
+
+    def _search_scope(self):
+        category = self.search_category_combo.get()
+        return (None if category == ALL_CATEGORIES else category or None), self.search_entry.get().strip()
+
+    def _search_state(self):
+        return self._search_scope(), tuple(self._search_attributes().items()), self._filter_state()
+
+    def _filter_state(self):
+        '''筛选区的当前输入 (发布时间保存选项而不是具体时间，便于比较和作为缓存的范围)'''
+        return (self.min_price_entry.get().strip(), self.max_price_entry.get().strip(), self.time_window_combo.get(),
+                self.item_status_combo.get(), self.bargain_only_var.get())
+
+    def _search_filters(self, state=None) -> Dict:
+        '''筛选区的输入 → search_items / list_items 的筛选参数；无法解析的价格视为不限 (输入即搜索时不打扰用户)'''
+        min_price, max_price, window, status, bargain_only = state if state is not None else self._filter_state()
+        days = TIME_WINDOWS.get(window)
+        return {
+            'min_price': self._parse_price(min_price),
+            'max_price': self._parse_price(max_price),
+            'created_after': datetime.now(timezone.utc) - timedelta(days=days) if days else None,
+            'status': ITEM_STATUS_CHOICES.get(status),
+            'can_bargain': True if bargain_only else None,
+        }
+
+    @staticmethod
+    def _parse_price(text) -> Optional[float]:
+        try:
+            return float(text) if text else None
+        except ValueError:
+            return None
+
+    def _check_price_entries(self) -> bool:
+        for entry in (self.min_price_entry, self.max_price_entry):
+            text = entry.get().strip()
+            if text and self._parse_price(text) is None:
+                messagebox.showerror("错误", "价格必须是数字")
+                return False
+        return True
+
+    def _search_attributes(self) -> Dict[str, str]:
+        key = self.search_attribute_combo.get()
+        value = self.search_attribute_entry.get().strip()
+        return {key: value} if key and value else {}
+
+    def _cache_scope(self, category, attributes: Dict[str, str]):
+        return category, self.hide_reserved_var.get(), tuple(sorted(attributes.items())), self._filter_state()
+
+    def update_attribute_choices(self):
+        '''按所选类别更新可筛选的属性名，原来选中的属性不再适用时清空'''
+        category = self.search_category_combo.get()
+        if category and category != ALL_CATEGORIES:
+            keys = self.category_manager.get_attributes_for_category(category)
+        else:
+            keys = list(dict.fromkeys(key for c in self.category_manager.get_all() for key in c.attributes_template))
+        self.search_attribute_combo['values'] = [''] + keys
+        if self.search_attribute_combo.get() not in keys:
+            self.search_attribute_combo.set('')
+
+    def on_search_category_selected(self, event=None):
+        self.update_attribute_choices()
+        self.schedule_search()
+
+    def _cancel_scheduled_search(self):
+        if self._search_after is not None:
+            self.after_cancel(self._search_after)
+            self._search_after = None
+
+    def schedule_search(self, event=None):
+        '''输入变化时重新开始防抖计时，连续输入只在停下后搜索一次；搜索条件变了，之前选中的分面不再适用'''
+        if self._search_state() == self._searched_state:
+            return      # 方向键、回车等没有改变搜索条件的按键
+        self._cancel_scheduled_search()
+        self.facet_status = self.facet_price = None
+        self._show_facets(None)
+        self._search_after = self.after(SEARCH_DEBOUNCE_MS, self._start_typeahead_search)
+
+    def _start_typeahead_search(self):
+        '''
+        输入即搜索：命中缓存 (或可由缓存的前缀结果过滤) 时直接显示，否则交给后台线程查询
+        包含归档数据的搜索不使用缓存 (归档物品按子串匹配，不在索引中)
+        '''
+        self._search_after = None
+        self._searched_state = self._search_state()
+        category, keyword = self._search_scope()
+        if not keyword:
+            return
+        self._clear_sort()
+        self._search_generation += 1
+        include_archived = self.include_archived_var.get()
+        scope = self._cache_scope(category, self._search_attributes())
+        cached = None if include_archived else self.search_cache.get(scope, keyword)
+        if cached is not None:
+            self._stream_items(cached, self._search_generation)
+            return
+        request = (self._search_generation, self.search_cache.epoch, scope, keyword, include_archived)
+        if self._search_running:
+            self._pending_search = request      # 取代尚未开始的旧请求
+        else:
+            self._launch_search(request)
+
+    def _launch_search(self, request):
+        self._search_running = True
+        threading.Thread(target=self._search_worker, args=(request,), daemon=True).start()
+        self.after(SEARCH_POLL_MS, self._poll_search)
+
+    def _search_worker(self, request):
+        '''后台线程：只查询数据库，结果通过队列交回界面线程 (Tk 控件只能在界面线程中操作)'''
+        _, _, (category, hide_reserved, attributes, filter_state), keyword, include_archived = request
+        try:
+            results = self.item_manager.search_items(category, keyword, include_reserved=not hide_reserved,
+                                                     include_archived=include_archived, attributes=dict(attributes),
+                                                     **self._search_filters(filter_state))
+        except Exception as e:      # 例如数据库繁忙；输入即搜索失败时不弹窗打扰用户
+            print(f"输入即搜索失败: {e}")
+            results = None
+        self._search_results.put((request, results))
+
+    def _poll_search(self):
+        try:
+            request, results = self._search_results.get_nowait()
+        except queue.Empty:
+            self.after(SEARCH_POLL_MS, self._poll_search)
+            return
+        self._search_running = False
+        generation, epoch, scope, keyword, include_archived = request
+        if results is not None and not include_archived:
+            self.search_cache.put(scope, keyword, results, epoch)
+        pending, self._pending_search = self._pending_search, None
+        if pending is not None:
+            self._launch_search(pending)        # 已被取代的结果只进入缓存，不显示
+        elif results is not None and generation == self._search_generation:
+            self._stream_items(results, generation)
+
+    def _stream_items(self, items: List[Item], generation, start=0):
+        '''分批把结果插入列表，每批之间回到事件循环，使输入不卡顿；有更新的搜索或刷新时停止'''
+        if generation != self._search_generation:
+            return
+        if start == 0:
+            for i in self.tree.get_children():
+                self.tree.delete(i)
+        for item in items[start:start + STREAM_CHUNK]:
+            self._insert_item_row(item)
+        if start + STREAM_CHUNK < len(items):
+            self.after(1, self._stream_items, items, generation, start + STREAM_CHUNK)
+
     def open_add_item_window(self):
         if self.current_user.role == 'admin':
             messagebox.showinfo("提示", "管理员不能发布物品，仅用于管理系统。")
@@ -949,6 +1420,9 @@ class MainView(ttk.Frame):
         
         item_id = int(self.tree.item(selected_items[0], 'values')[0])
         item_to_edit = self.item_manager.find_item_by_id(item_id)
+        if not item_to_edit:
+            messagebox.showerror("错误", "该物品已归档或已被删除，无法修改。")
+            return
 
         # 只有发布者或者管理员才能修改物品信息
         if item_to_edit.owner_username != self.current_user.username and self.current_user.role != 'admin':
@@ -970,7 +1444,7 @@ class MainView(ttk.Frame):
             return
         
         item_id = int(self.tree.item(selected_items[0], 'values')[0])
-        item = self.item_manager.find_item_by_id(item_id)
+        item = self.item_manager.find_item_by_id(item_id, include_archived=self.include_archived_var.get())
         if item:
             ItemDetailWindow(self, item, self.item_manager, self.current_user)
 
@@ -1021,6 +1495,10 @@ class MainView(ttk.Frame):
         if not selected_items:
             messagebox.showwarning("提示", "请先选择一个物品。")
             return
+
+        if len(selected_items) > 1:
+            self.confirm_sold_reserved(selected_items)
+            return
         
         item_id = int(self.tree.item(selected_items[0], 'values')[0])
         item = self.item_manager.find_item_by_id(item_id)
@@ -1044,14 +1522,98 @@ class MainView(ttk.Frame):
 
         def on_buyer_selected(buyer):
             if messagebox.askyesno("确认售出", f"确定将 '{item.name}' 卖给 {buyer.username} 吗？\n物品状态将变为'已售出'。"):
-                self.item_manager.confirm_sold(item.item_id, buyer.id)
-                messagebox.showinfo("成功", "操作成功！")
+                # 携带打开时读到的版本号，若期间物品被修改、删除或已售出则返回冲突
+                success, msg = self.item_manager.confirm_sold(item.item_id, buyer.id, item.version)
+                if success:
+                    messagebox.showinfo("成功", "操作成功！")
+                else:
+                    messagebox.showerror("操作失败", msg)
                 self.refresh_item_list()
 
         BuyerSelectionWindow(self, wanters, on_buyer_selected)
 
+    def confirm_sold_reserved(self, selected_items):
+        '''
+        多选时批量确认售出：每个物品卖给其当前的预留买家，整批在一个事务中提交
+        未预留的物品需要单独选择买家，会被跳过
+        '''
+        if not messagebox.askyesno("确认售出", f"确定将选中的 {len(selected_items)} 个物品分别卖给其预留买家吗？\n物品状态将变为'已售出'。"):
+            return
+        sales = [(int(self.tree.item(sel, 'values')[0]), None) for sel in selected_items]
+        sold = self.item_manager.mark_sold_many(sales, self.current_user.id)
+        skipped = len(sales) - sold
+        if skipped:
+            messagebox.showwarning("部分未售出", f"已确认售出 {sold} 个物品，{skipped} 个物品不是您发布的预留物品，请单独选择买家。")
+        else:
+            messagebox.showinfo("成功", f"已确认售出 {sold} 个物品。")
+        self.refresh_item_list()
+
+    def _get_selected_own_item(self) -> Optional[Item]:
+        '''获取选中的物品，并检查是否为当前用户发布'''
+        selected_items = self.tree.selection()
+        if not selected_items:
+            messagebox.showwarning("提示", "请先选择一个物品。")
+            return None
+
+        item_id = int(self.tree.item(selected_items[0], 'values')[0])
+        item = self.item_manager.find_item_by_id(item_id)
+        if not item:
+            return None
+        if item.owner_username != self.current_user.username:
+            messagebox.showerror("错误", "您只能操作自己发布的物品。")
+            return None
+        return item
+
+    def reserve_item(self):
+        '''
+        卖家将物品预留给某个想要的买家一段时间，到期自动恢复在售
+        '''
+        item = self._get_selected_own_item()
+        if not item: return
+
+        if item.status != 'active':
+            messagebox.showerror("错误", "只有在售的物品可以预留。")
+            return
+
+        wanters = self.item_manager.get_item_wanters(item.item_id)
+        if not wanters:
+            messagebox.showinfo("提示", "目前还没有人想要这个物品，无法预留。")
+            return
+
+        def on_buyer_selected(buyer):
+            hours = simpledialog.askinteger("预留时长", f"为 {buyer.username} 预留多少小时?", parent=self,
+                                            initialvalue=24, minvalue=1, maxvalue=24 * 14)
+            if hours is None:
+                return
+            success, msg = self.item_manager.reserve_item(item.item_id, buyer.id, hours, item.version)
+            if success:
+                messagebox.showinfo("成功", f"已为 {buyer.username} 预留 {hours} 小时。")
+            else:
+                messagebox.showerror("操作失败", msg)
+            self.refresh_item_list()
+
+        BuyerSelectionWindow(self, wanters, on_buyer_selected)
+
+    def release_reservation(self):
+        '''
+        卖家提前取消预留
+        '''
+        item = self._get_selected_own_item()
+        if not item: return
+
+        if item.status != 'reserved':
+            messagebox.showerror("错误", "该物品当前没有被预留。")
+            return
+
+        success, msg = self.item_manager.release_reservation(item.item_id, item.version)
+        if success:
+            messagebox.showinfo("成功", msg)
+        else:
+            messagebox.showerror("操作失败", msg)
+        self.refresh_item_list()
+
     def open_my_wants(self):
-        items = self.item_manager.get_user_wants(self.current_user.id)
+        items = self.item_manager.get_user_wants(self.current_user.id, include_archived=True)   # 意向列表是历史视图，包含已归档的交易
         MyWantsWindow(self, items)
 
     def open_received_wants(self):
@@ -1068,21 +1630,42 @@ class MainView(ttk.Frame):
             return
         
         if messagebox.askyesno("确认删除", f"确定要删除选中的 {len(selected_items)} 个物品吗？"):
-            for sel in selected_items:
-                item_id = int(self.tree.item(sel, 'values')[0])
-                item = self.item_manager.find_item_by_id(item_id)
-                # 只有发布者或者管理员才能删除物品
-                if item and (item.owner_username == self.current_user.username or self.current_user.role == 'admin'):
-                    # 增加判断：已出售或有人想要的商品，非管理员不可删除
-                    if (item.status == 'sold' or item.want_count > 0) and self.current_user.role != 'admin':
-                        messagebox.showerror("权限限制", f"物品 '{item.name}' 已售出或有人想要，无法删除。")
-                    else:
-                        self.item_manager.delete_item(item_id)
-                else:
-                    messagebox.showerror("权限错误", f"您无权删除物品 '{item.name if item else '未知'}'。")
+            # 整批在一个事务中删除，权限检查由 delete_items 完成：
+            # 只有发布者或者管理员才能删除物品，已出售或有人想要的商品非管理员不可删除；
+            # 携带列表显示时的版本号，显示之后被他人修改、售出的物品不会被删除
+            item_ids = [int(self.tree.item(sel, 'values')[0]) for sel in selected_items]
+            versions = {item_id: self.row_versions[item_id] for item_id in item_ids if item_id in self.row_versions}
+            deleted = self.item_manager.delete_items(item_ids, self.current_user.id, self.current_user.role == 'admin', versions)
+            skipped = len(item_ids) - deleted
+            if skipped:
+                messagebox.showwarning("部分未删除", f"已删除 {deleted} 个物品，{skipped} 个物品因无权删除、已售出、有人想要或已被他人修改而被跳过。")
             
             self.refresh_item_list()    # 更新显示的列表
 
+    def reprice_selected_items(self):
+        '''
+        按原价的百分比批量调整选中物品的价格，整批在一个事务中提交
+        '''
+        selected_items = self.tree.selection()
+        if not selected_items:
+            messagebox.showwarning("提示", "请选择要调价的物品。")
+            return
+
+        percent = simpledialog.askfloat("批量调价", f"对选中的 {len(selected_items)} 个物品按原价的百分比调价\n(如 80 表示八折):",
+                                        parent=self, minvalue=0)
+        if percent is None: # 用户取消
+            return
+
+        # 新价格由数据库按当前价格计算，不使用列表中可能已过时的价格
+        item_ids = [int(self.tree.item(sel, 'values')[0]) for sel in selected_items]
+        updated = self.item_manager.reprice_many(item_ids, percent, self.current_user.id, self.current_user.role == 'admin')
+        skipped = len(item_ids) - updated
+        if skipped:
+            messagebox.showwarning("部分未调价", f"已调价 {updated} 个物品，{skipped} 个物品因无权修改、已售出或有人想要而被跳过。")
+        else:
+            messagebox.showinfo("成功", f"已调价 {updated} 个物品。")
+        self.refresh_item_list()
+
     def open_category_management(self):
         CategoryManagementWindow(self, self.category_manager)
 
@@ -0,0 +1,264 @@
+'''
+批量导入物品 (如社团的整批闲置物品)
+从 CSV 或 JSONL 读取物品，列/字段名与 export_data.py 导出的 items 一致:
+    name, description, category, owner, price, can_bargain, address,
+    specific_attributes (JSON 对象) 或 attr_<属性名> 列,
+    image_paths (JSON 列表或以 ; 分隔的路径，相对路径以导入文件所在目录为准)
+类别和发布者名称通过一次性构建的内存映射解析，specific_attributes 按类别模板校验；
+图片由线程池并行复制到 ITEM_IMG；每批通过 ItemManager.create_items 在一个 executemany 事务中插入，
+同一事务中记录导入进度，中断后重新运行同一命令即从上次提交的位置继续；
+搜索索引、相似向量和重复检测签名不逐批建立，在最后一批之后对新物品的整个ID范围一次建立 (导入期间新物品暂时搜索不到)
+不合格的记录写入 <导入文件>.rejects.jsonl 并附带原因
+用法:
+    python import_data.py club_inventory.csv
+    python import_data.py items.jsonl --db second_hand.db --batch-size 50000 --image-workers 8
+    python import_data.py items.csv --restart     # 忽略已有进度，从头导入
+'''
+import os
+import csv
+import json
+import math
+import time
+import uuid
+import shutil
+import argparse
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+import database
+from database import get_db_connection
+
+TARGET_ROWS_PER_S = 50000
+_TRUE_VALUES = {'1', 'true', 'yes', 'y', '是'}
+_FALSE_VALUES = {'', '0', 'false', 'no', 'n', '否'}
+# 共享编码器：json.dumps 带非默认参数时每次调用都会新建编码器
+_encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def read_records(path) -> Iterator[Dict]:
+    '''流式读取 CSV (带表头) 或 JSONL 文件，逐条返回记录'''
+    if path.lower().endswith('.jsonl'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            header = next(reader, [])
+            for row in reader:
+                yield dict(zip(header, row))
+
+
+def _truncate_rejects(path, done):
+    '''
+    继续导入前截掉 record_no 大于已提交进度的不合格记录：每批的不合格记录在提交进度之前写入，
+    中断发生在两者之间时该批会被重新读取，重新写入前先去掉上次写入的部分
+    '''
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        offset = 0
+        for line in f:
+            if json.loads(line)['record_no'] > done:
+                f.truncate(offset)
+                return
+            offset += len(line)
+
+
+def _parse_bool(value) -> int:
+    if isinstance(value, (bool, int)):
+        return int(bool(value))
+    text = str(value or '').strip().lower()
+    if text in _TRUE_VALUES:
+        return 1
+    if text in _FALSE_VALUES:
+        return 0
+    raise ValueError(f"无法识别的可砍价取值: {value}")
+
+
+class BulkImporter:
+    '''
+    批量导入器
+    构造时一次性读取类别 (含属性模板) 和普通用户，之后每条记录只做字典查找
+    '''
+    def __init__(self, item_manager, image_workers=8):
+        self.item_manager = item_manager
+        self.image_workers = image_workers
+        conn = get_db_connection()
+        self.categories = {r['name']: (r['id'], set(json.loads(r['attributes_template'])))
+                           for r in conn.execute("SELECT id, name, attributes_template FROM categories")}
+        self.owners = {r['username']: r['id'] for r in conn.execute("SELECT id, username FROM users WHERE role = 'user'")}
+        conn.close()
+
+    def _convert(self, record: Dict, base_dir, attr_columns=None) -> Tuple[tuple, List[str]]:
+        '''
+        校验一条记录，返回 (不含图片列的插入行, 待复制的图片源路径)，不合格时抛出 ValueError
+        attr_columns 为预先从表头提取的 [(列名, 属性名)]，省去逐条扫描所有列
+        '''
+        get = record.get
+        name = (get('name') or '').strip()
+        if not name:
+            raise ValueError("缺少物品名称")
+        category = self.categories.get(get('category'))
+        if category is None:
+            raise ValueError(f"未知类别: {get('category')}")
+        owner_id = self.owners.get(get('owner'))
+        if owner_id is None:
+            raise ValueError(f"未知发布者: {get('owner')}")
+        price = float(get('price') or 0)
+        if not math.isfinite(price):
+            raise ValueError(f"价格不是有限数: {get('price')}")
+        if price < 0:
+            raise ValueError(f"价格不能为负: {price}")
+
+        attrs = get('specific_attributes')
+        if isinstance(attrs, str):
+            attrs = json.loads(attrs) if attrs.strip() else {}
+        if not attrs:
+            if attr_columns is None:
+                attr_columns = [(key, key[5:]) for key in record if key.startswith('attr_')]
+            attrs = {attr: record[key] for key, attr in attr_columns if get(key) not in (None, '')}
+        # export_data.py 将模板之外的键导出到 attributes_extra，这里合并回来一起校验
+        extra = get('attributes_extra')
+        if extra:
+            attrs.update(json.loads(extra) if isinstance(extra, str) else extra)
+        if not attrs.keys() <= category[1]:
+            unknown = sorted(set(attrs) - category[1])
+            raise ValueError(f"属性不在类别 '{get('category')}' 的模板中: {', '.join(unknown)}")
+        attrs_json = _encode_json(attrs) if attrs else '{}'
+
+        images = get('image_paths') or []
+        if isinstance(images, str):
+            images = json.loads(images) if images.lstrip().startswith('[') else [p for p in images.split(';') if p.strip()]
+        sources = [p if os.path.isabs(p) else os.path.join(base_dir, p) for p in images]
+        for path in sources:
+            if not os.path.isfile(path):
+                raise ValueError(f"图片不存在: {path}")
+
+        row = (name, get('description') or '', category[0], owner_id, price,
+               _parse_bool(get('can_bargain')), get('address') or '', attrs_json)
+        return row, sources
+
+    @staticmethod
+    def _copy_images(sources: List[str]) -> List[str]:
+        '''与 ItemInfoWindow 一致：以随机文件名复制到 ITEM_IMG；中途失败时删除已复制的文件'''
+        targets = []
+        try:
+            for path in sources:
+                target = os.path.join(database.IMG_DIR, f"{uuid.uuid4().hex}{os.path.splitext(path)[1]}")
+                targets.append(target)
+                shutil.copyfile(path, target)
+        except Exception:
+            database.remove_image_files(targets)
+            raise
+        return targets
+
+    def _insert_batch(self, pool, rows, sources, checkpoint) -> Tuple[int, int]:
+        '''
+        并行复制一批记录的图片后插入，返回 (插入的行数, 复制的图片数)
+        任何一张图片复制失败或插入失败 (事务回滚) 时删除本批已复制的图片，不在 ITEM_IMG 中留下无人引用的文件
+        '''
+        # 只有带图片的记录才提交到线程池，纯文本导入不产生额外开销
+        futures = {i: pool.submit(self._copy_images, images) for i, images in enumerate(sources) if images}
+        copied, error = {}, None
+        for i, future in futures.items():      # 等待全部完成，失败的记录之外的复制结果也要收集以便清理
+            try:
+                copied[i] = future.result()
+            except Exception as e:
+                error = error or e
+        try:
+            if error is not None:
+                raise error
+            rows = [row + (_encode_json(copied[i]) if i in copied else '[]',) for i, row in enumerate(rows)]
+            inserted = self.item_manager.create_items(rows, checkpoint, defer_index=True)
+        except BaseException:
+            database.remove_image_files([target for targets in copied.values() for target in targets])
+            raise
+        return inserted, sum(len(targets) for targets in copied.values())
+
+    def run(self, path, batch_size=20000, restart=False) -> Dict:
+        source = os.path.abspath(path)
+        base_dir = os.path.dirname(source)
+        reject_path = source + '.rejects.jsonl'
+        if restart:
+            self.item_manager.clear_import_checkpoint(source)
+        done = self.item_manager.get_import_checkpoint(source)
+        report = {'source': source, 'resumed_from': done, 'read': 0, 'inserted': 0, 'rejected': 0, 'images_copied': 0, 'indexed': 0}
+        os.makedirs(database.IMG_DIR, exist_ok=True)
+
+        if done and not restart:
+            _truncate_rejects(reject_path, done)
+
+        start = time.perf_counter()
+        records = islice(read_records(path), done, None)
+        with ThreadPoolExecutor(max_workers=self.image_workers) as pool, \
+                open(reject_path, 'w' if restart or done == 0 else 'a', encoding='utf-8') as rejects:
+            while True:
+                chunk = list(islice(records, batch_size))
+                if not chunk:
+                    break
+                # CSV 的每条记录列相同，按表头预先提取属性列；JSONL 的字段可能不同，逐条提取
+                attr_columns = None
+                if not path.lower().endswith('.jsonl'):
+                    attr_columns = [(key, key[5:]) for key in chunk[0] if key.startswith('attr_')]
+                rows, sources, rejected = [], [], []
+                for offset, record in enumerate(chunk):
+                    try:
+                        row, images = self._convert(record, base_dir, attr_columns)
+                    except (ValueError, TypeError, AttributeError) as e:
+                        rejected.append(json.dumps({'record_no': done + offset + 1, 'reason': str(e), 'record': record},
+                                                   ensure_ascii=False) + '\n')
+                        continue
+                    rows.append(row)
+                    sources.append(images)
+
+                done += len(chunk)
+                # 本批不合格的记录在提交进度之前写入并落盘，提交之后中断也不会丢失；
+                # 提交之前中断时，继续导入会先截掉它们再重新写入 (见 _truncate_rejects)
+                if rejected:
+                    rejects.writelines(rejected)
+                    rejects.flush()
+                    os.fsync(rejects.fileno())
+                inserted, images_copied = self._insert_batch(pool, rows, sources, (source, done))
+                report['read'] += len(chunk)
+                report['inserted'] += inserted
+                report['rejected'] += len(rejected)
+                report['images_copied'] += images_copied
+        load_elapsed = time.perf_counter() - start
+        # 包括之前中断的运行中已提交、尚未建立索引的批次
+        report['indexed'] = self.item_manager.build_deferred_index(source)
+
+        elapsed = time.perf_counter() - start
+        report['elapsed_s'] = round(elapsed, 3)
+        report['index_s'] = round(elapsed - load_elapsed, 3)
+        # 吞吐量按逐批导入的阶段计算，最后一次建立索引的用时单独列出 (index_s)
+        report['rows_per_s'] = round(report['read'] / load_elapsed) if load_elapsed > 0 else None
+        if report['rejected'] == 0 and os.path.getsize(reject_path) == 0:
+            os.remove(reject_path)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从 CSV/JSONL 批量导入物品")
+    parser.add_argument('path', help="导入文件 (.csv 或 .jsonl)")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--batch-size', type=int, default=20000, help="每个事务插入的记录数")
+    parser.add_argument('--image-workers', type=int, default=8, help="并行复制图片的线程数")
+    parser.add_argument('--restart', action='store_true', help="忽略已有进度，从头导入")
+    parser.add_argument('--cache-mb', type=int, default=256, help="导入连接的页缓存大小 (MB)，减少大批量插入时的索引页换入换出")
+    args = parser.parse_args()
+    database.DB_FILE = args.db
+    database.add_connection_hook(lambda conn: conn.execute(f"PRAGMA cache_size = -{args.cache_mb * 1024}"))
+
+    from models import ItemManager    # 延迟导入：models 在导入时会对 database.DB_FILE 执行 init_db
+    report = BulkImporter(ItemManager(), args.image_workers).run(args.path, args.batch_size, args.restart)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if report['rows_per_s'] is not None and report['read'] >= args.batch_size:
+        status = "达到" if report['rows_per_s'] >= TARGET_ROWS_PER_S else "未达到"
+        print(f"吞吐量 {report['rows_per_s']} 行/秒，{status}目标 {TARGET_ROWS_PER_S} 行/秒；"
+              f"导入后为 {report['indexed']} 个物品建立索引用时 {report['index_s']}s")
+
+
+if __name__ == '__main__':
+    main()
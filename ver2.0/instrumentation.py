@@ -0,0 +1,352 @@
+import sqlite3
+import json
+import re
+import time
+import bisect
+import threading
+import functools
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+import database
+
+# 延迟直方图的桶上界 (毫秒)，最后一个桶收录所有超过 1000ms 的样本
+HISTOGRAM_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# 需要抓取执行计划的语句类型
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def normalize_sql(sql: str) -> str:
+    '''压缩空白字符，使同一条语句不论缩进如何都归为一类'''
+    return _WHITESPACE_RE.sub(' ', sql).strip()
+
+
+def _strip_literals(sql: str) -> str:
+    '''trace 回调收到的是展开了参数的 SQL，将字面量替换为 ? 以便按语句形态聚合'''
+    sql = _STRING_LITERAL_RE.sub('?', sql)
+    sql = _NUMBER_LITERAL_RE.sub('?', sql)
+    return normalize_sql(sql)
+
+
+class LatencyStats:
+    '''
+    延迟统计
+    记录调用次数、总耗时、最值、行数以及固定分桶的延迟直方图
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = 0.0
+        self.rows = 0
+        self.statements = 0     # 仅方法统计使用：SQLite 实际执行的语句数 (来自 trace 回调)
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, elapsed_ms, rows=0, statements=0):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.min_ms = elapsed_ms if self.min_ms is None else min(self.min_ms, elapsed_ms)
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+        self.statements += statements
+        self.buckets[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, elapsed_ms)] += 1
+
+    def percentile(self, p) -> float:
+        '''根据直方图估算百分位数，返回所在桶的上界 (溢出桶返回最大值)'''
+        if self.count == 0:
+            return 0.0
+        target = self.count * p / 100.0
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= target:
+                return HISTOGRAM_BOUNDS_MS[i] if i < len(HISTOGRAM_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'avg_ms': round(self.total_ms / self.count, 3) if self.count else 0.0,
+            'min_ms': round(self.min_ms or 0.0, 3),
+            'max_ms': round(self.max_ms, 3),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'rows': self.rows,
+            'statements': self.statements,
+            'histogram': {
+                **{f"<={b}ms": n for b, n in zip(HISTOGRAM_BOUNDS_MS, self.buckets)},
+                f">{HISTOGRAM_BOUNDS_MS[-1]}ms": self.buckets[-1],
+            },
+        }
+
+
+class _ProfiledCursor(sqlite3.Cursor):
+    '''
+    计时游标
+    非查询语句在 execute 返回时记录；查询语句的耗时包含取结果的时间 (SQLite 惰性求值，取结果时才真正扫描结果集):
+    fetchone / fetchmany / fetchall 在首次调用时记录，逐行迭代在迭代结束时记录；
+    结果未取完就执行下一条语句或关闭游标时，按已取的部分记录，不会丢失
+    '''
+    def __init__(self, connection):
+        super().__init__(connection)
+        self._pending = None    # 尚未记录的查询 [sql, 参数, 已计耗时, 已取行数]
+
+    def execute(self, sql, parameters=()):
+        self._flush()
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._after_execute(sql, parameters, start)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._flush()
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._after_execute(sql, seq_of_parameters[0] if seq_of_parameters else (), start)
+        return self
+
+    def _after_execute(self, sql, parameters, start):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if self.description is None:
+            self.connection.profiler.record_statement(self.connection, sql, parameters, elapsed_ms, max(self.rowcount, 0))
+            self._pending = None
+        else:
+            self._pending = [sql, parameters, elapsed_ms, 0]
+
+    def _accumulate(self, start, rows):
+        if self._pending is not None:
+            self._pending[2] += (time.perf_counter() - start) * 1000
+            self._pending[3] += rows
+
+    def _flush(self):
+        '''记录尚未记录的查询'''
+        if self._pending is None:
+            return
+        sql, parameters, elapsed_ms, rows = self._pending
+        self._pending = None
+        self.connection.profiler.record_statement(self.connection, sql, parameters, elapsed_ms, rows)
+
+    def _after_fetch(self, start, rows):
+        self._accumulate(start, rows)
+        self._flush()
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._after_fetch(start, 0)
+            raise
+        self._accumulate(start, 1)
+        return row
+
+    def close(self):
+        self._flush()
+        super().close()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._after_fetch(start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._after_fetch(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._after_fetch(start, len(rows))
+        return rows
+
+
+class _ProfiledConnection(sqlite3.Connection):
+    '''性能分析模式下使用的连接类，所有游标 (包括 conn.execute 的隐式游标) 都会计时'''
+    profiler = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or _ProfiledCursor)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class QueryProfiler:
+    '''
+    查询性能分析器
+    - 包装 UserManager / ItemManager / CategoryManager 实例的公开方法，统计每个方法的耗时、行数和执行语句数
+    - 通过连接工厂为每条 SQL 计时，并用 set_trace_callback 捕获 SQLite 实际执行的全部语句
+      (包括 sqlite3 模块隐式发出的 BEGIN / COMMIT)
+    - 超过阈值的语句连同 EXPLAIN QUERY PLAN 写入慢查询日志
+
+    未启用时不修改任何连接或方法，开销为零；启用后通过 disable() 完全撤销
+    '''
+    def __init__(self, slow_threshold_ms=50.0, slow_log_path='slow_queries.log'):
+        self.slow_threshold_ms = slow_threshold_ms
+        self.slow_log_path = slow_log_path
+        self.method_stats: Dict[str, LatencyStats] = defaultdict(LatencyStats)
+        self.sql_stats: Dict[str, LatencyStats] = defaultdict(LatencyStats)
+        self.traced_statements: Dict[str, int] = defaultdict(int)
+        self.slow_query_count = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wrapped: List[tuple] = []
+        self._enabled = False
+
+    # --- 启用 / 停用 ---
+
+    def enable(self, *managers):
+        '''开始统计：替换连接工厂并包装给定管理器实例的公开方法'''
+        if self._enabled:
+            return
+        self._enabled = True
+        database.set_connection_factory(_ProfiledConnection)
+        database.add_connection_hook(self._on_connect)
+        for manager in managers:
+            self._wrap_manager(manager)
+
+    def disable(self):
+        '''停止统计，恢复原始连接工厂和方法'''
+        if not self._enabled:
+            return
+        self._enabled = False
+        database.remove_connection_hook(self._on_connect)
+        database.set_connection_factory(sqlite3.Connection)
+        for manager, name in self._wrapped:
+            delattr(manager, name)      # 删除实例属性后恢复为类上的原方法
+        self._wrapped.clear()
+
+    def _on_connect(self, conn):
+        conn.profiler = self
+        conn.set_trace_callback(self._on_trace)
+
+    def _wrap_manager(self, manager):
+        owner = type(manager).__name__
+        for name in dir(type(manager)):
+            if name.startswith('_'):
+                continue
+            method = getattr(manager, name)
+            if callable(method):
+                setattr(manager, name, self._wrap_method(f"{owner}.{name}", method))
+                self._wrapped.append((manager, name))
+
+    def _wrap_method(self, qualified_name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            stack = self._stack()
+            frame = {'name': qualified_name, 'rows': 0, 'statements': 0}
+            stack.append(frame)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                stack.pop()
+                if stack:
+                    # 嵌套调用 (如 register_user -> register)：外层方法同样计入内层产生的行数和语句数
+                    stack[-1]['rows'] += frame['rows']
+                    stack[-1]['statements'] += frame['statements']
+                with self._lock:
+                    self.method_stats[qualified_name].add(elapsed_ms, frame['rows'], frame['statements'])
+        return wrapper
+
+    def _stack(self) -> List[Dict]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _current_method(self) -> Optional[str]:
+        stack = self._stack()
+        return stack[-1]['name'] if stack else None
+
+    # --- 采集 ---
+
+    def _on_trace(self, statement):
+        stack = self._stack()
+        if stack:
+            stack[-1]['statements'] += 1
+        key = _strip_literals(statement)
+        with self._lock:
+            self.traced_statements[key] += 1
+
+    def record_statement(self, conn, sql, parameters, elapsed_ms, rows):
+        '''由计时游标调用：记录单条语句的耗时和行数，超过阈值时写慢查询日志'''
+        key = normalize_sql(sql)
+        stack = self._stack()
+        if stack:
+            stack[-1]['rows'] += rows
+        with self._lock:
+            self.sql_stats[key].add(elapsed_ms, rows)
+        if elapsed_ms >= self.slow_threshold_ms:
+            self._log_slow_query(conn, key, parameters, elapsed_ms, rows)
+
+    def _explain(self, conn, sql, parameters) -> List[str]:
+        if not sql.upper().startswith(_EXPLAINABLE):
+            return []
+        try:
+            # 使用原生游标，避免执行计划查询本身被计时
+            cursor = conn.cursor(sqlite3.Cursor)
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parameters)
+            return [row[3] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            return [f"(无法获取执行计划: {e})"]
+
+    def _log_slow_query(self, conn, sql, parameters, elapsed_ms, rows):
+        plan = self._explain(conn, sql, parameters)
+        lines = [
+            f"[{datetime.now().isoformat(timespec='seconds')}] {elapsed_ms:.2f}ms rows={rows} method={self._current_method()}",
+            f"  SQL: {sql}",
+        ]
+        lines.extend(f"  PLAN: {p}" for p in plan)
+        with self._lock:
+            self.slow_query_count += 1
+            with open(self.slow_log_path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+
+    # --- 报告 ---
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {
+                'slow_threshold_ms': self.slow_threshold_ms,
+                'slow_query_count': self.slow_query_count,
+                'methods': {k: v.to_dict() for k, v in sorted(self.method_stats.items(), key=lambda kv: -kv[1].total_ms)},
+                'statements': {k: v.to_dict() for k, v in sorted(self.sql_stats.items(), key=lambda kv: -kv[1].total_ms)},
+                'traced_statements': dict(sorted(self.traced_statements.items(), key=lambda kv: -kv[1])),
+            }
+
+    def format_text(self, limit=20) -> str:
+        '''生成便于阅读的文本报告，按总耗时排序'''
+        data = self.summary()
+        header = f"{'count':>7} {'total':>10} {'avg':>8} {'p95':>8} {'max':>9} {'rows':>8}"
+        lines = [f"慢查询阈值: {data['slow_threshold_ms']}ms, 慢查询数: {data['slow_query_count']}", "", "== 方法 ==", header + f" {'stmts':>6}  name"]
+        for name, s in list(data['methods'].items())[:limit]:
+            lines.append(f"{s['count']:>7} {s['total_ms']:>8.1f}ms {s['avg_ms']:>6.2f}ms {s['p95_ms']:>6}ms "
+                         f"{s['max_ms']:>7.2f}ms {s['rows']:>8} {s['statements']:>6}  {name}")
+        lines += ["", "== SQL 语句 ==", header + "  sql"]
+        for sql, s in list(data['statements'].items())[:limit]:
+            lines.append(f"{s['count']:>7} {s['total_ms']:>8.1f}ms {s['avg_ms']:>6.2f}ms {s['p95_ms']:>6}ms "
+                         f"{s['max_ms']:>7.2f}ms {s['rows']:>8}  {sql[:120]}")
+        return "\n".join(lines)
+
+    def export(self, path, fmt='json'):
+        '''导出汇总报告，fmt 为 'json' 或 'text' '''
+        with open(path, 'w', encoding='utf-8') as f:
+            if fmt == 'json':
+                json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+            else:
+                f.write(self.format_text(limit=1000))
@@ -0,0 +1,255 @@
+'''
+多客户端并发负载测试
+启动多个进程，每个进程通过真实的 ItemManager / UserManager 接口按配置的比例执行
+浏览、搜索、想要、留言、修改、确认售出等操作，统计吞吐量、延迟分位数、SQLITE_BUSY/锁错误和丢失更新
+用法:
+    python load_test.py --items 5000 --processes 8 --duration 30 --journal-mode wal
+    python load_test.py --db my.db --mix browse=1,search=4,revise=4,confirm_sold=1 --no-cas
+'''
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import multiprocessing as mp
+from collections import defaultdict
+from typing import Dict, List
+import database
+import benchmark
+
+DEFAULT_MIX = {'browse': 1, 'search': 4, 'want': 2, 'message': 2, 'revise': 4, 'confirm_sold': 1}
+
+
+def _classify_error(e: Exception) -> str:
+    '''将数据库异常归类：SQLITE_BUSY / 锁错误 / 其他'''
+    name = getattr(e, 'sqlite_errorname', '') or ''
+    text = str(e).lower()
+    if name.startswith('SQLITE_BUSY') or 'busy' in text:
+        return 'SQLITE_BUSY'
+    if name.startswith('SQLITE_LOCKED') or 'locked' in text:
+        return 'database_locked'
+    return type(e).__name__
+
+
+class _Worker:
+    '''单个客户端进程中的操作执行器'''
+    def __init__(self, seed, hot_items, categories, user_ids, use_cas):
+        import models   # 在子进程中导入，使用已设置好的 database.DB_FILE
+        self.rng = random.Random(seed)
+        self.item_manager = models.ItemManager()
+        self.user_manager = models.UserManager()
+        self.hot_items = hot_items
+        self.categories = categories
+        self.user_ids = user_ids
+        self.use_cas = use_cas
+        self.increments = defaultdict(int)   # 本进程成功提交的 price +1 次数，用于检测丢失更新
+        self.sold = defaultdict(int)         # 本进程确认售出成功的次数，用于检测重复售出
+
+    def browse(self):
+        self.item_manager.get_all_items()
+        self.item_manager.get_messages(self.rng.choice(self.hot_items))
+
+    def search(self):
+        self.item_manager.search_items(self.rng.choice(self.categories), self.rng.choice(['耳机', '教材', '九成新', '']))
+
+    def want(self):
+        self.item_manager.add_want(self.rng.choice(self.hot_items), self.rng.choice(self.user_ids), 0.0)
+
+    def message(self):
+        self.item_manager.add_message(self.rng.choice(self.hot_items), self.rng.choice(self.user_ids), '压测留言')
+
+    def revise(self):
+        # 读-改-写：价格 +1。启用 CAS 时冲突会被拒绝；关闭 CAS 时并发写会互相覆盖，产生丢失更新
+        item_id = self.rng.choice(self.hot_items)
+        item = self.item_manager.find_item_by_id(item_id)
+        if item is None:
+            return
+        success, _ = self.item_manager.revise_item(item_id, {'price': item.price + 1},
+                                                   item.version if self.use_cas else None)
+        if success:
+            self.increments[item_id] += 1
+
+    def confirm_sold(self):
+        item_id = self.rng.choice(self.hot_items)
+        item = self.item_manager.find_item_by_id(item_id)
+        if item is None or item.status == 'sold':
+            return
+        wanters = self.item_manager.get_item_wanters(item_id)
+        if not wanters:
+            return
+        success, _ = self.item_manager.confirm_sold(item_id, self.rng.choice(wanters).id,
+                                                    item.version if self.use_cas else None)
+        if success:
+            self.sold[item_id] += 1
+
+
+def _worker_main(index, db_path, busy_timeout_ms, mix, duration, seed, hot_items, categories, user_ids, use_cas, start_at, queue):
+    database.DB_FILE = db_path
+    if busy_timeout_ms is not None:
+        database.add_connection_hook(lambda conn: conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}"))
+    worker = _Worker(seed + index, hot_items, categories, user_ids, use_cas)
+    ops, weights = list(mix.keys()), list(mix.values())
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    # 所有进程在同一时刻开始，保证并发度
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        op = worker.rng.choices(ops, weights)[0]
+        start = time.perf_counter()
+        try:
+            getattr(worker, op)()
+            latencies[op].append((time.perf_counter() - start) * 1000)
+        except sqlite3.Error as e:
+            errors[op][_classify_error(e)] += 1
+
+    queue.put({
+        'latencies': dict(latencies),
+        'errors': {op: dict(v) for op, v in errors.items()},
+        'increments': dict(worker.increments),
+        'sold': dict(worker.sold),
+    })
+
+
+def _percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def _snapshot(db_path, hot_items) -> Dict[int, Dict]:
+    with sqlite3.connect(db_path) as conn:
+        marks = ','.join('?' * len(hot_items))
+        rows = conn.execute(f"SELECT id, price, version, status FROM items WHERE id IN ({marks})", hot_items)
+        return {r[0]: {'price': r[1], 'version': r[2], 'status': r[3]} for r in rows}
+
+
+def run_load(db_path, processes=4, duration=10.0, mix=None, journal_mode=None, busy_timeout_ms=None,
+             hot_item_count=20, use_cas=True, seed=42) -> Dict:
+    '''执行一次负载测试并返回汇总报告'''
+    mix = mix or DEFAULT_MIX
+    with sqlite3.connect(db_path) as conn:
+        if journal_mode:
+            conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+        actual_journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        categories = [r[0] for r in conn.execute("SELECT name FROM categories")]
+        user_ids = [r[0] for r in conn.execute("SELECT id FROM users WHERE role = 'user' LIMIT 1000")]
+        # 热点物品：在售且已有人想要，保证修改和售出操作之间存在竞争
+        hot_items = [r[0] for r in conn.execute('''
+            SELECT id FROM items WHERE status = 'active' AND id IN (SELECT item_id FROM item_wants) LIMIT ?
+        ''', (hot_item_count,))]
+    if not hot_items:
+        raise ValueError("数据库中没有可用作热点的在售物品 (需要有购买意向的 active 物品)")
+
+    before = _snapshot(db_path, hot_items)
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    start_at = time.time() + 1.0 + processes * 0.2    # 预留子进程启动时间
+    procs = [ctx.Process(target=_worker_main, args=(i, db_path, busy_timeout_ms, mix, duration, seed, hot_items,
+                                                    categories, user_ids, use_cas, start_at, queue))
+             for i in range(processes)]
+    for p in procs:
+        p.start()
+    outputs = [queue.get() for _ in procs]
+    for p in procs:
+        p.join()
+    after = _snapshot(db_path, hot_items)
+
+    # 汇总延迟和错误
+    latencies, errors = defaultdict(list), defaultdict(lambda: defaultdict(int))
+    increments, sold = defaultdict(int), defaultdict(int)
+    for out in outputs:
+        for op, values in out['latencies'].items():
+            latencies[op].extend(values)
+        for op, errs in out['errors'].items():
+            for kind, n in errs.items():
+                errors[op][kind] += n
+        for item_id, n in out['increments'].items():
+            increments[int(item_id)] += n
+        for item_id, n in out['sold'].items():
+            sold[int(item_id)] += n
+
+    ops_report = {}
+    total_ok = 0
+    for op in mix:
+        values = sorted(latencies.get(op, []))
+        total_ok += len(values)
+        ops_report[op] = {
+            'ok': len(values),
+            'throughput_per_s': round(len(values) / duration, 1),
+            'p50_ms': round(_percentile(values, 50), 3),
+            'p95_ms': round(_percentile(values, 95), 3),
+            'p99_ms': round(_percentile(values, 99), 3),
+            'max_ms': round(values[-1], 3) if values else 0.0,
+            'errors': dict(errors.get(op, {})),
+        }
+
+    # 丢失更新：成功提交的 +1 次数与价格实际增量不一致；重复售出：同一物品被多次确认售出成功
+    lost_updates = sum(max(0, increments[i] - round(after[i]['price'] - before[i]['price'])) for i in hot_items if i in after)
+    double_sold = sum(1 for n in sold.values() if n > 1)
+    error_totals = defaultdict(int)
+    for errs in errors.values():
+        for kind, n in errs.items():
+            error_totals[kind] += n
+
+    return {
+        'config': {'db': db_path, 'processes': processes, 'duration_s': duration, 'mix': mix,
+                   'journal_mode': actual_journal_mode, 'busy_timeout_ms': busy_timeout_ms,
+                   'hot_items': len(hot_items), 'cas': use_cas},
+        'throughput_per_s': round(total_ok / duration, 1),
+        'operations': ops_report,
+        'errors': dict(error_totals),
+        'anomalies': {'lost_updates': lost_updates, 'double_sold_items': double_sold},
+    }
+
+
+def _parse_mix(text) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        op, _, weight = part.partition('=')
+        if op not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"未知操作: {op}，可选 {', '.join(DEFAULT_MIX)}")
+        mix[op] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="二手交易系统多进程并发负载测试")
+    parser.add_argument('--db', help="目标数据库 (默认在合成数据副本上运行)")
+    parser.add_argument('--items', type=int, default=5000, help="未指定 --db 时生成的合成数据规模")
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10.0, help="持续时间 (秒)")
+    parser.add_argument('--mix', type=_parse_mix, default=DEFAULT_MIX, help="操作比例，如 browse=1,search=4,revise=2")
+    parser.add_argument('--journal-mode', choices=['delete', 'truncate', 'persist', 'wal'], help="测试前设置的日志模式")
+    parser.add_argument('--busy-timeout', type=int, help="每个连接的 busy_timeout (毫秒)，默认使用 sqlite3 的 5 秒")
+    parser.add_argument('--hot-items', type=int, default=20, help="竞争热点物品数量")
+    parser.add_argument('--no-cas', action='store_true', help="修改/售出时不带版本号，用于对照丢失更新")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="将报告保存为 JSON")
+    args = parser.parse_args()
+
+    db_path = args.db
+    if not db_path:
+        source = benchmark.ensure_dataset(args.items, args.seed)
+        db_path = source.replace('.db', '.load.db')
+        with sqlite3.connect(source) as src, sqlite3.connect(db_path) as dst:
+            src.backup(dst)
+
+    report = run_load(db_path, args.processes, args.duration, args.mix, args.journal_mode, args.busy_timeout,
+                      args.hot_items, not args.no_cas, args.seed)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if not args.db:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+    sys.exit(1 if report['anomalies']['lost_updates'] or report['anomalies']['double_sold_items'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox
-from models import UserManager, ItemManager, CategoryManager
+from models import UserManager, ItemManager, CategoryManager, ReservationSweeper
 from gui_components import LoginView, MainView, CreateAdminView
+from instrumentation import QueryProfiler
+import tracing
 
 class App(tk.Tk):
     '''
@@ -16,6 +19,23 @@ class App(tk.Tk):
         self.item_manager = ItemManager()
         self.category_manager = CategoryManager()
 
+        # 可选的查询性能分析：设置环境变量 SECOND_HAND_PROFILE=1 启用，SECOND_HAND_SLOW_MS 设置慢查询阈值
+        self.profiler = None
+        if os.environ.get('SECOND_HAND_PROFILE'):
+            self.profiler = QueryProfiler(slow_threshold_ms=float(os.environ.get('SECOND_HAND_SLOW_MS', 50)))
+            self.profiler.enable(self.user_manager, self.item_manager, self.category_manager)
+
+        # 可选的界面延迟追踪：设置环境变量 SECOND_HAND_TRACE=1 (或输出文件路径) 启用，退出时写出 Chrome Trace JSON
+        self.tracer = None
+        trace_path = os.environ.get('SECOND_HAND_TRACE')
+        if trace_path:
+            self.tracer = tracing.enable('ui_trace.json' if trace_path == '1' else trace_path)
+            tracing.trace_managers(self.user_manager, self.item_manager, self.category_manager)
+
+        # 后台线程：定期释放已到期的物品预留
+        self.reservation_sweeper = ReservationSweeper(self.item_manager)
+        self.reservation_sweeper.start()
+
         # 全局状态变量
         self.current_user = None
         self._current_view = None
@@ -135,4 +155,12 @@ class App(tk.Tk):
 
 if __name__ == '__main__':
     app = App()
-    app.mainloop()
\ No newline at end of file
+    app.mainloop()
+
+    # 退出时导出性能分析报告和界面追踪文件
+    if app.profiler:
+        app.profiler.export('profile_report.json')
+        print(app.profiler.format_text())
+    if app.tracer:
+        app.tracer.save()
+        print(f"界面追踪已写入 {app.tracer.output_path}")
\ No newline at end of file
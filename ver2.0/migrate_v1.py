@@ -0,0 +1,204 @@
+'''
+从 ver1.0 迁移物品 (database.xlsx → SQLite)
+以 openpyxl 只读模式逐行读取工作簿，不把整个表格载入内存
+ver1.0 修改物品时会在表格末尾追加同一 item id 的新行，因此每个 id 只保留最后出现的一行 (最新版本)；
+ver1.0 删除的物品在保存时已从表格中去掉，缺少名称或联系人的行视为无效并跳过
+每个联系人对应一个占位用户 (用户名 v1_<联系人>，随机密码，无法登录)，物品归入指定类别 (默认 "其他"，不存在时自动创建)
+迁移结果记录在 legacy_v1_items 中，重复执行只插入新物品、更新有变化的物品，可在切换期间多次运行
+新插入物品的搜索索引、相似向量和重复检测签名在最后一批之后一次建立 (与 import_data.py 相同，起点记录在 import_checkpoints 中，中断后下次运行补上)
+用法:
+    python migrate_v1.py ../ver1.0/database.xlsx
+    python migrate_v1.py ../ver1.0/database.xlsx --db second_hand.db --category 其他 --batch-size 5000
+    python migrate_v1.py ../ver1.0/database.xlsx --prune    # 同时删除 ver1.0 中已不存在的已迁移物品
+'''
+import os
+import json
+import time
+import hashlib
+import argparse
+from typing import Dict, Iterator, List, Tuple
+import database
+import search_index
+import similar
+import duplicates
+from database import get_db_connection, write_transaction
+
+try:
+    import openpyxl
+except ImportError:     # 只有迁移工具需要 openpyxl
+    openpyxl = None
+
+V1_COLUMNS = ('item id', 'item name', 'item description', 'contact information')
+USERNAME_PREFIX = 'v1_'
+
+
+def read_latest_items(path) -> Dict[int, Tuple[str, str, str]]:
+    '''流式读取工作簿，返回 {ver1.0 物品ID: (名称, 描述, 联系人)}，同一 id 以最后一行为准'''
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(v).strip() if v is not None else '' for v in next(rows, ())]
+        missing = [name for name in V1_COLUMNS if name not in header]
+        if missing:
+            raise ValueError(f"工作簿缺少列: {', '.join(missing)}")
+        positions = [header.index(name) for name in V1_COLUMNS]
+
+        latest = {}
+        for row in rows:
+            item_id, name, desc, contact = (row[i] if i < len(row) else None for i in positions)
+            if item_id is None:
+                continue
+            item_id = int(float(item_id))       # pandas 写出的整数列可能是浮点数
+            name, desc, contact = (_cell_text(v) for v in (name, desc, contact))
+            if not name or not contact:
+                # 无效的新版本覆盖旧版本时，该 id 整体视为无效
+                latest.pop(item_id, None)
+                continue
+            latest[item_id] = (name, desc, contact)
+        return latest
+    finally:
+        workbook.close()
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)      # 纯数字的联系电话会被读成浮点数
+    return str(value).strip()
+
+
+def placeholder_username(contact) -> str:
+    '''由联系人生成确定的占位用户名，过长时截断并附加哈希以保持唯一'''
+    if len(contact) <= 24:
+        return USERNAME_PREFIX + contact
+    return f"{USERNAME_PREFIX}{contact[:15]}_{hashlib.sha1(contact.encode()).hexdigest()[:8]}"
+
+
+def _contact_info(contact) -> str:
+    info = {"address": "", "phone": "", "email": ""}
+    info['email' if '@' in contact else 'phone'] = contact
+    return json.dumps(info, ensure_ascii=False)
+
+
+def _chunks(items: List, size) -> Iterator[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class V1Migrator:
+    '''将 ver1.0 物品分批写入 ver2.0 数据库，每批一个写事务'''
+    def __init__(self, category='其他'):
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("INSERT OR IGNORE INTO categories (name, attributes_template) VALUES (?, '[]')", (category,))
+            cursor.execute("SELECT id FROM categories WHERE name = ?", (category,))
+            self.category_id = cursor.fetchone()['id']
+
+    @staticmethod
+    def _ensure_owners(cursor, contacts) -> Dict[str, int]:
+        '''创建缺少的占位用户 (随机盐和哈希，任何密码都无法通过验证)，返回 {联系人: 用户ID}'''
+        usernames = {contact: placeholder_username(contact) for contact in contacts}
+        cursor.executemany('''
+            INSERT OR IGNORE INTO users (username, password_hash, salt, role, status, contact_info)
+            VALUES (?, ?, ?, 'user', 'approved', ?)
+        ''', [(username, os.urandom(32), os.urandom(16), _contact_info(contact)) for contact, username in usernames.items()])
+        ids = {}
+        for batch in _chunks(list(usernames.values()), 500):
+            cursor.execute(f"SELECT id, username FROM users WHERE username IN ({','.join('?' * len(batch))})", batch)
+            ids.update((r['username'], r['id']) for r in cursor.fetchall())
+        return {contact: ids[username] for contact, username in usernames.items()}
+
+    def _migrate_batch(self, batch: List[Tuple[int, Tuple[str, str, str]]], source) -> Dict[str, int]:
+        counts = {'inserted': 0, 'updated': 0, 'skipped_deleted': 0}
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            owners = self._ensure_owners(cursor, {contact for _, (_, _, contact) in batch})
+            v1_ids = [v1_id for v1_id, _ in batch]
+            cursor.execute(f'''
+                SELECT l.v1_id, l.item_id, i.id IS NOT NULL AS present
+                FROM legacy_v1_items l LEFT JOIN items i ON i.id = l.item_id
+                WHERE l.v1_id IN ({','.join('?' * len(v1_ids))})
+            ''', v1_ids)
+            mapped = {r['v1_id']: (r['item_id'], r['present']) for r in cursor.fetchall()}
+
+            updates, changed = [], []
+            for v1_id, (name, desc, contact) in batch:
+                owner_id = owners[contact]
+                if v1_id not in mapped:
+                    cursor.execute('''
+                        INSERT INTO items (name, description, category_id, owner_id, price, can_bargain, address)
+                        VALUES (?, ?, ?, ?, 0, 0, '')
+                    ''', (name, desc, self.category_id, owner_id))
+                    if not counts['inserted']:
+                        database.defer_index(cursor, source, cursor.lastrowid)
+                    cursor.execute("INSERT INTO legacy_v1_items (v1_id, item_id) VALUES (?, ?)", (v1_id, cursor.lastrowid))
+                    counts['inserted'] += 1
+                elif mapped[v1_id][1]:
+                    updates.append((name, desc, owner_id, mapped[v1_id][0]))
+                else:
+                    # 已在新系统中删除 (或已归档) 的物品不再重新创建
+                    counts['skipped_deleted'] += 1
+
+            # 只更新内容有变化的物品，版本号 +1 使打开中的编辑窗口能检测到冲突
+            cursor.executemany('''
+                UPDATE items SET name = ?1, description = ?2, owner_id = ?3, version = version + 1
+                WHERE id = ?4 AND (name IS NOT ?1 OR description IS NOT ?2 OR owner_id IS NOT ?3)
+            ''', updates)
+            counts['updated'] = cursor.rowcount if updates else 0
+            # 内容未变的物品重新索引结果相同，这里不区分；新插入的物品在 run 的最后一次建立索引
+            changed.extend(item_id for _, _, _, item_id in updates)
+            search_index.index_items(cursor, changed)
+            similar.index_items(cursor, changed)
+            duplicates.index_items(cursor, changed)
+        return counts
+
+    def prune(self, keep_ids) -> int:
+        '''删除 ver1.0 中已不存在的已迁移物品 (连同意向、留言)，返回删除的物品数'''
+        conn = get_db_connection()
+        stale = [(r['v1_id'], r['item_id']) for r in conn.execute("SELECT v1_id, item_id FROM legacy_v1_items")
+                 if r['v1_id'] not in keep_ids]
+        conn.close()
+        if not stale:
+            return 0
+        from models import ItemManager    # 复用 delete_items 的级联删除
+        deleted = ItemManager().delete_items([item_id for _, item_id in stale], operator_id=None, is_admin=True)
+        with write_transaction() as conn:
+            conn.executemany("DELETE FROM legacy_v1_items WHERE v1_id = ?", [(v1_id,) for v1_id, _ in stale])
+        return deleted
+
+    def run(self, path, batch_size=5000, prune=False) -> Dict:
+        start = time.perf_counter()
+        latest = read_latest_items(path)
+        source = os.path.abspath(path)
+        report = {'source': source, 'v1_items': len(latest),
+                  'inserted': 0, 'updated': 0, 'skipped_deleted': 0}
+        for batch in _chunks(sorted(latest.items()), batch_size):
+            for key, value in self._migrate_batch(batch, source).items():
+                report[key] += value
+        report['indexed'] = database.build_deferred_index(source)
+        if prune:
+            report['pruned'] = self.prune(latest.keys())
+        report['elapsed_s'] = round(time.perf_counter() - start, 3)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="将 ver1.0 的 database.xlsx 迁移到 ver2.0 数据库")
+    parser.add_argument('path', help="ver1.0 的 database.xlsx")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--category', default='其他', help="迁移物品所属的类别，不存在时自动创建")
+    parser.add_argument('--batch-size', type=int, default=5000, help="每个事务写入的物品数")
+    parser.add_argument('--prune', action='store_true', help="删除 ver1.0 中已不存在的已迁移物品")
+    args = parser.parse_args()
+    if openpyxl is None:
+        parser.error("迁移需要安装 openpyxl")
+    database.DB_FILE = args.db
+    database.init_db()      # 创建 legacy_v1_items 等新表
+
+    report = V1Migrator(args.category).run(args.path, args.batch_size, args.prune)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
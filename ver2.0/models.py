@@ -2,8 +2,14 @@ import sqlite3
 import json
 import os
 import hashlib
+import threading
+from datetime import date, datetime, timezone
 from typing import List, Dict, Optional, Tuple
-from database import get_db_connection, init_db
+import database
+from database import get_db_connection, init_db, write_transaction, remove_image_files, attach_archive, table_columns, ARCHIVED_TABLES
+import search_index
+import similar
+import duplicates
 
 # 确保模块加载时数据库已初始化
 init_db()
@@ -41,7 +47,8 @@ class Item:
     包含物品的所有属性，以及为了方便UI显示而关联查询出的额外字段（如卖家名、类别名）
     '''
     def __init__(self, id, name, description, category_id, owner_id, status, price, can_bargain, address, specific_attributes, image_paths,
-                 category_name=None, owner_username=None, phone=None, email=None, buyer_id=None, want_count=0):
+                 category_name=None, owner_username=None, phone=None, email=None, buyer_id=None, want_count=0, version=0,
+                 reserved_by=None, reserved_until=None, archived=False):
         self.id = id
         self.name = name
         self.description = description
@@ -55,6 +62,10 @@ class Item:
         self.image_paths = image_paths
         self.buyer_id = buyer_id
         self.want_count = want_count
+        self.version = version      # 乐观锁版本号，修改/删除/售出时用于冲突检测
+        self.reserved_by = reserved_by          # 预留给的买家ID
+        self.reserved_until = reserved_until    # 预留到期时间 (UTC)
+        self.archived = archived    # 是否来自归档库 (只读的历史数据)
         
         # GUI 兼容性字段 (通过 JOIN 查询获取)
         self.category = category_name if category_name else str(category_id)
@@ -165,14 +176,51 @@ class UserManager:
         conn.close()
         return [User(r['id'], r['username'], r['role'], r['status'], json.loads(r['contact_info'])) for r in rows]
 
-    def approve_user(self, username):
-        '''管理员批准用户注册'''
+    def list_users(self, status=None, keyword=None, page=0, page_size=100) -> Tuple[List[User], int]:
+        '''
+        分页获取用户列表 (用于管理员界面)，返回 (当前页用户, 符合条件的总数)
+        按 status DESC 排序使 'pending' 排在 'approved' 之前，配合 idx_users_status 索引无需额外排序
+        '''
+        where, params = [], []
+        if status:
+            where.append("status = ?")
+            params.append(status)
+        if keyword:
+            where.append("username LIKE ?")
+            params.append(f"%{keyword}%")
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("UPDATE users SET status = 'approved' WHERE username = ?", (username,))
-        conn.commit()
+        cursor.execute(f"SELECT COUNT(*) FROM users {where_sql}", params)
+        total = cursor.fetchone()[0]
+        cursor.execute(f'''
+            SELECT id, username, role, status, contact_info FROM users {where_sql}
+            ORDER BY status DESC, id DESC
+            LIMIT ? OFFSET ?
+        ''', params + [page_size, page * page_size])
+        rows = cursor.fetchall()
         conn.close()
-        return True
+        return [User(r['id'], r['username'], r['role'], r['status'], json.loads(r['contact_info'])) for r in rows], total
+
+    def approve_user(self, username):
+        '''管理员批准用户注册'''
+        return self.approve_users([username]) > 0
+
+    def approve_users(self, usernames: List[str]) -> int:
+        '''批量批准用户注册，在一个事务内完成，返回实际由 pending 变为 approved 的人数'''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany("UPDATE users SET status = 'approved' WHERE username = ? AND status = 'pending'",
+                               [(name,) for name in usernames])
+            return cursor.rowcount
+
+    def approve_all_pending(self) -> int:
+        '''批准所有待审批用户 (走 status 索引)，返回批准人数'''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE users SET status = 'approved' WHERE status = 'pending'")
+            return cursor.rowcount
 
     def has_admin(self) -> bool:
         '''检查数据库中是否存在管理员'''
@@ -260,24 +308,57 @@ class CategoryManager:
         conn.commit()
         conn.close()
 
+# 关键字搜索最多返回的物品数
+SEARCH_LIMIT = 100
+# 物品详情中推荐的相似物品数
+SIMILAR_LIMIT = 6
+# 发布物品时最多提示的疑似重复物品数
+DUPLICATE_LIMIT = 5
+# 分面搜索的状态分组 (有人想要 = 在售且有购买意向) 和价格区间 [下限, 上限)，上限为 None 表示不设上限
+STATUS_BUCKETS = ('active', 'wanted', 'reserved', 'sold')
+PRICE_BANDS = ((0, 50), (50, 200), (200, 1000), (1000, None))
+# list_items 可排序的列
+SORT_COLUMNS = {'price': 'i.price', 'created_at': 'i.created_at', 'want_count': 'i.want_count', 'name': 'i.name'}
+# 发布时间筛选只给出一端时，另一端用这两个值补齐 (created_at 为 'YYYY-MM-DD HH:MM:SS' 格式的 UTC 时间)
+EARLIEST_TIME, LATEST_TIME = '0000-00-00 00:00:00', '9999-12-31 23:59:59'
+# 带关键字排序时，匹配数超过此值则沿排序索引逐行检查是否匹配，否则先取出全部匹配再排序
+BROAD_MATCHES = 20000
+# 排序时，命中不超过此行数的最窄区间条件用它的索引取出再排序，否则沿排序列的索引逐行检查
+DRIVING_ROWS = 20000
+
+def _timestamp(value) -> str:
+    '''datetime (无时区时视为 UTC)、date 或字符串 → 与 created_at 可比较的时间字符串'''
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d 00:00:00')
+    return str(value)
+
 class ItemManager:
     '''
     物品管理器
     负责物品的发布、搜索、交易流程及留言管理
     '''
-    def _fetch_items(self, where_clause="", params=()) -> List[Item]:
+    def _fetch_items(self, where_clause="", params=(), include_archived=False) -> List[Item]:
         '''
         核心查询方法
         执行带有 JOIN 的 SQL 查询，将 items 表与 users, categories 表关联，
         并转换 JSON 字段为 Python 对象
+        include_archived=True 时通过合并视图同时查询归档库
         '''
         conn = get_db_connection()
         cursor = conn.cursor()
+        items_table = 'items'
+        if include_archived:
+            attach_archive(conn)
+            items_table = 'all_items'
         
-        sql = '''
-            SELECT i.*, c.name as category_name, u.username as owner_username, u.contact_info,
-            (SELECT COUNT(*) FROM item_wants w WHERE w.item_id = i.id) as want_count
-            FROM items i
+        # want_count 直接取 items 表中由触发器维护的列
+        sql = f'''
+            SELECT i.*, c.name as category_name, u.username as owner_username, u.contact_info
+            FROM {items_table} i
             JOIN categories c ON i.category_id = c.id
             JOIN users u ON i.owner_id = u.id
         '''
@@ -288,32 +369,40 @@ class ItemManager:
         rows = cursor.fetchall()
         conn.close()
         
-        items = []
-        for r in rows:
-            contact = json.loads(r['contact_info'])
-            items.append(Item(
-                id=r['id'],
-                name=r['name'],
-                description=r['description'],
-                category_id=r['category_id'],
-                owner_id=r['owner_id'],
-                status=r['status'],
-                price=r['price'],
-                can_bargain=r['can_bargain'],
-                address=r['address'],
-                specific_attributes=json.loads(r['specific_attributes']),
-                image_paths=json.loads(r['image_paths']),
-                category_name=r['category_name'],
-                owner_username=r['owner_username'],
-                phone=contact.get('phone', ''),
-                email=contact.get('email', ''),
-                buyer_id=r['buyer_id'],
-                want_count=r['want_count']
-            ))
-        return items
+        return [self._row_to_item(r) for r in rows]
+
+    def _row_to_item(self, r) -> Item:
+        '''将带有 JOIN 字段的查询结果行转换为 Item 对象'''
+        contact = json.loads(r['contact_info'])
+        return Item(
+            id=r['id'],
+            name=r['name'],
+            description=r['description'],
+            category_id=r['category_id'],
+            owner_id=r['owner_id'],
+            status=r['status'],
+            price=r['price'],
+            can_bargain=r['can_bargain'],
+            address=r['address'],
+            specific_attributes=json.loads(r['specific_attributes']),
+            image_paths=json.loads(r['image_paths']),
+            category_name=r['category_name'],
+            owner_username=r['owner_username'],
+            phone=contact.get('phone', ''),
+            email=contact.get('email', ''),
+            buyer_id=r['buyer_id'],
+            want_count=r['want_count'],
+            version=r['version'],
+            reserved_by=r['reserved_by'],
+            reserved_until=r['reserved_until'],
+            archived=bool(r['archived']) if 'archived' in r.keys() else False
+        )
 
-    def create_item(self, name, description, price, can_bargain, address, phone, email, category, owner_username, specific_attributes, image_paths=None):
-        '''创建新物品，处理外键关联和 JSON 数据序列化'''
+    def create_item(self, name, description, price, can_bargain, address, phone, email, category, owner_username, specific_attributes, image_paths=None) -> List[int]:
+        '''
+        创建新物品，处理外键关联和 JSON 数据序列化
+        返回同一卖家与新物品内容几乎相同的未售出物品ID (疑似重复发布，见 duplicates.py)，没有时为空列表；只提示，不阻止发布
+        '''
         conn = get_db_connection()
         cursor = conn.cursor()
         
@@ -340,55 +429,463 @@ class ItemManager:
                 INSERT INTO items (name, description, category_id, owner_id, price, can_bargain, address, specific_attributes, image_paths)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (name, description, category_id, owner_id, price, can_bargain, address, json.dumps(specific_attributes, ensure_ascii=False), json.dumps(image_paths, ensure_ascii=False)))
+            item_id = cursor.lastrowid
+            search_index.index_items(cursor, [item_id])
+            similar.index_items(cursor, [item_id])
+            duplicates.index_items(cursor, [item_id])
+            found = [other for other, _ in duplicates.find_duplicates(cursor, item_id, DUPLICATE_LIMIT)]
             conn.commit()
+            return found
         finally:
             conn.close()
 
-    def get_all_items(self) -> List[Item]:
-        '''获取所有物品 (包括已售出)'''
-        return self._fetch_items()
+    def create_items(self, rows: List[tuple], checkpoint: Optional[Tuple[str, int]] = None, defer_index=False) -> int:
+        '''
+        批量创建物品，整批在一个事务中通过 executemany 插入，返回插入的数量
+        每行是已解析外键、已序列化 JSON 的元组，供导入工具使用 (见 import_data.py)：
+        (name, description, category_id, owner_id, price, can_bargain, address, specific_attributes_json, image_paths_json)
+        checkpoint=(source, rows_done) 时在同一事务中记录导入进度，中断后从该位置恢复不会重复插入
+        defer_index=True 时不建立搜索索引、相似向量和重复检测签名，只在进度中记下本批的起始ID (需要 checkpoint)，
+        由 build_deferred_index 在最后一批之后对整个ID范围一次建立；中断后重新运行导入仍会为之前的批次补上
+        '''
+        if defer_index and not checkpoint:
+            raise ValueError("延迟建立索引需要记录导入进度 (checkpoint)")
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM items")
+            last_id = cursor.fetchone()[0]
+            # 插入期间关闭逐行生成属性行的触发器，插入后用一条语句为整批物品生成
+            cursor.execute("INSERT INTO bulk_insert (active) VALUES (1)")
+            cursor.executemany('''
+                INSERT INTO items (name, description, category_id, owner_id, price, can_bargain, address, specific_attributes, image_paths)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            inserted = cursor.rowcount
+            cursor.execute("DELETE FROM bulk_insert")
+            database.add_attribute_rows(cursor, last_id + 1)
+            if defer_index:
+                # 写事务中没有其他插入，本批物品就是 id 大于插入前最大值的那些
+                database.defer_index(cursor, checkpoint[0], last_id + 1)
+            else:
+                cursor.execute("SELECT id FROM items WHERE id > ?", (last_id,))
+                item_ids = [r['id'] for r in cursor.fetchall()]
+                search_index.index_items(cursor, item_ids)
+                similar.index_items(cursor, item_ids)
+                duplicates.index_items(cursor, item_ids)
+            if checkpoint:
+                cursor.execute('''
+                    INSERT INTO import_checkpoints (source, rows_done) VALUES (?, ?)
+                    ON CONFLICT(source) DO UPDATE SET rows_done = excluded.rows_done, updated_at = CURRENT_TIMESTAMP
+                ''', checkpoint)
+        return inserted
+
+    def build_deferred_index(self, source) -> int:
+        '''为 create_items(defer_index=True) 插入的物品一次建立索引，返回建立索引的物品数 (见 database.build_deferred_index)'''
+        return database.build_deferred_index(source)
 
-    def search_items(self, category_name, keyword) -> List[Item]:
-        '''根据类别和关键字搜索物品'''
-        # 先获取 category_id
+    def get_import_checkpoint(self, source) -> int:
+        '''返回某个导入文件已处理的记录数，没有记录时为 0'''
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM categories WHERE name = ?", (category_name,))
-        row = cursor.fetchone()
+        row = conn.execute("SELECT rows_done FROM import_checkpoints WHERE source = ?", (source,)).fetchone()
         conn.close()
-        
-        if not row:
-            return []
-            
-        category_id = row['id']
-        
-        where = "i.category_id = ?"
-        params = []
-        params.append(category_id)
-        
-        if keyword:
-            where += " AND (i.name LIKE ? OR i.description LIKE ? OR u.username LIKE ?)"
+        return row['rows_done'] if row else 0
+
+    def clear_import_checkpoint(self, source):
+        '''清除导入进度；仍有延迟建立的索引时保留其起点，只把进度归零'''
+        conn = get_db_connection()
+        conn.execute("DELETE FROM import_checkpoints WHERE source = ? AND index_from IS NULL", (source,))
+        conn.execute("UPDATE import_checkpoints SET rows_done = 0 WHERE source = ?", (source,))
+        conn.commit()
+        conn.close()
+
+    def get_all_items(self, include_reserved=True, include_archived=False) -> List[Item]:
+        '''
+        获取所有物品 (包括已售出但尚未归档的)
+        include_reserved=False 时过滤掉预留中的物品 (走 status 索引)
+        include_archived=True 时合并归档库中的历史物品
+        '''
+        if not include_reserved:
+            return self._fetch_items("i.status IN ('active', 'sold')", include_archived=include_archived)
+        return self._fetch_items(include_archived=include_archived)
+
+    def search_items(self, category_name=None, keyword=None, include_reserved=True, include_archived=False,
+                     limit=SEARCH_LIMIT, attributes: Optional[Dict[str, str]] = None, min_price=None, max_price=None,
+                     created_after=None, created_before=None, status=None, can_bargain=None) -> List[Item]:
+        '''
+        搜索物品：category_name 为空时搜索所有类别；有关键字时通过 search_index 的全文索引匹配名称、描述、拼音和发布者，
+        按相似度从高到低返回最多 limit 个；没有关键字时返回类别下的所有物品
+        attributes 为 {属性名: 值} 时只返回这些属性都相等 (不区分大小写) 的物品，如 {'品牌': 'Apple'}
+        min_price、max_price 为价格区间 (含两端)，created_after、created_before 为发布时间区间 [起, 止)，
+        status 为物品状态 (active/reserved/sold)，can_bargain 为是否可砍价，均为 None 时不限，见 _listing_filters
+        include_reserved=False 时过滤掉预留中的物品，include_archived=True 时附加归档库中匹配的历史物品 (归档数据不建索引，按子串匹配)
+        '''
+        filters, params = [], []
+        if category_name:
+            filters.append("i.category_id = (SELECT id FROM categories WHERE name = ?)")
+            params.append(category_name)
+        if not include_reserved:
+            filters.append("i.status IN ('active', 'sold')")
+        listing_filters, listing_params = self._listing_filters(min_price, max_price, created_after, created_before,
+                                                                status, can_bargain)
+        filters.extend(listing_filters)
+        params.extend(listing_params)
+
+        if not keyword:
+            attribute_filters, attribute_params = self._attribute_filters(attributes, include_archived=include_archived)
+            return self._fetch_items(" AND ".join(filters + attribute_filters), tuple(params + attribute_params), include_archived)
+
+        items = []
+        category_id = self._category_id(category_name) if category_name else None
+        queries = search_index.build_queries(keyword, category_id, attributes)
+        if queries is not None and (category_id is not None or not category_name):
+            rank_filters, rank_params = self._attribute_filters(attributes, per_row=True)
+            if not include_reserved:
+                rank_filters.append("i.status IN ('active', 'sold')")
+            rank_filters.extend(listing_filters)
+            rank_params.extend(listing_params)
+            ids = self._rank_matches(queries, rank_filters, rank_params, limit)
+            by_id = {item.id: item for item in self._fetch_items(f"i.id IN ({','.join('?' * len(ids))})", tuple(ids))} if ids else {}
+            items = [by_id[item_id] for item_id in ids if item_id in by_id]
+        if include_archived:
             kw = f"%{keyword}%"
-            params.extend([kw, kw, kw])
-            
-        return self._fetch_items(where, tuple(params))
+            archived_filters, archived_params = self._attribute_filters(attributes, archived_only=True)
+            where = " AND ".join(filters + archived_filters + ["i.archived = 1", "(i.name LIKE ? OR i.description LIKE ? OR u.username LIKE ?)"])
+            items.extend(self._fetch_items(where, tuple(params + archived_params) + (kw, kw, kw), include_archived=True))
+        return items
 
-    def find_item_by_id(self, item_id) -> Optional[Item]:
-        items = self._fetch_items("i.id = ?", (item_id,))
-        return items[0] if items else None
+    def similar_items(self, item_id, limit=SIMILAR_LIMIT) -> List[Item]:
+        '''
+        与物品内容最相似的在售物品 (名称、描述的 TF-IDF 余弦相似度，见 similar.py)，按相似度从高到低返回最多 limit 个
+        相似度不区分物品状态，多取一些候选再过滤掉已预留、已售出的物品
+        '''
+        ids = [other for other, _ in similar.find_similar(item_id, limit * 4)]
+        if not ids:
+            return []
+        by_id = {item.id: item for item in self._fetch_items(f"i.id IN ({','.join('?' * len(ids))}) AND i.status = 'active'", tuple(ids))}
+        return [by_id[other] for other in ids if other in by_id][:limit]
+
+    @staticmethod
+    def _listing_filters(min_price=None, max_price=None, created_after=None, created_before=None, status=None,
+                         can_bargain=None, unindexed=()) -> Tuple[List[str], List]:
+        '''
+        价格、发布时间、状态和可砍价筛选条件 (物品表别名 i)
+        每种条件只有一种写法并按固定顺序排列，区间只给出一端时另一端补齐为不受限的值，
+        因此各种筛选组合最多产生 16 种语句，语句缓存和查询计划都保持稳定；
+        价格和发布时间区间由 idx_items_price、idx_items_created_at 及按状态、类别的复合索引支持，
+        unindexed 中的列 ('price'、'created_at') 加一元 + 使查询计划不用它的索引，只逐行检查
+        '''
+        filters, params = [], []
+        if min_price is not None or max_price is not None:
+            filters.append(f"{'+' if 'price' in unindexed else ''}i.price BETWEEN ? AND ?")
+            params.extend([float('-inf') if min_price is None else float(min_price),
+                           float('inf') if max_price is None else float(max_price)])
+        if created_after is not None or created_before is not None:
+            filters.append("+i.created_at >= ? AND +i.created_at < ?" if 'created_at' in unindexed
+                           else "i.created_at >= ? AND i.created_at < ?")
+            params.extend([EARLIEST_TIME if created_after is None else _timestamp(created_after),
+                           LATEST_TIME if created_before is None else _timestamp(created_before)])
+        if status is not None:
+            filters.append("i.status = ?")
+            params.append(status)
+        if can_bargain is not None:
+            filters.append("i.can_bargain = ?")
+            params.append(1 if can_bargain else 0)
+        return filters, params
+
+    @staticmethod
+    def _attribute_filters(attributes: Optional[Dict[str, str]], include_archived=False, archived_only=False,
+                           per_row=False) -> Tuple[List[str], List]:
+        '''
+        属性筛选条件：在线物品通过 item_attributes 的 (key, value, item_id) 索引取出符合的物品ID；
+        per_row=True 用于候选已由全文索引限定的查询 (索引中的属性词条已求过交集)，改为按主键 (item_id, key) 逐个确认候选，
+        不必取出属性相同的所有物品
+        归档物品没有属性行，只在包含归档数据时对归档部分用 json_extract 比较
+        '''
+        filters, params = [], []
+        for key, value in (attributes or {}).items():
+            if per_row:
+                indexed = "EXISTS (SELECT 1 FROM item_attributes a WHERE a.item_id = i.id AND a.key = ? AND a.value = ?)"
+            else:
+                indexed = "i.id IN (SELECT item_id FROM item_attributes WHERE key = ? AND value = ?)"
+            archived = "trim(json_extract(i.specific_attributes, ?)) = ? COLLATE NOCASE"
+            path = '$."' + str(key).replace('"', '\\"') + '"'
+            value = str(value).strip()
+            if archived_only:
+                filters.append(archived)
+                params.extend([path, value])
+            elif include_archived:
+                filters.append(f"(CASE WHEN i.archived = 1 THEN {archived} ELSE {indexed} END)")
+                params.extend([path, value, key, value])
+            else:
+                filters.append(indexed)
+                params.extend([key, value])
+        return filters, params
 
-    def delete_item(self, item_id):
+    def _category_id(self, category_name) -> Optional[int]:
         conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM items WHERE id = ?", (item_id,))
-        conn.commit()
+        row = conn.execute("SELECT id FROM categories WHERE name = ?", (category_name,)).fetchone()
         conn.close()
+        return row['id'] if row else None
 
-    def revise_item(self, item_id, data: Dict):
-        '''更新物品信息'''
+    def _rank_matches(self, queries: Tuple[str, str], filters: List[str], params: List, limit) -> List[int]:
+        '''
+        先用要求所有词条都出现的查询，结果不足 limit 个时再用任一词条出现的查询补足，返回按 bm25 排序的物品ID
+        内层查询按 rowid 倒序只取最新的 MAX_CANDIDATES 个匹配 (FTS5 直接按倒序输出，不排序)，外层只对这些计算排序
+        filters 是对物品表 (别名 i) 的附加条件
+        '''
+        table = search_index.SEARCH_TABLE
+        where = "".join(f" AND {f}" for f in filters)
+        sql = f'''
+            SELECT id FROM (
+                SELECT s.rowid AS id, bm25({table}, {', '.join(map(str, search_index.COLUMN_WEIGHTS))}) AS score
+                FROM {table} s JOIN items i ON i.id = s.rowid
+                WHERE {table} MATCH ?{where}
+                ORDER BY s.rowid DESC LIMIT {search_index.MAX_CANDIDATES}
+            ) ORDER BY score LIMIT ?
+        '''
         conn = get_db_connection()
-        cursor = conn.cursor()
-        
+        try:
+            ids = [r['id'] for r in conn.execute(sql, (queries[0], *params, limit))]
+            if len(ids) < limit and queries[1] != queries[0]:
+                seen = set(ids)
+                for r in conn.execute(sql, (queries[1], *params, limit)):
+                    if r['id'] not in seen and len(ids) < limit:
+                        ids.append(r['id'])
+        finally:
+            conn.close()
+        return ids
+
+    def faceted_search(self, category_name=None, keyword=None, include_reserved=True, attributes: Optional[Dict[str, str]] = None,
+                       status=None, price_band=None, page=0, page_size=SEARCH_LIMIT, min_price=None, max_price=None,
+                       created_after=None, created_before=None, item_status=None, can_bargain=None) -> Dict:
+        '''
+        分面搜索：返回一页结果以及按类别、状态分组 (STATUS_BUCKETS)、价格区间 (PRICE_BANDS 的下标) 的计数
+        status、price_band 为选中的分面，与其他条件一起限定候选集合；
+        min_price 至 can_bargain 与 search_items 的同名筛选相同，item_status 即 search_items 的 status (物品状态，而不是分面分组)；计数和结果页都来自同一个候选集合，
+        由一条语句完成：候选集合物化一次，再分别分组计数
+        有关键字时候选集合与 search_items 相同，为最新的 MAX_CANDIDATES 个全文匹配 (没有精确匹配时用容错查询)，
+        按相似度分页，truncated 表示匹配数超出了候选窗口、计数只针对窗口内的物品；没有关键字时候选集合是所有符合条件的物品，按发布时间从新到旧分页
+        返回 {'items': [...], 'total': 候选数, 'truncated': bool, 'facets': {'category': {类别名: 数量}, 'status': {分组: 数量}, 'price': {区间下标: 数量}}}
+        '''
+        result = {'items': [], 'total': 0, 'truncated': False,
+                  'facets': {'category': {}, 'status': {}, 'price': {}}}
+        category_id = None
+        if category_name:
+            category_id = self._category_id(category_name)
+            if category_id is None:
+                return result
+
+        filters, params = self._attribute_filters(attributes, per_row=bool(keyword))
+        if not include_reserved:
+            filters.append("i.status IN ('active', 'sold')")
+        listing_filters, listing_params = self._listing_filters(min_price, max_price, created_after, created_before,
+                                                                item_status, can_bargain)
+        filters.extend(listing_filters)
+        params.extend(listing_params)
+        bucket = f'''
+            CASE WHEN i.status = 'sold' THEN 'sold' WHEN i.status = 'reserved' THEN 'reserved'
+                 WHEN i.want_count > 0 THEN 'wanted' ELSE 'active' END
+        '''
+        band = "CASE " + " ".join(f"WHEN i.price < {high} THEN {n}" for n, (_, high) in enumerate(PRICE_BANDS) if high is not None) \
+               + f" ELSE {len(PRICE_BANDS) - 1} END"
+        if status is not None:
+            filters.append(f"({bucket}) = ?")
+            params.append(status)
+        if price_band is not None:
+            low, high = PRICE_BANDS[price_band]
+            filters.append("i.price >= ?" if high is None else "i.price >= ? AND i.price < ?")
+            params.extend([low] if high is None else [low, high])
+        where = "".join(f" AND {f}" for f in filters)
+
+        if keyword:
+            queries = search_index.build_queries(keyword, category_id, attributes)
+            if queries is None:
+                return result
+            table = search_index.SEARCH_TABLE
+            candidates = f'''
+                SELECT s.rowid AS id, bm25({table}, {', '.join(map(str, search_index.COLUMN_WEIGHTS))}) AS score
+                FROM {table} s JOIN items i ON i.id = s.rowid
+                WHERE {table} MATCH ?{where}
+                ORDER BY s.rowid DESC LIMIT {search_index.MAX_CANDIDATES}
+            '''
+            attempts = [(queries[0],), (queries[1],)] if queries[1] != queries[0] else [(queries[0],)]
+        else:
+            if category_id is not None:
+                where += " AND i.category_id = ?"
+                params.append(category_id)
+            candidates = f"SELECT i.id AS id, -i.id AS score FROM items i WHERE 1{where}"
+            attempts = [()]
+
+        sql = f'''
+            WITH c AS MATERIALIZED (
+                SELECT c0.id, c0.score, i.category_id, {bucket} AS bucket, {band} AS band
+                FROM ({candidates}) c0 JOIN items i ON i.id = c0.id
+            )
+            SELECT 'category' AS facet, k.name AS value, COUNT(*) AS n, NULL AS id FROM c JOIN categories k ON k.id = c.category_id GROUP BY k.name
+            UNION ALL SELECT 'status', bucket, COUNT(*), NULL FROM c GROUP BY bucket
+            UNION ALL SELECT 'price', band, COUNT(*), NULL FROM c GROUP BY band
+            UNION ALL SELECT * FROM (SELECT 'page', NULL, NULL, id FROM c ORDER BY score LIMIT ? OFFSET ?)
+        '''
+        conn = get_db_connection()
+        try:
+            for match in attempts:
+                rows = conn.execute(sql, (*match, *params, page_size, page * page_size)).fetchall()
+                if rows:
+                    break
+        finally:
+            conn.close()
+
+        ids = []
+        for r in rows:
+            if r['facet'] == 'page':
+                ids.append(r['id'])
+            else:
+                result['facets'][r['facet']][r['value']] = r['n']
+        result['total'] = sum(result['facets']['status'].values())
+        result['truncated'] = bool(keyword) and result['total'] >= search_index.MAX_CANDIDATES
+        if ids:
+            by_id = {item.id: item for item in self._fetch_items(f"i.id IN ({','.join('?' * len(ids))})", tuple(ids))}
+            result['items'] = [by_id[item_id] for item_id in ids if item_id in by_id]
+        return result
+
+    def list_items(self, sort='created_at', descending=True, category_name=None, keyword=None, include_reserved=True,
+                   attributes: Optional[Dict[str, str]] = None, after: Optional[tuple] = None,
+                   page_size=SEARCH_LIMIT, min_price=None, max_price=None, created_after=None, created_before=None,
+                   status=None, can_bargain=None) -> Tuple[List[Item], Optional[tuple]]:
+        '''
+        按 SORT_COLUMNS 中的列排序、分页列出物品 (只查询主库)
+        使用键集分页：after 为上一页返回的游标 (排序值, 物品ID)，下一页从游标之后开始，翻页代价与页码无关；
+        返回 (本页物品, 下一页游标)，没有下一页时游标为 None；min_price 至 can_bargain 与 search_items 的同名筛选相同
+        有关键字时列出所有全文匹配 (精确查询) 的物品，不限于相似度排序的候选窗口：
+            匹配较少时先从索引取出全部匹配再排序，代价与匹配数成正比；
+            匹配很多时 (常见词) 把匹配的物品ID取到临时索引中，沿排序列的索引逐行检查是否在其中，避免对数万个匹配回表、排序
+        价格、发布时间区间同理：命中的行少时由区间的索引取出再排序，多时沿排序列的索引逐行检查 (见 _unindexed_ranges)
+        '''
+        column = SORT_COLUMNS[sort]
+        filters, params = self._attribute_filters(attributes)
+        category_id = self._category_id(category_name) if category_name else None
+        if category_name:
+            filters.append("i.category_id = ?")
+            params.append(category_id)
+        if not include_reserved:
+            filters.append("i.status IN ('active', 'sold')")
+        conn = get_db_connection()
+        listing_filters, listing_params = self._listing_filters(
+            min_price, max_price, created_after, created_before, status, can_bargain,
+            unindexed=self._unindexed_ranges(conn, sort, min_price, max_price, created_after, created_before))
+        filters.extend(listing_filters)
+        params.extend(listing_params)
+        if keyword:
+            queries = search_index.build_queries(keyword, category_id)
+            if queries is None:
+                conn.close()
+                return [], None
+            # 计数最多数到 BROAD_MATCHES + 1，常见词也只需几毫秒
+            matches = conn.execute(f"SELECT COUNT(*) FROM (SELECT rowid FROM {search_index.SEARCH_TABLE} "
+                                   f"WHERE {search_index.SEARCH_TABLE} MATCH ? LIMIT ?)",
+                                   (queries[0], BROAD_MATCHES + 1)).fetchone()[0]
+            if not matches:
+                conn.close()
+                return [], None
+            # 一元 + 使 IN 只用于检查，不用来按物品ID逐个回表
+            filters.append(f"{'+' if matches > BROAD_MATCHES else ''}i.id IN "
+                           f"(SELECT rowid FROM {search_index.SEARCH_TABLE} WHERE {search_index.SEARCH_TABLE} MATCH ?)")
+            params.append(queries[0])
+        if after is not None:
+            # 行值比较：(排序值, id) 严格位于游标之后
+            filters.append(f"({column}, i.id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+        direction = 'DESC' if descending else 'ASC'
+        sql = f'''
+            SELECT i.id, {column} AS sort_value FROM items i
+            {"WHERE " + " AND ".join(filters) if filters else ""}
+            ORDER BY {column} {direction}, i.id {direction}
+            LIMIT ?
+        '''
+        rows = conn.execute(sql, (*params, page_size)).fetchall()
+        conn.close()
+
+        ids = [r['id'] for r in rows]
+        by_id = {item.id: item for item in self._fetch_items(f"i.id IN ({','.join('?' * len(ids))})", tuple(ids))} if ids else {}
+        items = [by_id[item_id] for item_id in ids if item_id in by_id]
+        cursor = (rows[-1]['sort_value'], rows[-1]['id']) if len(rows) == page_size else None
+        return items, cursor
+
+    def _unindexed_ranges(self, conn, sort, min_price, max_price, created_after, created_before) -> Tuple[str, ...]:
+        '''
+        选择排序时不使用索引的区间条件 (列名)：没有 STAT4 统计时查询计划无法估计区间大小，总会用某个区间的索引，
+        宽区间会取出大量行再排序；这里按索引数出各区间的行数 (最多数到 DRIVING_ROWS + 1)，
+        只保留命中不超过 DRIVING_ROWS 行的最窄区间的索引，都超过时只保留排序列自身的区间 (沿排序索引逐行检查其余条件)
+        '''
+        counts = {}
+        for column, bounds in (('price', {'min_price': min_price, 'max_price': max_price}),
+                               ('created_at', {'created_after': created_after, 'created_before': created_before})):
+            if all(v is None for v in bounds.values()):
+                continue
+            where, params = self._listing_filters(**bounds)
+            counts[column] = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM items i WHERE {where[0]} LIMIT ?)",
+                                          (*params, DRIVING_ROWS + 1)).fetchone()[0]
+        narrowest = min(counts, key=counts.get, default=None)
+        driving = narrowest if narrowest is not None and counts[narrowest] <= DRIVING_ROWS else sort
+        return tuple(column for column in counts if column != driving)
+
+    def find_item_by_id(self, item_id, include_archived=False) -> Optional[Item]:
+        items = self._fetch_items("i.id = ?", (item_id,), include_archived)
+        return items[0] if items else None
+
+    def _conflict_message(self, cursor, item_id) -> str:
+        '''比较并交换失败时，在同一事务内查明冲突原因'''
+        cursor.execute("SELECT status FROM items WHERE id = ?", (item_id,))
+        row = cursor.fetchone()
+        if not row:
+            return "物品不存在或已被删除"
+        if row['status'] == 'sold':
+            return "物品已售出"
+        return "物品信息已被他人修改，请刷新后重试"
+
+    def _image_paths_of(self, cursor, item_ids: List[int]) -> Dict[int, List[str]]:
+        '''查询物品的图片路径，按 500 个一组分批，避免超过 SQL 参数数量上限'''
+        paths = {}
+        for start in range(0, len(item_ids), 500):
+            chunk = item_ids[start:start + 500]
+            cursor.execute(f"SELECT id, image_paths FROM items WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+            paths.update((r['id'], json.loads(r['image_paths'])) for r in cursor.fetchall())
+        return paths
+
+    def _delete_dependents(self, cursor, item_ids: List[int]):
+        '''
+        级联清理：删除已不存在的物品的购买意向和留言
+        与删除物品在同一事务中执行；每个连接未开启外键约束，因此由这里显式保证不留下悬空记录
+        '''
+        params = [(item_id, item_id) for item_id in item_ids]
+        cursor.executemany("DELETE FROM item_wants WHERE item_id = ? AND NOT EXISTS (SELECT 1 FROM items WHERE id = ?)", params)
+        cursor.executemany("DELETE FROM messages WHERE item_id = ? AND NOT EXISTS (SELECT 1 FROM items WHERE id = ?)", params)
+        search_index.remove_items(cursor, item_ids)
+        similar.remove_items(cursor, item_ids)
+        duplicates.remove_items(cursor, item_ids)
+
+    def delete_item(self, item_id, expected_version=None) -> Tuple[bool, str]:
+        '''
+        删除物品，连同其购买意向、留言和本地图片
+        传入 expected_version 时仅当版本号未变化才删除，否则返回冲突结果
+        '''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            image_paths = self._image_paths_of(cursor, [item_id]).get(item_id, [])
+            cursor.execute("DELETE FROM items WHERE id = ? AND (? IS NULL OR version = ?)",
+                           (item_id, expected_version, expected_version))
+            if cursor.rowcount == 0:
+                return False, self._conflict_message(cursor, item_id)
+            self._delete_dependents(cursor, [item_id])
+        # 图片文件在事务提交后再删除，避免回滚后物品仍在而图片已丢失
+        remove_image_files(image_paths)
+        return True, "删除成功"
+
+    def revise_item(self, item_id, data: Dict, expected_version=None) -> Tuple[bool, str]:
+        '''
+        更新物品信息
+        已售出的物品不能再修改；传入 expected_version 时进行比较并交换：版本号不一致说明物品已被他人修改或售出，返回冲突结果
+        '''
         # 构建更新语句
         fields = []
         values = []
@@ -414,21 +911,36 @@ class ItemManager:
             fields.append("specific_attributes = ?")
             values.append(json.dumps(data['specific_attributes'], ensure_ascii=False))
             
-        if fields:
-            values.append(item_id)
-            sql = f"UPDATE items SET {', '.join(fields)} WHERE id = ?"
+        if not fields:
+            return True, "没有需要更新的字段"
+
+        fields.append("version = version + 1")
+        values.extend([item_id, expected_version, expected_version])
+        sql = f"UPDATE items SET {', '.join(fields)} WHERE id = ? AND status != 'sold' AND (? IS NULL OR version = ?)"
+        with write_transaction() as conn:
+            cursor = conn.cursor()
             cursor.execute(sql, values)
-            conn.commit()
-        conn.close()
+            if cursor.rowcount == 0:
+                return False, self._conflict_message(cursor, item_id)
+            if 'name' in data or 'description' in data or 'specific_attributes' in data:
+                search_index.index_items(cursor, [item_id])
+            if 'name' in data or 'description' in data:
+                similar.index_items(cursor, [item_id])
+            if 'name' in data or 'description' in data or 'image_paths' in data:
+                duplicates.index_items(cursor, [item_id])
+        return True, "修改成功"
 
     def add_want(self, item_id, user_id, offer_price=0.0) -> bool:
-        '''记录用户对物品的购买意向'''
+        '''记录用户对物品的购买意向，仅在售 (未预留、未售出) 的物品可以添加'''
         conn = get_db_connection()
         cursor = conn.cursor()
         try:
-            cursor.execute("INSERT INTO item_wants (item_id, user_id, offer_price) VALUES (?, ?, ?)", (item_id, user_id, offer_price))
+            cursor.execute('''
+                INSERT INTO item_wants (item_id, user_id, offer_price)
+                SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM items WHERE id = ? AND status = 'active')
+            ''', (item_id, user_id, offer_price, item_id))
             conn.commit()
-            return True
+            return cursor.rowcount == 1
         except sqlite3.IntegrityError:
             return False # 已经想要了
         finally:
@@ -447,15 +959,18 @@ class ItemManager:
         conn.close()
         return [User(r['id'], r['username'], r['role'], r['status'], json.loads(r['contact_info'])) for r in rows]
 
-    def get_user_wants(self, user_id) -> List[Item]:
-        '''获取用户想要的所有物品'''
+    def get_user_wants(self, user_id, include_archived=False) -> List[Item]:
+        '''获取用户想要的所有物品，include_archived=True 时包括已归档的历史交易'''
         conn = get_db_connection()
         cursor = conn.cursor()
-        sql = '''
-            SELECT i.*, c.name as category_name, u.username as owner_username, u.contact_info,
-            (SELECT COUNT(*) FROM item_wants w2 WHERE w2.item_id = i.id) as want_count
-            FROM items i
-            JOIN item_wants w ON i.id = w.item_id
+        items_table, wants_table = 'items', 'item_wants'
+        if include_archived:
+            attach_archive(conn)
+            items_table, wants_table = 'all_items', 'all_item_wants'
+        sql = f'''
+            SELECT i.*, c.name as category_name, u.username as owner_username, u.contact_info
+            FROM {items_table} i
+            JOIN {wants_table} w ON i.id = w.item_id
             JOIN categories c ON i.category_id = c.id
             JOIN users u ON i.owner_id = u.id
             WHERE w.user_id = ?
@@ -464,29 +979,7 @@ class ItemManager:
         rows = cursor.fetchall()
         conn.close()
         
-        items = []
-        for r in rows:
-            contact = json.loads(r['contact_info'])
-            items.append(Item(
-                id=r['id'],
-                name=r['name'],
-                description=r['description'],
-                category_id=r['category_id'],
-                owner_id=r['owner_id'],
-                status=r['status'],
-                price=r['price'],
-                can_bargain=r['can_bargain'],
-                address=r['address'],
-                specific_attributes=json.loads(r['specific_attributes']),
-                image_paths=json.loads(r['image_paths']),
-                category_name=r['category_name'],
-                owner_username=r['owner_username'],
-                phone=contact.get('phone', ''),
-                email=contact.get('email', ''),
-                buyer_id=r['buyer_id'],
-                want_count=r['want_count']
-            ))
-        return items
+        return [self._row_to_item(r) for r in rows]
 
     def get_received_wants(self, owner_id) -> List[Dict]:
         '''获取卖家收到的所有意向信息'''
@@ -514,13 +1007,176 @@ class ItemManager:
             })
         return results
 
-    def confirm_sold(self, item_id, buyer_id):
-        '''确认交易完成：将状态改为已售出，并记录最终买家'''
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("UPDATE items SET status = 'sold', buyer_id = ? WHERE id = ?", (buyer_id, item_id))
-        conn.commit()
-        conn.close()
+    def confirm_sold(self, item_id, buyer_id, expected_version=None) -> Tuple[bool, str]:
+        '''
+        确认交易完成：将状态改为已售出，并记录最终买家
+        在同一个 BEGIN IMMEDIATE 事务中校验买家意向、物品仍在售 (或预留给该买家) 以及版本号，任一不满足则返回冲突结果
+        '''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM item_wants WHERE item_id = ? AND user_id = ?", (item_id, buyer_id))
+            if not cursor.fetchone():
+                return False, "该买家的购买意向已不存在"
+
+            cursor.execute('''
+                UPDATE items SET status = 'sold', buyer_id = ?, reserved_by = NULL, reserved_until = NULL,
+                    sold_at = CURRENT_TIMESTAMP, version = version + 1
+                WHERE id = ? AND (status = 'active' OR (status = 'reserved' AND reserved_by = ?))
+                    AND (? IS NULL OR version = ?)
+            ''', (buyer_id, item_id, buyer_id, expected_version, expected_version))
+            if cursor.rowcount == 0:
+                return False, self._conflict_message(cursor, item_id)
+        return True, "操作成功"
+
+    def reserve_item(self, item_id, buyer_id, hours=24, expected_version=None) -> Tuple[bool, str]:
+        '''
+        将在售物品预留给某个有购买意向的买家，预留期间其他用户不能再添加意向
+        到期时间以 UTC 存储 (与 created_at 的 CURRENT_TIMESTAMP 格式一致)，到期后由 ReservationSweeper 释放
+        '''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1 FROM item_wants WHERE item_id = ? AND user_id = ?", (item_id, buyer_id))
+            if not cursor.fetchone():
+                return False, "该买家的购买意向已不存在"
+
+            cursor.execute('''
+                UPDATE items SET status = 'reserved', reserved_by = ?, reserved_until = datetime('now', ?),
+                    version = version + 1
+                WHERE id = ? AND status = 'active' AND (? IS NULL OR version = ?)
+            ''', (buyer_id, f"+{int(hours)} hours", item_id, expected_version, expected_version))
+            if cursor.rowcount == 0:
+                return False, self._conflict_message(cursor, item_id)
+        return True, "预留成功"
+
+    def release_reservation(self, item_id, expected_version=None) -> Tuple[bool, str]:
+        '''卖家提前取消预留，物品恢复在售'''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE items SET status = 'active', reserved_by = NULL, reserved_until = NULL, version = version + 1
+                WHERE id = ? AND status = 'reserved' AND (? IS NULL OR version = ?)
+            ''', (item_id, expected_version, expected_version))
+            if cursor.rowcount == 0:
+                return False, self._conflict_message(cursor, item_id)
+        return True, "已取消预留"
+
+    def release_expired_reservations(self, batch_size=500) -> int:
+        '''
+        释放一批已到期的预留，返回本批释放的数量
+        子查询通过 idx_items_reserved_until 部分索引按到期时间范围扫描，不会全表扫描
+        '''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE items SET status = 'active', reserved_by = NULL, reserved_until = NULL, version = version + 1
+                WHERE id IN (
+                    SELECT id FROM items
+                    WHERE reserved_until IS NOT NULL AND reserved_until <= datetime('now')
+                    ORDER BY reserved_until
+                    LIMIT ?
+                ) AND status = 'reserved'
+            ''', (batch_size,))
+            return cursor.rowcount
+
+    def delete_items(self, item_ids: List[int], operator_id, is_admin=False,
+                     versions: Optional[Dict[int, int]] = None) -> int:
+        '''
+        批量删除物品 (连同意向、留言和本地图片)，整批在一个事务中通过 executemany 执行，返回实际删除的数量
+        权限检查写在 WHERE 条件中：管理员可删除任意物品；普通用户只能删除自己发布的、未售出且无人想要的物品，
+        不满足条件的物品被跳过
+        versions 为 {item_id: 读取时的版本号} 时与 delete_item 相同进行比较并交换，版本号已变化的物品同样被跳过
+        '''
+        item_ids = list(item_ids)
+        versions = versions or {}
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            image_paths = self._image_paths_of(cursor, item_ids)
+            cursor.executemany('''
+                DELETE FROM items
+                WHERE id = ?1 AND (?4 IS NULL OR version = ?4) AND (?2 OR (owner_id = ?3 AND status != 'sold'
+                    AND NOT EXISTS (SELECT 1 FROM item_wants w WHERE w.item_id = items.id)))
+            ''', [(item_id, bool(is_admin), operator_id, versions.get(item_id)) for item_id in item_ids])
+            deleted = cursor.rowcount
+            self._delete_dependents(cursor, item_ids)
+            remaining = self._image_paths_of(cursor, list(image_paths))
+        remove_image_files(p for item_id, paths in image_paths.items() if item_id not in remaining for p in paths)
+        return deleted
+
+    def mark_sold_many(self, sales: List[Tuple[int, Optional[int]]], owner_id) -> int:
+        '''
+        批量确认售出，sales 为 (item_id, buyer_id) 列表，整批在一个事务中执行，返回成功售出的数量
+        buyer_id 为 None 时卖给该物品当前的预留买家；只处理 owner_id 本人发布的物品，
+        且与 confirm_sold 相同，要求物品在售 (或预留给该买家) 并且买家的购买意向仍然存在
+        '''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE items SET status = 'sold', buyer_id = COALESCE(?1, reserved_by),
+                    reserved_by = NULL, reserved_until = NULL, sold_at = CURRENT_TIMESTAMP, version = version + 1
+                WHERE id = ?2 AND owner_id = ?3
+                    AND ((status = 'active' AND ?1 IS NOT NULL)
+                         OR (status = 'reserved' AND reserved_by = COALESCE(?1, reserved_by)))
+                    AND EXISTS (SELECT 1 FROM item_wants w
+                                WHERE w.item_id = items.id AND w.user_id = COALESCE(?1, items.reserved_by))
+            ''', [(buyer_id, item_id, owner_id) for item_id, buyer_id in sales])
+            return cursor.rowcount
+
+    def reprice_many(self, item_ids: List[int], percent, operator_id, is_admin=False) -> int:
+        '''
+        批量调价：价格改为当前价格的 percent% (保留两位小数)，整批在一个事务中执行，返回成功修改的数量
+        新价格在 UPDATE 中由当前价格计算，期间被他人修改过的价格不会被基于旧价格的结果覆盖
+        已售出的物品不可调价；普通用户只能修改自己发布的、无人想要的物品 (与单个修改的规则一致)
+        '''
+        with write_transaction() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                UPDATE items SET price = ROUND(price * ?, 2), version = version + 1
+                WHERE id = ? AND status != 'sold' AND (? OR (owner_id = ?
+                    AND NOT EXISTS (SELECT 1 FROM item_wants w WHERE w.item_id = items.id)))
+            ''', [(float(percent) / 100, item_id, bool(is_admin), operator_id) for item_id in item_ids])
+            return cursor.rowcount
+
+    def archive_sold_items(self, older_than_days=180, batch_size=1000) -> Dict[str, int]:
+        '''
+        冷数据归档：将售出超过 older_than_days 天的物品连同其意向和留言移入归档库 (database.archive_path())
+        每批一个同时覆盖主库和归档库的事务，复制后删除，返回各表归档的行数
+        列表和搜索默认只查询主库；历史视图通过 include_archived=True 合并查询归档数据
+        '''
+        counts = {table: 0 for table in ARCHIVED_TABLES}
+        batch = batch_size
+        while batch == batch_size:
+            with write_transaction(with_archive=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+                cursor.execute("DELETE FROM archive_batch")
+                # 走 idx_items_sold_at 部分索引
+                cursor.execute('''
+                    INSERT INTO archive_batch
+                    SELECT id FROM main.items
+                    WHERE status = 'sold' AND COALESCE(sold_at, created_at) <= datetime('now', ?)
+                    LIMIT ?
+                ''', (f"-{int(older_than_days)} days", batch_size))
+                batch = cursor.rowcount
+                if batch == 0:
+                    break
+                for table in ARCHIVED_TABLES:
+                    key = 'id' if table == 'items' else 'item_id'
+                    cols = ', '.join(table_columns(conn, table))
+                    cursor.execute(f'''
+                        INSERT INTO archive.{table} ({cols}, archived_at)
+                        SELECT {cols}, CURRENT_TIMESTAMP FROM main.{table} WHERE {key} IN (SELECT id FROM archive_batch)
+                    ''')
+                    counts[table] += cursor.rowcount
+                # 先删除引用物品的行，再删除物品本身
+                for table in reversed(ARCHIVED_TABLES):
+                    key = 'id' if table == 'items' else 'item_id'
+                    cursor.execute(f"DELETE FROM main.{table} WHERE {key} IN (SELECT id FROM archive_batch)")
+                # 归档的物品不再出现在主库的搜索索引、相似物品和重复检测中
+                cursor.execute(f"DELETE FROM main.{search_index.SEARCH_TABLE} WHERE rowid IN (SELECT id FROM archive_batch)")
+                cursor.execute(f"DELETE FROM main.{similar.VECTORS_TABLE} WHERE item_id IN (SELECT id FROM archive_batch)")
+                cursor.execute("SELECT id FROM archive_batch")
+                duplicates.remove_items(cursor, [r[0] for r in cursor.fetchall()])
+        return counts
 
     def add_message(self, item_id, sender_id, content, reply_to_id=None):
         '''添加留言'''
@@ -533,13 +1189,17 @@ class ItemManager:
         conn.commit()
         conn.close()
 
-    def get_messages(self, item_id) -> List[Message]:
-        '''获取物品的所有留言'''
+    def get_messages(self, item_id, include_archived=False) -> List[Message]:
+        '''获取物品的所有留言，查看已归档物品时传入 include_archived=True'''
         conn = get_db_connection()
         cursor = conn.cursor()
-        sql = '''
+        messages_table = 'messages'
+        if include_archived:
+            attach_archive(conn)
+            messages_table = 'all_messages'
+        sql = f'''
             SELECT m.*, u.username as sender_name
-            FROM messages m
+            FROM {messages_table} m
             JOIN users u ON m.sender_id = u.id
             WHERE m.item_id = ?
             ORDER BY m.created_at ASC
@@ -547,4 +1207,36 @@ class ItemManager:
         cursor.execute(sql, (item_id,))
         rows = cursor.fetchall()
         conn.close()
-        return [Message(r['id'], r['item_id'], r['sender_id'], r['sender_name'], r['content'], r['reply_to_id'], r['created_at']) for r in rows]
\ No newline at end of file
+        return [Message(r['id'], r['item_id'], r['sender_id'], r['sender_name'], r['content'], r['reply_to_id'], r['created_at']) for r in rows]
+
+class ReservationSweeper(threading.Thread):
+    '''
+    预留清理线程
+    后台定期分批释放已到期的预留，每批一个短事务，避免长时间持有写锁
+    '''
+    def __init__(self, item_manager: ItemManager, interval=60, batch_size=500):
+        super().__init__(daemon=True, name="ReservationSweeper")
+        self.item_manager = item_manager
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop_event = threading.Event()
+
+    def sweep_once(self) -> int:
+        '''连续处理直到某一批不满，返回本轮共释放的数量'''
+        total = 0
+        while True:
+            released = self.item_manager.release_expired_reservations(self.batch_size)
+            total += released
+            if released < self.batch_size:
+                return total
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sweep_once()
+            except sqlite3.Error as e:
+                print(f"清理过期预留失败: {e}")
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,128 @@
+'''
+并发竞争测试：确认售出 / 修改 / 删除
+每一轮新建一个有购买意向的在售物品，多个线程在同一时刻 (threading.Barrier) 带着同一个版本号
+分别调用 confirm_sold、revise_item、delete_item，检查:
+    恰好一个操作成功，其余返回冲突结果
+    物品的最终状态与成功的操作一致 (已售出 / 价格已修改 / 已删除)
+另外检查已售出的物品不带版本号也不能再修改
+在临时数据库上运行，不影响 second_hand.db
+用法:
+    python race_test.py
+    python race_test.py --rounds 200 --threads 6
+'''
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import Counter
+import database
+
+OPS = ('confirm_sold', 'revise_item', 'delete_item')
+SELLER, BUYER, CATEGORY = 'race_seller', 'race_buyer', '竞争测试'
+
+
+def _setup(models):
+    '''创建卖家、买家和类别，返回 (ItemManager, 买家ID)'''
+    user_manager = models.UserManager()
+    for username in (SELLER, BUYER):
+        user_manager.register_user(username, 'pw', '', '', '')
+    user_manager.approve_users([SELLER, BUYER])
+    models.CategoryManager().add_category(CATEGORY, [])
+    return models.ItemManager(), user_manager.get_user(BUYER).id
+
+
+def _new_item(item_manager, buyer_id, n):
+    '''新建一个有购买意向的在售物品，返回 (物品ID, 版本号)'''
+    item_manager.create_item(f'竞争测试物品{n}', f'第{n}轮', 10.0, 0, '地点', '', '', CATEGORY, SELLER, {})
+    conn = database.get_db_connection()
+    item_id = conn.execute("SELECT MAX(id) FROM items").fetchone()[0]
+    conn.close()
+    item_manager.add_want(item_id, buyer_id)
+    return item_id, item_manager.find_item_by_id(item_id).version
+
+
+def race_round(item_manager, buyer_id, n, threads) -> tuple:
+    '''执行一轮竞争，返回 (成功的操作, 发现的问题)'''
+    item_id, version = _new_item(item_manager, buyer_id, n)
+    calls = {
+        'confirm_sold': lambda: item_manager.confirm_sold(item_id, buyer_id, version),
+        'revise_item': lambda: item_manager.revise_item(item_id, {'price': 99.0}, version),
+        'delete_item': lambda: item_manager.delete_item(item_id, version),
+    }
+    barrier = threading.Barrier(threads)
+    results, errors = [None] * threads, []
+
+    def run(i):
+        op = OPS[i % len(OPS)]
+        barrier.wait()
+        try:
+            results[i] = (op,) + tuple(calls[op]())
+        except Exception as e:     # 数据库错误 (如锁超时) 也记为失败，并在报告中列出
+            results[i] = (op, False, str(e))
+            errors.append(f"{op} 出错 {type(e).__name__}: {e}")
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+
+    problems = []
+    winners = [r[0] for r in results if r[1]]
+    if len(winners) != 1:
+        problems.append(f"第{n}轮: {len(winners)} 个操作成功 {winners}")
+    problems.extend(f"第{n}轮: {e}" for e in errors)
+    item = item_manager.find_item_by_id(item_id)
+    if winners == ['confirm_sold'] and (item is None or item.status != 'sold'):
+        problems.append(f"第{n}轮: confirm_sold 成功但物品状态为 {item and item.status}")
+    if winners == ['revise_item'] and (item is None or item.price != 99.0 or item.status != 'active'):
+        problems.append(f"第{n}轮: revise_item 成功但物品为 {item and (item.status, item.price)}")
+    if winners == ['delete_item'] and item is not None:
+        problems.append(f"第{n}轮: delete_item 成功但物品仍存在")
+    return winners, problems
+
+
+def sold_is_final(item_manager, buyer_id) -> list:
+    '''已售出的物品不带版本号也不能再修改'''
+    item_id, version = _new_item(item_manager, buyer_id, 'sold')
+    success, msg = item_manager.confirm_sold(item_id, buyer_id, version)
+    if not success:
+        return [f"确认售出失败: {msg}"]
+    success, msg = item_manager.revise_item(item_id, {'price': 5.0})
+    if success or item_manager.find_item_by_id(item_id).price != 10.0:
+        return ["已售出的物品仍被修改"]
+    return [] if msg == "物品已售出" else [f"修改已售出物品返回了意外的信息: {msg}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="确认售出 / 修改 / 删除的多线程竞争测试")
+    parser.add_argument('--rounds', type=int, default=100)
+    parser.add_argument('--threads', type=int, default=3, help="每轮并发的线程数 (依次分配三种操作)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='race_test_')
+    database.DB_FILE = os.path.join(workdir, 'race.db')
+    sys.setswitchinterval(1e-5)     # 更频繁地切换线程，增加交错的机会
+    try:
+        import models   # 延迟导入：models 在导入时会对 database.DB_FILE 执行 init_db
+        item_manager, buyer_id = _setup(models)
+        wins, problems = Counter(), []
+        for n in range(args.rounds):
+            winners, found = race_round(item_manager, buyer_id, n, args.threads)
+            wins.update(winners)
+            problems.extend(found)
+        problems.extend(sold_is_final(item_manager, buyer_id))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.rounds} 轮，每轮 {args.threads} 个线程，各操作胜出次数: {dict(wins)}")
+    for p in problems:
+        print("  " + p)
+    print("通过" if not problems else f"发现 {len(problems)} 个问题")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
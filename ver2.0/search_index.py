@@ -0,0 +1,292 @@
+'''
+物品搜索索引
+基于 SQLite FTS5 的 item_search 表 (rowid = 物品ID)，每个物品的名称和描述预先切分成词条:
+    中文: 相邻两字 (二元组)，每段末尾的单字也作为词条，因此 "耳机" 能匹配 "蓝牙耳机"，单字关键字用前缀匹配
+    英文/数字: 整词 (小写)，关键字按前缀匹配，如 "app" 匹配 "Apple"
+    拼音: 名称的全拼和首字母，以每个音节开头的后缀各为一个词条 (蓝牙耳机 → lanyaerji yaerji erji ji)，
+          关键字按前缀匹配，因此 "erji"、"yaer"、"ej" 都能找到 "蓝牙耳机"；拼音需要安装可选依赖 pypinyin，
+          逐字取常用读音并按字缓存 (多音字不按词组区分读音)，整批建立索引时几乎都命中缓存
+    标签: 类别 "c<类别ID>" 和每个属性 "a<属性名与值的哈希>" 各一个词条，按类别、属性搜索时由索引直接求交集，不必逐个回表过滤
+          (属性词条不区分模板，是否按模板生效由 item_attributes 决定，这里只用于缩小候选)
+查询先要求所有词条都出现 (精确)，结果不足时再放宽为任一词条出现 (容错，如错别字)，两者都按 bm25 相似度排序，名称的权重最高；
+常见关键字可能匹配数万个物品，只对最新的 MAX_CANDIDATES 个匹配计算相似度，使延迟与匹配数无关
+索引在 ItemManager 创建、修改、删除和归档物品时于同一事务内更新；整批导入可延迟到最后一批之后，由 index_new_items 一次建立；
+安装 pypinyin 或整批修改数据后可执行:
+    python search_index.py --rebuild
+'''
+import re
+import json
+import time
+import hashlib
+import argparse
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+import database
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:     # 拼音搜索为可选功能
+    lazy_pinyin = None
+
+SEARCH_TABLE = 'item_search'
+COLUMNS = ('name', 'description', 'pinyin', 'initials', 'owner', 'tags')
+# 各列的 bm25 权重：名称、描述、拼音全拼、拼音首字母、发布者、标签 (只用于过滤)
+COLUMN_WEIGHTS = (10.0, 2.0, 6.0, 4.0, 1.0, 0.0)
+MAX_PINYIN_SUFFIX = 6       # 拼音后缀最多包含的音节数，避免长名称产生过长的词条
+MAX_CANDIDATES = 2000       # 每个查询最多计算相似度的匹配数 (按物品ID从新到旧)
+_SEGMENT = re.compile(r'[一-鿿]+|[0-9A-Za-z]+')
+_CJK = re.compile(r'[一-鿿]+')
+
+
+def create_table(cursor):
+    '''创建 FTS5 索引表 (由 init_db 调用)，返回是否为新建；旧版本的索引列不同时删除重建'''
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (SEARCH_TABLE,))
+    if cursor.fetchone():
+        cursor.execute(f"PRAGMA table_info({SEARCH_TABLE})")
+        if tuple(r[1] for r in cursor.fetchall()) == COLUMNS:
+            return False
+        cursor.execute(f"DROP TABLE {SEARCH_TABLE}")
+    # 词条已预先切分并以空格分隔，unicode61 只负责按空白拆分和转小写；前缀索引加速单字和拼音前缀查询
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5(
+            {', '.join(COLUMNS)},
+            prefix = '1 2 3', tokenize = 'unicode61 remove_diacritics 0'
+        )
+    ''')
+    return True
+
+
+def text_terms(text: str) -> List[str]:
+    '''文本切分出的词条：中文相邻两字及每段末字，英文/数字整词 (小写)；相似物品 (similar.py) 使用相同的切分'''
+    terms = []
+    for segment in _SEGMENT.findall(text or ''):
+        if _CJK.fullmatch(segment):
+            terms.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+            terms.append(segment[-1])
+        else:
+            terms.append(segment.lower())
+    return terms
+
+
+@lru_cache(maxsize=None)
+def _char_pinyin(char) -> str:
+    '''单个汉字的拼音 (常用读音)；汉字的种类有限，按字缓存后不必每次对整段文字做分词注音'''
+    return lazy_pinyin(char)[0]
+
+
+def _pinyin_terms(text: str) -> Tuple[List[str], List[str]]:
+    if lazy_pinyin is None:
+        return [], []
+    full, initials = [], []
+    for segment in _CJK.findall(text or ''):
+        syllables = [_char_pinyin(char) for char in segment]
+        firsts = [s[0] for s in syllables if s]
+        for i in range(len(syllables)):
+            full.append(''.join(syllables[i:i + MAX_PINYIN_SUFFIX]))
+            initials.append(''.join(firsts[i:i + MAX_PINYIN_SUFFIX]))
+    return full, initials
+
+
+@lru_cache(maxsize=65536)
+def attribute_tag(key, value) -> str:
+    '''属性词条：属性名和值 (去掉首尾空白，不区分大小写) 的哈希；品牌、尺码等取值重复很多，按 (属性名, 值) 缓存'''
+    text = f"{str(key).strip()}\x00{str(value).strip().lower()}"
+    return 'a' + hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _tags(category_id, specific_attributes) -> List[str]:
+    tags = [f'c{category_id}'] if category_id is not None else []
+    try:
+        attributes = json.loads(specific_attributes or '{}')
+    except ValueError:
+        attributes = {}
+    if isinstance(attributes, dict):
+        tags.extend(attribute_tag(k, v) for k, v in attributes.items()
+                    if isinstance(v, (str, int, float)) and str(v).strip())
+    return tags
+
+
+def document(name, description, owner='', category_id=None, specific_attributes=None) -> tuple:
+    '''一个物品在索引中的各列内容'''
+    full, initials = _pinyin_terms(name)
+    return (' '.join(text_terms(name)), ' '.join(text_terms(description)),
+            ' '.join(full), ' '.join(initials), ' '.join(text_terms(owner)),
+            ' '.join(_tags(category_id, specific_attributes)))
+
+
+def query_terms(keyword) -> List[Tuple[str, bool]]:
+    '''
+    关键字拆分出的词条 [(词条, 是否前缀匹配)]：中文按二元组拆分；单个汉字和英文/拼音按前缀匹配
+    '''
+    terms = []
+    for segment in _SEGMENT.findall(keyword or ''):
+        if _CJK.fullmatch(segment):
+            if len(segment) == 1:
+                terms.append((segment, True))
+            else:
+                terms.extend((segment[i:i + 2], False) for i in range(len(segment) - 1))
+        else:
+            terms.append((segment.lower(), True))
+    return list(dict.fromkeys(terms))
+
+
+def build_queries(keyword, category_id=None, attributes=None) -> Optional[Tuple[str, str]]:
+    '''
+    将关键字转换为 (精确, 容错) 两个 FTS5 查询表达式，关键字中没有可检索的字符时返回 None
+    给定 category_id 时只匹配该类别，给定 attributes {属性名: 值} 时只匹配带有这些属性的物品
+    '''
+    parts = [f'"{term}" *' if prefix else f'"{term}"' for term, prefix in query_terms(keyword)]
+    if not parts:
+        return None
+    strict, fuzzy = ' AND '.join(parts), ' OR '.join(parts)
+    tags = [f'c{int(category_id)}'] if category_id is not None else []
+    tags.extend(attribute_tag(k, v) for k, v in (attributes or {}).items())
+    if tags:
+        required = ' AND '.join(f'tags : "{tag}"' for tag in tags)
+        strict, fuzzy = (f'{required} AND ({q})' for q in (strict, fuzzy))
+    return strict, fuzzy
+
+
+def matches_all(item, terms: List[Tuple[str, bool]]) -> bool:
+    '''在内存中判断物品是否满足精确查询 (所有词条都出现)，规则与 FTS5 中的查询相同'''
+    item_terms = set(' '.join(document(item.name, item.description, item.owner_username)[:5]).split())
+    return all(term in item_terms or (prefix and any(t.startswith(term) for t in item_terms))
+               for term, prefix in terms)
+
+
+class PrefixCache:
+    '''
+    输入即搜索用的 LRU 结果缓存，键为 (搜索范围, 关键字)
+    关键字是某个已缓存关键字的延伸 (如 "蓝牙" → "蓝牙耳机") 时，延伸后每个词条都蕴含原来的某个词条，
+    精确匹配的物品必然在原来的结果中，因此直接在缓存的结果中过滤，不再查询数据库；
+    只有结果少于 limit 个 (包含了全部匹配) 的缓存项可以这样使用，过滤结果保持原来的相似度顺序；
+    过滤后没有精确匹配时仍查询数据库，由容错查询给出部分匹配的物品
+    数据修改后调用 clear()；clear() 之前发出的查询结果由 epoch 识别并丢弃
+    '''
+    def __init__(self, limit, capacity=32):
+        self.limit = limit
+        self.capacity = capacity
+        self.entries: 'OrderedDict[tuple, list]' = OrderedDict()
+        self.epoch = 0
+
+    def get(self, scope, keyword) -> Optional[list]:
+        '''返回缓存或由前缀结果过滤得到的物品列表，没有可用的缓存时返回 None'''
+        key = (scope, keyword)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        # 取最长的可用前缀
+        for prefix_len in range(len(keyword) - 1, 0, -1):
+            items = self.entries.get((scope, keyword[:prefix_len]))
+            if items is not None and len(items) < self.limit:
+                terms = query_terms(keyword)
+                if not terms:
+                    return None
+                result = [item for item in items if matches_all(item, terms)]
+                if not result:
+                    return None
+                self.put(scope, keyword, result, self.epoch)
+                return result
+        return None
+
+    def put(self, scope, keyword, items: list, epoch):
+        if epoch != self.epoch:
+            return
+        self.entries[(scope, keyword)] = items
+        self.entries.move_to_end((scope, keyword))
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.epoch += 1
+
+
+_INSERT = f'''
+    INSERT INTO {SEARCH_TABLE} (rowid, {', '.join(COLUMNS)}) VALUES (?, {', '.join('?' * len(COLUMNS))})
+'''
+
+
+def index_items(cursor, item_ids: Iterable[int]):
+    '''重新生成一批物品的索引行 (物品已不存在时只删除)，需在调用方的写事务中执行'''
+    item_ids = list(item_ids)
+    for start in range(0, len(item_ids), 500):
+        batch = item_ids[start:start + 500]
+        marks = ','.join('?' * len(batch))
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({marks})", batch)
+        cursor.execute(f'''
+            SELECT i.id, i.name, i.description, u.username, i.category_id, i.specific_attributes
+            FROM items i JOIN users u ON i.owner_id = u.id
+            WHERE i.id IN ({marks})
+        ''', batch)
+        rows = [(r[0],) + document(*r[1:]) for r in cursor.fetchall()]
+        cursor.executemany(_INSERT, rows)
+
+
+def remove_items(cursor, item_ids: Iterable[int]):
+    '''从索引中删除一批已不存在的物品 (仍存在的会被跳过)，需在调用方的写事务中执行'''
+    cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = ? AND NOT EXISTS (SELECT 1 FROM items WHERE id = ?)",
+                       [(item_id, item_id) for item_id in item_ids])
+
+
+def _write_all(conn, first_id, batch_size) -> int:
+    '''流式读取ID不小于 first_id 的物品，分批整批插入索引行，返回物品数'''
+    cursor = conn.cursor()
+    read = conn.execute('''
+        SELECT i.id, i.name, i.description, u.username, i.category_id, i.specific_attributes
+        FROM items i JOIN users u ON i.owner_id = u.id
+        WHERE i.id >= ?
+    ''', (first_id,))
+    total = 0
+    while True:
+        rows = read.fetchmany(batch_size)
+        if not rows:
+            break
+        cursor.executemany(_INSERT, [(r[0],) + document(*r[1:]) for r in rows])
+        total += len(rows)
+    return total
+
+
+def index_new_items(conn, first_id, batch_size=20000) -> int:
+    '''
+    为ID不小于 first_id 的物品一次生成索引行，返回物品数；需在调用方的写事务中执行
+    供整批导入延迟建立索引时在最后一批之后调用：比逐批调用 index_items 少了逐批的查找和删除，
+    该范围内已有的索引行 (导入期间经 ItemManager 创建或修改的物品) 先删除再重新生成
+    '''
+    conn.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid >= ?", (first_id,))
+    return _write_all(conn, first_id, batch_size)
+
+
+def rebuild(conn, batch_size=20000) -> int:
+    '''清空并按物品表重建整个索引，返回索引的物品数'''
+    conn.execute(f"DELETE FROM {SEARCH_TABLE}")
+    total = _write_all(conn, 0, batch_size)
+    optimize(conn.cursor())
+    return total
+
+
+def optimize(cursor):
+    '''合并 FTS5 的段，之后的查询只需读取少量 b-tree；适合在整批写入后调用'''
+    cursor.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建物品搜索索引")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--rebuild', action='store_true', help="清空并重建整个索引")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error("请指定 --rebuild")
+    database.DB_FILE = args.db
+    database.init_db()
+
+    start = time.perf_counter()
+    with database.write_transaction() as conn:
+        total = rebuild(conn)
+    pinyin = "含拼音" if lazy_pinyin is not None else "未安装 pypinyin，不含拼音"
+    print(f"已重建 {total} 个物品的搜索索引 ({pinyin})，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+'''
+相似物品推荐
+物品的名称和描述按与搜索索引相同的规则切分为词条 (中文二元组、英文整词，见 search_index.text_terms)，
+每个物品表示为 TF-IDF 向量 (名称中的词条按 NAME_WEIGHT 加权)，两个物品的相似度为向量的余弦相似度
+持久化：与搜索索引一样，在 ItemManager 创建、修改、删除和归档物品时于同一事务内更新 (整批导入时延迟到最后一批之后，见 index_new_items)
+    similar_terms: 词条 → 词条ID
+    item_vectors:  每个物品的词频向量，词条ID和词频分别打包为 int32、float32 数组；
+                   seq 自增且不重用，物品每次重新写入都得到新的 seq，进程据此增量载入
+查询 (需要可选依赖 numpy)：
+    进程内把所有向量按词条排列成稀疏矩阵 (CSC：同一词条的物品ID和权重连续存放)，首次查询时载入，
+    IDF 和向量长度按载入时的文档频率计算；之后新写入的向量作为增量，覆盖这些物品由矩阵算出的相似度，增量过多时重新载入
+    查询物品的各词条取出矩阵的对应列，numpy.bincount 按物品ID累加，一次得到与所有物品的相似度；
+    出现在超过 MAX_DF_RATIO (且不少于 MIN_DF_CUTOFF 个) 的物品中的常见词条 (如 "九成"、"成新") 几乎没有区分度，不参与计算
+未安装 numpy 时退化为用搜索索引查询名称、描述中有相同词条的物品，按 bm25 排序
+整批修改数据后可执行:
+    python similar.py --rebuild
+在只有几个物品的临时数据库上检查两种查询方式都能找到同款物品:
+    python similar.py --check
+'''
+import os
+import sys
+import math
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+import database
+import search_index
+
+try:
+    import numpy as np
+except ImportError:     # 相似度矩阵为可选功能
+    np = None
+
+TERMS_TABLE = 'similar_terms'
+VECTORS_TABLE = 'item_vectors'
+NAME_WEIGHT = 3.0           # 名称中的词条相对描述中的权重
+MAX_DF_RATIO = 0.05         # 文档频率超过物品数的这一比例的词条不参与计算
+MIN_DF_CUTOFF = 50          # 上述比例对应的物品数低于此值时按此值计，物品较少时同款物品共有的词条不会被当作常见词条
+MAX_DELTA = 1000            # 增量超过这么多个物品时重新载入矩阵
+
+
+def create_tables(cursor) -> bool:
+    '''创建词条表和向量表 (由 init_db 调用)，返回向量表是否为新建'''
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (VECTORS_TABLE,))
+    created = cursor.fetchone() is None
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {TERMS_TABLE} (
+            id INTEGER PRIMARY KEY,
+            term TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {VECTORS_TABLE} (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL UNIQUE,
+            terms BLOB NOT NULL,    -- int32 词条ID数组
+            weights BLOB NOT NULL   -- float32 词频数组，与 terms 一一对应
+        )
+    ''')
+    return created
+
+
+def term_frequencies(name, description) -> Dict[str, float]:
+    '''物品的词频 (名称中的词条按 NAME_WEIGHT 计)'''
+    tf = {}
+    for term in search_index.text_terms(name):
+        tf[term] = tf.get(term, 0.0) + NAME_WEIGHT
+    for term in search_index.text_terms(description):
+        tf[term] = tf.get(term, 0.0) + 1.0
+    return tf
+
+
+def _term_ids(cursor, terms) -> Dict[str, int]:
+    '''词条 → 词条ID，新词条在这里分配ID'''
+    terms = list(terms)
+    cursor.executemany(f"INSERT OR IGNORE INTO {TERMS_TABLE} (term) VALUES (?)", [(t,) for t in terms])
+    ids = {}
+    for start in range(0, len(terms), 500):
+        chunk = terms[start:start + 500]
+        cursor.execute(f"SELECT term, id FROM {TERMS_TABLE} WHERE term IN ({','.join('?' * len(chunk))})", chunk)
+        ids.update((r[0], r[1]) for r in cursor.fetchall())
+    return ids
+
+
+def _write_vectors(cursor, rows):
+    '''rows 为 [(物品ID, 名称, 描述)]，写入它们的词频向量'''
+    docs = [(r[0], term_frequencies(r[1], r[2])) for r in rows]
+    ids = _term_ids(cursor, {term for _, tf in docs for term in tf})
+    cursor.executemany(f"INSERT INTO {VECTORS_TABLE} (item_id, terms, weights) VALUES (?, ?, ?)", [
+        (item_id, array('i', [ids[t] for t in tf]).tobytes(), array('f', tf.values()).tobytes())
+        for item_id, tf in docs
+    ])
+
+
+def index_items(cursor, item_ids: Iterable[int]):
+    '''重新生成一批物品的向量 (物品已不存在时只删除)，需在调用方的写事务中执行'''
+    item_ids = list(item_ids)
+    for start in range(0, len(item_ids), 500):
+        batch = item_ids[start:start + 500]
+        marks = ','.join('?' * len(batch))
+        cursor.execute(f"DELETE FROM {VECTORS_TABLE} WHERE item_id IN ({marks})", batch)
+        cursor.execute(f"SELECT id, name, description FROM items WHERE id IN ({marks})", batch)
+        _write_vectors(cursor, cursor.fetchall())
+
+
+def remove_items(cursor, item_ids: Iterable[int]):
+    '''删除一批已不存在的物品的向量 (仍存在的会被跳过)，需在调用方的写事务中执行'''
+    cursor.executemany(f"DELETE FROM {VECTORS_TABLE} WHERE item_id = ? AND NOT EXISTS (SELECT 1 FROM items WHERE id = ?)",
+                       [(item_id, item_id) for item_id in item_ids])
+
+
+def _write_all(conn, first_id, batch_size) -> int:
+    '''流式读取ID不小于 first_id 的物品，分批写入向量，返回物品数'''
+    cursor = conn.cursor()
+    read = conn.execute("SELECT id, name, description FROM items WHERE id >= ?", (first_id,))
+    total = 0
+    while True:
+        rows = read.fetchmany(batch_size)
+        if not rows:
+            break
+        _write_vectors(cursor, rows)
+        total += len(rows)
+    return total
+
+
+def index_new_items(conn, first_id, batch_size=20000) -> int:
+    '''
+    为ID不小于 first_id 的物品一次写入向量，返回物品数；需在调用方的写事务中执行
+    供整批导入延迟建立索引时在最后一批之后调用，该范围内已有的向量先删除再重新写入 (得到新的 seq，进程会增量载入)
+    '''
+    conn.execute(f"DELETE FROM {VECTORS_TABLE} WHERE item_id >= ?", (first_id,))
+    return _write_all(conn, first_id, batch_size)
+
+
+def rebuild(conn, batch_size=20000) -> int:
+    '''清空并按物品表重建所有向量，返回物品数'''
+    conn.execute(f"DELETE FROM {VECTORS_TABLE}")
+    return _write_all(conn, 0, batch_size)
+
+
+class SimilarityMatrix:
+    '''
+    一个数据库的 TF-IDF 稀疏矩阵 (需要 numpy)
+    列 t 的物品ID和权重为 items[indptr[t]:indptr[t + 1]]、weights[...]，权重已乘以 IDF 并除以向量长度
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = None             # 已载入的最大 seq，None 表示尚未载入
+        self.delta: Dict[int, Dict[int, float]] = {}     # 载入后重新写入的物品 → {词条ID: 归一化权重}
+
+    def _load(self, conn):
+        cursor = conn.cursor()
+        cursor.row_factory = None   # 整表读取，元组比 sqlite3.Row 快一倍
+        rows = cursor.execute(f"SELECT seq, item_id, terms, weights FROM {VECTORS_TABLE}").fetchall()
+        counts = np.fromiter((len(r[2]) // 4 for r in rows), dtype=np.int64, count=len(rows))
+        terms = np.frombuffer(b''.join(r[2] for r in rows), dtype=np.int32)
+        tf = np.frombuffer(b''.join(r[3] for r in rows), dtype=np.float32)
+        item_ids = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+
+        self.docs = len(rows)
+        self.df = np.bincount(terms) if len(terms) else np.zeros(0, dtype=np.int64)
+        self.idf = np.log((1 + self.docs) / (1 + self.df)) + 1      # 平滑的 IDF，未出现过的词条 df 按 0 计
+        weights = tf * self.idf[terms]
+        doc = np.repeat(np.arange(len(rows)), counts)
+        norms = np.sqrt(np.bincount(doc, weights=weights * weights, minlength=len(rows)))
+        weights /= np.where(norms > 0, norms, 1.0)[doc]
+
+        # 词条ID不超过 65535 时 (常见情况) 按 uint16 排序，numpy 对它用基数排序，比 int32 的归并排序快数倍
+        order = np.argsort(terms.astype(np.uint16) if len(self.df) <= 1 << 16 else terms, kind='stable')
+        self.indptr = np.concatenate(([0], np.cumsum(self.df)))
+        self.items = item_ids[doc][order]
+        self.weights = weights[order]
+        self.max_item = int(item_ids.max()) if len(rows) else 0
+        self.seq = max((r[0] for r in rows), default=0)
+        self.delta = {}
+
+    def _idf(self, term) -> float:
+        return float(self.idf[term]) if term < len(self.idf) else math.log(1 + self.docs) + 1
+
+    def _normalize(self, terms: bytes, weights: bytes) -> Dict[int, float]:
+        vector = {t: w * self._idf(t) for t, w in zip(array('i', terms), array('f', weights))}
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {t: w / norm for t, w in vector.items()}
+
+    def refresh(self, conn):
+        '''载入之后新写入的向量加入增量；首次调用或增量过多时 (重新) 载入整个矩阵'''
+        if self.seq is not None:
+            rows = conn.execute(f"SELECT seq, item_id, terms, weights FROM {VECTORS_TABLE} WHERE seq > ? ORDER BY seq",
+                                (self.seq,)).fetchall()
+            for r in rows:
+                self.delta[r['item_id']] = self._normalize(r['terms'], r['weights'])
+                self.seq = r['seq']
+            if len(self.delta) <= MAX_DELTA:
+                return
+        self._load(conn)
+
+    def _vector(self, conn, item_id) -> Dict[int, float]:
+        if item_id in self.delta:
+            return self.delta[item_id]
+        row = conn.execute(f"SELECT terms, weights FROM {VECTORS_TABLE} WHERE item_id = ?", (item_id,)).fetchone()
+        return self._normalize(row['terms'], row['weights']) if row else {}
+
+    def similar(self, conn, item_id, limit) -> List[Tuple[int, float]]:
+        '''与物品最相似的至多 limit 个物品 [(物品ID, 余弦相似度)]，按相似度从高到低，不含物品自身'''
+        with self.lock:
+            self.refresh(conn)
+            max_df = max(MIN_DF_CUTOFF, MAX_DF_RATIO * self.docs)
+            query = {t: w for t, w in self._vector(conn, item_id).items()
+                     if t >= len(self.df) or self.df[t] <= max_df}
+            size = max(self.max_item, max(self.delta, default=0), item_id) + 1
+            columns = [t for t in query if t < len(self.df)]
+            if columns:
+                ids = np.concatenate([self.items[self.indptr[t]:self.indptr[t + 1]] for t in columns])
+                weights = np.concatenate([self.weights[self.indptr[t]:self.indptr[t + 1]] * query[t] for t in columns])
+                scores = np.bincount(ids, weights=weights, minlength=size)
+            else:
+                scores = np.zeros(size)
+            # 重新写入过的物品，矩阵中是旧的向量，用增量中的新向量重新计算
+            for other, vector in self.delta.items():
+                scores[other] = sum(w * vector.get(t, 0.0) for t, w in query.items())
+            scores[item_id] = 0.0
+            limit = min(limit, size)
+            top = np.argpartition(-scores, limit - 1)[:limit] if limit else []
+            return sorted(((int(i), float(scores[i])) for i in top if scores[i] > 0), key=lambda x: -x[1])
+
+
+_matrices: Dict[str, SimilarityMatrix] = {}
+_matrices_lock = threading.Lock()
+
+
+def _fts_similar(conn, item_id, limit) -> List[Tuple[int, float]]:
+    '''未安装 numpy 时：名称、描述中任一词条相同的物品 (在搜索索引的候选窗口内) 按 bm25 排序'''
+    row = conn.execute("SELECT name, description FROM items WHERE id = ?", (item_id,)).fetchone()
+    if not row:
+        return []
+    terms = list(term_frequencies(row['name'], row['description']))
+    if not terms:
+        return []
+    table = search_index.SEARCH_TABLE
+    query = '{name description} : (' + ' OR '.join(f'"{t}"' for t in terms) + ')'
+    rows = conn.execute(f'''
+        SELECT id, score FROM (
+            SELECT rowid AS id, bm25({table}, {', '.join(map(str, search_index.COLUMN_WEIGHTS))}) AS score
+            FROM {table} WHERE {table} MATCH ? AND rowid != ?
+            ORDER BY rowid DESC LIMIT {search_index.MAX_CANDIDATES}
+        ) ORDER BY score LIMIT ?
+    ''', (query, item_id, limit)).fetchall()
+    return [(r['id'], -r['score']) for r in rows]
+
+
+def find_similar(item_id, limit) -> List[Tuple[int, float]]:
+    '''与物品最相似的至多 limit 个物品 [(物品ID, 相似度)]，按相似度从高到低；结果可能包含已售出、已删除的物品，由调用方过滤'''
+    conn = database.get_db_connection()
+    try:
+        if np is None:
+            return _fts_similar(conn, item_id, limit)
+        with _matrices_lock:
+            matrix = _matrices.setdefault(database.DB_FILE, SimilarityMatrix())
+        return matrix.similar(conn, item_id, limit)
+    finally:
+        conn.close()
+
+
+def check() -> bool:
+    '''
+    小目录自检：临时数据库中 10 个物品，其中 3 个是同款降噪耳机，
+    矩阵查询 (有 numpy 时) 和搜索索引查询都应为第一个耳机推荐另外两个
+    '''
+    global np
+    workdir = tempfile.mkdtemp(prefix='similar_check_')
+    saved_db, saved_np = database.DB_FILE, np
+    database.DB_FILE = os.path.join(workdir, 'check.db')
+    try:
+        import models   # 延迟导入：models 在导入时会对 database.DB_FILE 执行 init_db
+        database.init_db()
+        user_manager = models.UserManager()
+        user_manager.register_user('similar_check', 'pw', '', '', '')
+        user_manager.approve_users(['similar_check'])
+        category = models.CategoryManager().get_all_categories()[0]
+        names = ['索尼降噪耳机 WH-1000XM4', '索尼 WH-1000XM4 降噪耳机 黑色', '索尼降噪耳机 WH1000XM4 九成新',
+                 '高等数学教材', '山地自行车', '宿舍小台灯', '篮球', '电饭煲', '机械键盘', '行李箱']
+        item_manager = models.ItemManager()
+        for name in names:
+            item_manager.create_item(name, name, 10.0, 0, '地点', '', '', category, 'similar_check', {})
+        conn = database.get_db_connection()
+        ids = [r['id'] for r in conn.execute("SELECT id FROM items ORDER BY id")]
+        conn.close()
+        ok = True
+        for mode in (['numpy'] if saved_np is not None else []) + ['fts']:
+            np = saved_np if mode == 'numpy' else None
+            found = [other for other, _ in find_similar(ids[0], 2)]
+            print(f"{mode}: {names[0]} → {[names[ids.index(i)] for i in found]}")
+            ok = ok and set(found) == set(ids[1:3])
+        return ok
+    finally:
+        np = saved_np
+        _matrices.pop(database.DB_FILE, None)
+        database.DB_FILE = saved_db
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重建相似物品的词频向量")
+    parser.add_argument('--db', default=database.DB_FILE)
+    parser.add_argument('--rebuild', action='store_true', help="清空并重建所有物品的向量")
+    parser.add_argument('--check', action='store_true', help="在临时数据库上检查相似物品查询")
+    args = parser.parse_args()
+    if args.check:
+        ok = check()
+        print("通过" if ok else "未通过")
+        sys.exit(0 if ok else 1)
+    if not args.rebuild:
+        parser.error("请指定 --rebuild 或 --check")
+    database.DB_FILE = args.db
+    database.init_db()
+
+    start = time.perf_counter()
+    with database.write_transaction() as conn:
+        total = rebuild(conn)
+    print(f"已重建 {total} 个物品的向量，用时 {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
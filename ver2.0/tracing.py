@@ -0,0 +1,181 @@
+'''
+界面延迟追踪
+记录从 Tk 事件触发到屏幕刷新的每一段耗时，定位界面卡顿发生在数据库、图片加载、控件构建还是渲染
+启用：设置环境变量 SECOND_HAND_TRACE=1 (写入 ui_trace.json) 或 SECOND_HAND_TRACE=<输出文件路径> 后启动 main.py，
+    退出时写出追踪文件；未启用时 span() 直接返回空上下文，traced 包装的函数只多一次判断
+实现：enable() 替换 tk.CallWrapper.__call__，每个顶层 Tk 回调 (按钮、事件绑定、after) 记为 ui 区间，
+    回调结束后的 update_idletasks 记为 render 区间；管理器方法 (trace_managers) 记为 db 区间，其余位置用 span/traced 标注，
+    disable() 恢复原来的回调分发
+输出：Chrome Trace Event 格式的 JSON (traceEvents 中的完整事件 ph='X'，时间单位微秒，附带线程名)，
+    可在 chrome://tracing 或 Perfetto 中打开；每个根区间的 args.self_time_ms 按类别汇总自身耗时
+'''
+import os
+import json
+import time
+import threading
+import functools
+import tkinter as tk
+from collections import defaultdict
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+
+# 全局追踪器，未启用时为 None，所有 span() 调用直接返回空上下文
+_tracer = None
+_NULL_SPAN = nullcontext()
+
+
+class _Span:
+    '''
+    一个计时区间
+    退出时计算自身耗时 (扣除子区间)，并按类别累加到所在调用链的根区间上
+    '''
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.child_us = 0.0
+        self.breakdown: Dict[str, float] = defaultdict(float)
+
+    def __enter__(self):
+        self.stack = self.tracer._stack()
+        self.stack.append(self)
+        self.start_us = self.tracer._now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        dur_us = self.tracer._now_us() - self.start_us
+        self.stack.pop()
+        root = self.stack[0] if self.stack else self
+        root.breakdown[self.cat] += dur_us - self.child_us
+        if self.stack:
+            self.stack[-1].child_us += dur_us
+
+        args = dict(self.args)
+        if root is self:
+            # 根区间附带耗时归因：各类别 (db / image / widget / render ...) 的自身耗时之和
+            args['self_time_ms'] = {cat: round(us / 1000, 3) for cat, us in self.breakdown.items()}
+        if exc_type is not None:
+            args['error'] = repr(exc)
+        self.tracer._emit({
+            'name': self.name, 'cat': self.cat, 'ph': 'X',
+            'ts': round(self.start_us, 3), 'dur': round(dur_us, 3),
+            'pid': self.tracer.pid, 'tid': threading.get_ident(), 'args': args,
+        })
+        return False
+
+
+class Tracer:
+    '''
+    界面延迟追踪器
+    记录 Chrome Trace Event 格式的完整事件 (ph='X')，可在 chrome://tracing 或 Perfetto 中打开
+    '''
+    def __init__(self, output_path='ui_trace.json'):
+        self.output_path = output_path
+        self.pid = os.getpid()
+        self.events: List[Dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self._thread_names: Dict[int, str] = {}
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1_000_000
+
+    def _stack(self) -> List[_Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _emit(self, event):
+        with self._lock:
+            self.events.append(event)
+            tid = event['tid']
+            if tid not in self._thread_names:
+                self._thread_names[tid] = threading.current_thread().name
+
+    def span(self, name, cat='app', args=None) -> _Span:
+        return _Span(self, name, cat, args or {})
+
+    def save(self, path=None):
+        '''写出 Chrome Trace JSON 文件'''
+        with self._lock:
+            meta = [{'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+                    for tid, name in self._thread_names.items()]
+            data = {'traceEvents': meta + self.events, 'displayTimeUnit': 'ms'}
+        with open(path or self.output_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+
+
+def span(name, cat='app', **args):
+    '''
+    在追踪模式下创建一个计时区间，否则返回空上下文
+    用法: with tracing.span("加载图片", "image", path=p): ...
+    '''
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, cat, args)
+
+
+def traced(cat='app', name=None):
+    '''将函数整体包装为一个区间的装饰器，未启用追踪时只多一次判断'''
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(span_name, cat):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_managers(*managers):
+    '''将管理器实例的公开方法包装为 db 类区间'''
+    for manager in managers:
+        owner = type(manager).__name__
+        for attr in dir(type(manager)):
+            if attr.startswith('_'):
+                continue
+            method = getattr(manager, attr)
+            if callable(method):
+                setattr(manager, attr, traced('db', f"{owner}.{attr}")(method))
+
+
+_original_callwrapper_call = tk.CallWrapper.__call__
+
+def _traced_callwrapper_call(self, *args):
+    '''
+    所有 Tk 回调 (按钮 command、事件绑定、after) 都经过 CallWrapper
+    在追踪模式下将每个顶层回调包装成 ui 区间，回调结束后执行 update_idletasks 并记为 render 区间，
+    从而覆盖"事件触发 → 数据库 → 图片 → 控件构建 → 屏幕刷新"的完整链路
+    '''
+    name = getattr(self.func, '__qualname__', repr(self.func))
+    is_root = not _tracer._stack()
+    with _tracer.span(name, 'ui'):
+        result = _original_callwrapper_call(self, *args)
+        if is_root and self.widget is not None:
+            with _tracer.span('update_idletasks', 'render'):
+                try:
+                    self.widget.update_idletasks()
+                except tk.TclError:
+                    pass    # 回调中销毁了控件 (如切换视图)
+    return result
+
+
+def enable(output_path='ui_trace.json') -> Tracer:
+    '''启用追踪：创建全局追踪器并接管 Tk 回调分发'''
+    global _tracer
+    _tracer = Tracer(output_path)
+    tk.CallWrapper.__call__ = _traced_callwrapper_call
+    return _tracer
+
+
+def disable() -> Optional[Tracer]:
+    '''停用追踪并恢复 Tk 回调分发，返回停用前的追踪器以便保存'''
+    global _tracer
+    tracer, _tracer = _tracer, None
+    tk.CallWrapper.__call__ = _original_callwrapper_call
+    return tracer